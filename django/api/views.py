@@ -15,7 +15,7 @@ from django.http import (
 )
 from django.views.decorators.csrf import csrf_exempt
 
-import operator_interface.tasks
+import operator_interface.outbox
 from operator_interface.models import Message, Conversation, ConversationPlatform
 
 
@@ -147,10 +147,6 @@ def send_message(request, customer_id):
                         pass
 
             if not platform:
-                if not conv:
-                    conv = Conversation(conversation_user_id=customer_id)
-                    conv.save()
-
                 formatted_num = phonenumbers.format_number(
                     mobile_numbers[0], phonenumbers.PhoneNumberFormat.E164
                 ) if len(mobile_numbers) else phonenumbers.format_number(
@@ -164,10 +160,11 @@ def send_message(request, customer_id):
                     platform_id = operator_interface.models.ConversationPlatform.AS207960
                     platform_rcpt_id = f"msisdn-messaging;{formatted_num}"
 
-                platform = ConversationPlatform(
+                platform = ConversationPlatform.create(
+                    platform_id,
+                    platform_rcpt_id,
+                    customer_user_id=customer_id,
                     conversation=conv,
-                    platform=platform_id,
-                    platform_id=platform_rcpt_id,
                     additional_platform_data=json.dumps({
                         "try_others": [phonenumbers.format_number(
                             n, phonenumbers.PhoneNumberFormat.E164
@@ -176,7 +173,6 @@ def send_message(request, customer_id):
                         ) for n in other_numbers]
                     })
                 )
-                platform.save()
             else:
                 platform.conversation.update_user_id(customer_id)
         else:
@@ -191,7 +187,6 @@ def send_message(request, customer_id):
         direction=Message.TO_CUSTOMER,
         message_id=uuid.uuid4(),
     )
-    message.save()
-    operator_interface.tasks.process_message.delay(message.id)
+    operator_interface.outbox.dispatch(message)
 
     return HttpResponse(json.dumps({"status": "ok"}), content_type="application/json")
@@ -1,21 +1,24 @@
+import contextlib
+import functools
 import json
 import logging
 import base64
+import typing
 import uuid
-import magic
 import os.path
-import urllib.parse
-import django_keycloak_auth.users
-import requests
 from celery import shared_task
 from django.conf import settings
 from io import BytesIO
 
 import operator_interface.consumers
+import operator_interface.delivery
+import operator_interface.media
+import operator_interface.outbox
 import operator_interface.tasks
+import operator_interface.users
 from django.shortcuts import reverse
-from operator_interface.models import ConversationPlatform, Message
-from django.core.files.storage import DefaultStorage
+from operator_interface.models import ConversationPlatform, MediaObject, Message
+import wewillfixyourpc_bot.http_client
 from django.utils import html
 from . import models
 
@@ -24,14 +27,16 @@ def send_blip_abc_request(mid, to, data):
     data = dict(to=to, **data)
     if mid:
         data["id"] = str(mid)
-    return requests.post(
+    return wewillfixyourpc_bot.http_client.post(
         "https://msging.net/messages",
         headers={"Authorization": f"Key {settings.BLIP_KEY}"},
         json=data,
     )
 
 
-def send_own_abc_request(mid, to: str, locale: str, contents: dict, files: [], auto_reply: bool = True):
+def send_own_abc_request(
+        mid, to: str, locale: str, contents: dict, files: typing.List[MediaObject], auto_reply: bool = True
+):
     data = {
         "to": to,
         "locale": locale,
@@ -40,18 +45,22 @@ def send_own_abc_request(mid, to: str, locale: str, contents: dict, files: [], a
     }
     if mid:
         data["id"] = str(mid)
-    return requests.post(
-        "https://abc.cardifftec.uk/api/message",
-        headers={"Authorization": f"Bearer {settings.ABC_KEY}"},
-        data={
-            "data": json.dumps(data)
-        },
-        files=[("file", f) for f in files]
-    )
+    with contextlib.ExitStack() as stack:
+        return wewillfixyourpc_bot.http_client.post(
+            "https://abc.cardifftec.uk/api/message",
+            headers={"Authorization": f"Bearer {settings.ABC_KEY}"},
+            data={
+                "data": json.dumps(data)
+            },
+            files=[
+                ("file", (f.name or os.path.basename(f.path), stack.enter_context(f.open()), f.content_type))
+                for f in files
+            ]
+        )
 
 
 def send_abc_notification(mid, to, event):
-    return requests.post(
+    return wewillfixyourpc_bot.http_client.post(
         "https://msging.net/messages",
         headers={"Authorization": f"Key {settings.BLIP_KEY}"},
         json={"id": mid, "from": to, "event": event},
@@ -84,8 +93,7 @@ def handle_abc_text(msg_id, msg_from, data):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
     send_abc_notification(msg_id, msg_from, "consumed")
 
 
@@ -97,15 +105,19 @@ def handle_abc_media(msg_id, msg_from, data):
     platform.save()
     if not Message.message_exits(platform, msg_id):
         if content.get("type", "").startswith("image/"):
+            image = content.get("uri")
+            try:
+                image = operator_interface.media.ingest_url(image).url
+            except operator_interface.media.MediaError as e:
+                logging.warning(f"Couldn't ingest ABC media, linking to the original: {e}")
             message_m: Message = Message(
                 platform=platform,
                 platform_message_id=msg_id,
-                image=content.get("uri"),
+                image=image,
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
             text = content.get("title", "").replace("￼", "")
             if text:
                 message_m: Message = Message(
@@ -115,8 +127,7 @@ def handle_abc_media(msg_id, msg_from, data):
                     direction=Message.FROM_CUSTOMER,
                     state=Message.DELIVERED,
                 )
-                message_m.save()
-                operator_interface.tasks.process_message.delay(message_m.id)
+                operator_interface.outbox.dispatch(message_m)
     send_abc_notification(msg_id, msg_from, "consumed")
 
 
@@ -157,7 +168,7 @@ def handle_abc_own(data: dict):
     info["current_capabilities"] = capabilities
 
     if conversation.conversation_user_id:
-        django_keycloak_auth.users.update_user(
+        operator_interface.users.update_user(
             str(conversation.conversation_user_id),
             locale=msg_locale,
             force_update=False,
@@ -175,8 +186,7 @@ def handle_abc_own(data: dict):
                 state=Message.DELIVERED,
                 device_data=device
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
         elif contents.get("action"):
             action: str = contents["action"]
             if action == "typing_start":
@@ -205,23 +215,25 @@ def handle_abc_own(data: dict):
     for attachment in data.get("attachments", []):
         contents: str = attachment.get("contents")
         name: str = attachment.get("name")
-        mime_type: str = attachment.get("mime-type")
         if contents:
             try:
                 contents: bytes = base64.b64decode(contents)
             except ValueError:
                 continue
-            fs = DefaultStorage()
-            file_name = fs.save(name, BytesIO(contents))
+            try:
+                media = operator_interface.media.ingest_file(BytesIO(contents), name)
+            except operator_interface.media.MediaError as e:
+                logging.warning(f"Couldn't ingest ABC attachment: {e}")
+                continue
 
-            if mime_type.startswith("image"):
+            if media.is_image:
                 m = Message(
                     platform=platform,
                     platform_message_id=msg_id,
                     direction=Message.FROM_CUSTOMER,
                     state=Message.DELIVERED,
                     device_data=device,
-                    image=fs.base_url + file_name
+                    image=media.url
                 )
             else:
                 m = Message(
@@ -230,10 +242,9 @@ def handle_abc_own(data: dict):
                     direction=Message.FROM_CUSTOMER,
                     state=Message.DELIVERED,
                     device_data=device,
-                    text=f"<a href=\"{fs.base_url + file_name}\" target=\"_blank\">{name}</a>",
+                    text=f"<a href=\"{media.url}\" target=\"_blank\">{html.conditional_escape(name)}</a>",
                 )
-            m.save()
-            operator_interface.tasks.process_message.delay(m.id)
+            operator_interface.outbox.dispatch(m)
 
 
 @shared_task
@@ -332,15 +343,18 @@ def send_message(mid: int):
         else:
             return
 
-        for msg_data in messages:
+        def send_part(msg_data):
             r = send_blip_abc_request(message.message_id, message.platform.platform_id, msg_data)
             if r.status_code != 202:
                 logging.error(f"Error sending ABC message: {r.status_code} {r.text}")
-                message.state = Message.FAILED
-                message.save()
-            else:
-                message.state = Message.DELIVERED
-                message.save()
+            r.raise_for_status()
+
+        operator_interface.delivery.send_parts(
+            message, [functools.partial(send_part, msg_data) for msg_data in messages]
+        )
+
+        message.state = Message.DELIVERED
+        message.save()
 
     elif settings.ABC_PLATFORM == "own":
         messages = []
@@ -393,16 +407,10 @@ def send_message(mid: int):
                 }, []))
 
         elif message.image:
-            orig_file_name = os.path.basename(
-                urllib.parse.urlparse(message.image).path
-            )
-            image = requests.get(message.image)
-            image.raise_for_status()
-            image = image.content
-            mime = magic.from_buffer(image, mime=True)
+            media = operator_interface.media.resolve(message.image)
             messages.append((message.message_id, {
                 "text": ""
-            }, [(orig_file_name, image, mime)]))
+            }, [media]))
         elif message.request == "sign_in":
             state = models.AccountLinkingState(conversation=message.platform)
             state.save()
@@ -425,15 +433,18 @@ def send_message(mid: int):
         else:
             return
 
-        for msg_data in messages:
+        def send_part(msg_data):
             r = send_own_abc_request(
                 msg_data[0], message.platform.platform_id, "en_GB", msg_data[1], msg_data[2],
                 auto_reply=message.user is None
             )
             if r.status_code != 200:
                 logging.error(f"Error sending ABC message: {r.status_code} {r.text}")
-                message.state = Message.FAILED
-                message.save()
-            else:
-                message.state = Message.DELIVERED
-                message.save()
+            r.raise_for_status()
+
+        operator_interface.delivery.send_parts(
+            message, [functools.partial(send_part, msg_data) for msg_data in messages]
+        )
+
+        message.state = Message.DELIVERED
+        message.save()
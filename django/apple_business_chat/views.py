@@ -2,7 +2,7 @@ from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbid
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
-import operator_interface.tasks
+import operator_interface.outbox
 from django.utils import timezone
 import datetime
 from . import tasks
@@ -103,8 +103,7 @@ def notif_webhook(request):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            m.save()
-            operator_interface.tasks.process_message.delay(m.id)
+            operator_interface.outbox.dispatch(m)
         if msg:
             msg.state = Message.FAILED
             msg.save()
@@ -164,8 +163,7 @@ def account_linking(request):
         text="Login complete, thanks!",
         direction=Message.TO_CUSTOMER,
     )
-    message.save()
-    operator_interface.tasks.process_message.delay(message.id)
+    operator_interface.outbox.dispatch(message)
 
     return HttpResponse(
         '<script type="text/javascript">window.close();</script><h1>You can now close this window</h1>'
@@ -1,19 +1,31 @@
+import functools
 import logging
 import requests
+import wewillfixyourpc_bot.http_client
 from celery import shared_task
 from django.conf import settings
 import mimetypes
 import django_keycloak_auth.clients
 import operator_interface.models
 import operator_interface.consumers
+import operator_interface.delivery
+import operator_interface.media
+import operator_interface.outbox
 import operator_interface.tasks
 from operator_interface.models import ConversationPlatform, Message
 from django.contrib.auth.models import User
 from django.utils import html
 
-oauth_client = django_keycloak_auth.clients.get_keycloak_client().open_id_connect(
-    settings.AS207960_OIDC_CLIENT_ID, settings.AS207960_OIDC_CLIENT_SECRET
-)
+_oauth_client = None
+
+
+def get_oauth_client():
+    global _oauth_client
+    if _oauth_client is None:
+        _oauth_client = django_keycloak_auth.clients.get_keycloak_client().open_id_connect(
+            settings.AS207960_OIDC_CLIENT_ID, settings.AS207960_OIDC_CLIENT_SECRET
+        )
+    return _oauth_client
 
 
 def send_as207960_request(mid, to: str, media_type: str, contents, representative=None):
@@ -28,7 +40,7 @@ def send_as207960_request(mid, to: str, media_type: str, contents, representativ
     }
     if mid:
         data["client_message_id"] = str(mid)
-    return requests.post(
+    return wewillfixyourpc_bot.http_client.post(
         f"https://messaging.as207960.net/api/brands/{settings.AS207960_BRAND_ID}/messages/",
         headers={"Authorization": f"X-AS207960-PAT {settings.AS207960_KEY}"},
         json=data,
@@ -41,7 +53,7 @@ def get_message_persona(user=None):
         try:
             if user.userprofile.as207960_persona_id is None:
                 profile = user.userprofile  # type: operator_interface.models.UserProfile
-                persona_r = requests.post(
+                persona_r = wewillfixyourpc_bot.http_client.post(
                     f"https://messaging.as207960.net/api/brands/{settings.AS207960_BRAND_ID}/representatives/",
                     headers={
                         "Authorization": f"X-AS207960-PAT {settings.AS207960_KEY}",
@@ -99,8 +111,7 @@ def handle_as207960_text(msg_id, msg_platform, msg_conv_id, metadata, content):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -109,26 +120,29 @@ def handle_as207960_file(msg_id, msg_platform, msg_conv_id, metadata, content):
     platform.is_typing = False
     platform.save()
     if not Message.message_exits(platform, msg_id):
+        url = content.get("url")
+        try:
+            url = operator_interface.media.ingest_url(url).url
+        except operator_interface.media.MediaError as e:
+            logging.warning(f"Couldn't ingest AS207960 file, linking to the original: {e}")
         if content.get("media_type", "").startswith("image/"):
             message_m: Message = Message(
                 platform=platform,
                 platform_message_id=msg_id,
-                image=content.get("url"),
+                image=url,
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
         else:
             message_m: Message = Message(
                 platform=platform,
                 platform_message_id=msg_id,
-                text=content.get("url"),
+                text=url,
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -160,6 +174,7 @@ def handle_as207960_chatstate(msg_id, msg_platform, msg_conv_id, metadata, conte
 @shared_task
 def handle_as207960_oauth_code(msg_id, msg_platform, msg_conv_id, metadata, content):
     platform = get_platform(msg_platform, msg_conv_id, metadata)
+    oauth_client = get_oauth_client()
     token_response = oauth_client.authorization_code(
         code=content, redirect_uri="https://messaging.as207960.net/brand_oauth/redirect/"
     )
@@ -176,8 +191,7 @@ def handle_as207960_oauth_code(msg_id, msg_platform, msg_conv_id, metadata, cont
         text="Login complete, thanks!",
         direction=Message.TO_CUSTOMER,
     )
-    message.save()
-    operator_interface.tasks.process_message.delay(message.id)
+    operator_interface.outbox.dispatch(message)
 
 
 @shared_task
@@ -227,15 +241,19 @@ def send_message(mid: int):
     else:
         return
 
-    for msg_data in messages:
+    def send_part(msg_data):
         r = send_as207960_request(
             msg_data[0], message.platform.platform_id, msg_data[1], msg_data[2],
             representative=persona_id
         )
         if r.status_code != 201:
             logging.error(f"Error sending AS207960 message: {r.status_code} {r.text}")
-            message.state = Message.FAILED
-            message.save()
-        else:
-            message.state = Message.DELIVERED
-            message.save()
+            r.raise_for_status()
+            raise requests.exceptions.HTTPError(f"Unexpected status {r.status_code}", response=r)
+
+    operator_interface.delivery.send_parts(
+        message, [functools.partial(send_part, msg_data) for msg_data in messages]
+    )
+
+    message.state = Message.DELIVERED
+    message.save()
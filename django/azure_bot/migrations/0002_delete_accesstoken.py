@@ -0,0 +1,16 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='AccessToken',
+        ),
+    ]
@@ -1,17 +1,16 @@
-import datetime
 import json
 import logging
 import dateutil.parser
 
-import requests
 from celery import shared_task
 from django.conf import settings
-from django.utils import timezone
 
 import operator_interface.consumers
+import operator_interface.outbox
 import operator_interface.tasks
 from operator_interface.models import Conversation, Message
-from . import models
+import wewillfixyourpc_bot.http_client
+import wewillfixyourpc_bot.token_cache
 
 
 def event_to_conversation(msg):
@@ -33,20 +32,8 @@ def event_to_conversation(msg):
     return conversation
 
 
-def get_access_token():
-    tokens = models.AccessToken.objects.all()
-    valid_tokens = []
-
-    for token in tokens:
-        if token.expires_at <= timezone.now():
-            token.delete()
-        else:
-            valid_tokens.append(token.token)
-
-    if len(valid_tokens):
-        return valid_tokens.pop()
-
-    r = requests.post(
+def _fetch_access_token() -> dict:
+    r = wewillfixyourpc_bot.http_client.post(
         "https://login.microsoftonline.com/botframework.com/oauth2/v2.0/token",
         data={
             "grant_type": "client_credentials",
@@ -56,13 +43,11 @@ def get_access_token():
         },
     )
     r.raise_for_status()
-    data = r.json()
+    return r.json()
 
-    token = models.AccessToken(token=data["access_token"])
-    token.expires_at = timezone.now() + datetime.timedelta(seconds=data["expires_in"])
-    token.save()
 
-    return token.token
+def get_access_token() -> str:
+    return wewillfixyourpc_bot.token_cache.get_token("azure", _fetch_access_token)
 
 
 @shared_task
@@ -86,8 +71,7 @@ def handle_azure_message(msg):
         else:
             return
 
-        message_m.save()
-        operator_interface.tasks.process_message.delay(message_m.id)
+        operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -124,7 +108,7 @@ def send_azure_message(mid):
 
     endpoint = f"{additional_id['endpoint']}/v3/conversations/{message.conversation.platform_id}/activities"
 
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         endpoint,
         headers={"Authorization": f"Bearer {access_token}"},
         json={
@@ -137,7 +121,12 @@ def send_azure_message(mid):
     )
     if r.status_code != 200:
         logging.error(f"Error sending azure message: {r.status_code} {r.text}")
-        requests.post(
+        if r.status_code == 401:
+            wewillfixyourpc_bot.token_cache.invalidate("azure")
+        if r.status_code == 429 or r.status_code >= 500:
+            # Transient, so leave it to the outbound retries rather than apologising to the customer
+            r.raise_for_status()
+        wewillfixyourpc_bot.http_client.post(
             endpoint,
             headers={"Authorization": f"Bearer {access_token}"},
             json={
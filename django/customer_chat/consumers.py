@@ -1,90 +1,172 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.layers import get_channel_layer
-from django.conf import settings
-from django.shortcuts import reverse
-from django.utils import html
+from django.utils import html, timezone
 import typing
 import json
 import re
+import operator_interface.consumers
 import operator_interface.models
-import operator_interface.tasks
+import operator_interface.outbox
+import operator_interface.profile_pictures
+import operator_interface.serializers
 
 channel_layer = get_channel_layer()
 
 
-class ChatConsumer(JsonWebsocketConsumer):
+def serialize_message(message: operator_interface.models.Message) -> dict:
+    urls = re.findall(
+        "(http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+)",
+        message.text,
+    )
+
+    buttons = []
+    if len(urls):
+        buttons.append({"text": "Open link", "type": "url", "url": urls[0]})
+
+    return {
+        "type": "message",
+        "id": message.id,
+        "mid": str(message.message_id),
+        "direction": message.direction,
+        "timestamp": int(message.timestamp.timestamp()),
+        "text": message.text,
+        "image": message.image,
+        "state": message.state,
+        "request": message.request,
+        "sent_by": message.user.first_name if message.user else None,
+        "profile_picture_url": operator_interface.profile_pictures.url(message.user)
+        if message.user
+        else None,
+        "selection": message.selection,
+        "card": message.card,
+        "buttons": buttons,
+        "cursor": operator_interface.serializers.to_cursor(message.updated_at),
+    }
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.platform = (
             None
         )  # type: typing.Union[operator_interface.models.ConversationPlatform, None]
 
-    def close(self, code=None):
-        return super().close(code)
-
-    def message(self, event):
-        message: operator_interface.models.Message = operator_interface.models.Message.objects.get(
-            id=event.get("mid")
+    async def message(self, event):
+        messages, delta = await database_sync_to_async(self.deliver_messages)(
+            [event.get("mid")]
         )
-        self.send_message(message)
-        self.send_conversation(message.platform)
-        message.state = operator_interface.models.Message.DELIVERED
-        message.save()
+        for message in messages:
+            await self.send_json(message)
+        await self.send_json(delta)
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
         if self.platform:
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 f"customer_chat_{self.platform.id}", self.channel_name
             )
 
-    def send_message(self, message: operator_interface.models.Message):
-        urls = re.findall(
-            "(http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+)",
-            message.text,
+    async def send_error(self, error: str):
+        await self.send_json({"type": "error", "msg": error})
+
+    def get_messages(self, **filters) -> typing.List[operator_interface.models.Message]:
+        return list(
+            self.platform.messages.filter(**filters)
+            .select_related("user")
+            .order_by("timestamp")
         )
 
-        buttons = []
-        if len(urls):
-            buttons.append({"text": "Open link", "type": "url", "url": urls[0]})
-
-        self.send_json(
-            {
-                "type": "message",
-                "id": message.id,
-                "mid": str(message.message_id),
-                "direction": message.direction,
-                "timestamp": int(message.timestamp.timestamp()),
-                "text": message.text,
-                "image": message.image,
-                "state": message.state,
-                "request": message.request,
-                "sent_by": message.user.first_name if message.user else None,
-                "profile_picture_url": settings.EXTERNAL_URL_BASE
-                + reverse("operator:profile_pic", args=[message.user.id])
-                if message.user
-                else None,
-                "selection": message.selection,
-                "card": message.card,
-                "buttons": buttons,
-            }
+    def mark_delivered(self, messages: typing.List[operator_interface.models.Message]):
+        undelivered = {
+            m.id for m in messages
+            if m.direction == operator_interface.models.Message.TO_CUSTOMER
+            and m.state == operator_interface.models.Message.SENDING
+        }
+        if not undelivered:
+            return
+
+        operator_interface.models.Message.objects.filter(
+            id__in=undelivered, state=operator_interface.models.Message.SENDING
+        ).update(state=operator_interface.models.Message.DELIVERED, updated_at=timezone.now())
+        for message in messages:
+            if message.id in undelivered:
+                message.state = operator_interface.models.Message.DELIVERED
+        operator_interface.consumers.schedule_events(*(
+            (operator_interface.consumers.MESSAGE_UPDATE, mid) for mid in undelivered
+        ))
+
+    def make_delta(self, messages: typing.List[operator_interface.models.Message]) -> dict:
+        conversation = operator_interface.models.Conversation.objects.select_related(
+            "current_agent"
+        ).get(id=self.platform.conversation_id)
+        return {
+            "type": "conversation_delta",
+            "current_agent": conversation.current_agent.first_name
+            if conversation.current_agent
+            else None,
+            "messages": [m.id for m in messages],
+        }
+
+    def deliver_messages(self, ids: typing.List[int]):
+        messages = self.get_messages(id__in=ids)
+        self.mark_delivered(messages)
+        return [serialize_message(m) for m in messages], self.make_delta(messages)
+
+    def get_missed_messages(self, last_seen: int):
+        """Returns the messages changed since last_seen and a delta, or None when there are more
+        than MAX_RESYNC_CHANGES and the client should be sent the whole conversation instead."""
+        cursor = operator_interface.serializers.to_cursor(timezone.now())
+        messages = list(
+            self.platform.messages.filter(
+                updated_at__gte=operator_interface.serializers.from_cursor(last_seen)
+                - operator_interface.serializers.RESYNC_OVERLAP
+            )
+            .select_related("user")
+            .order_by("timestamp")[:operator_interface.serializers.MAX_RESYNC_CHANGES + 1]
         )
+        if len(messages) > operator_interface.serializers.MAX_RESYNC_CHANGES:
+            return None
+        self.mark_delivered(messages)
+        return [serialize_message(m) for m in messages], {
+            **self.make_delta(messages),
+            "cursor": cursor,
+        }
+
+    def get_conversation(self) -> dict:
+        cursor = operator_interface.serializers.to_cursor(timezone.now())
+        conversation = operator_interface.models.Conversation.objects.select_related(
+            "current_agent"
+        ).get(id=self.platform.conversation_id)
+        messages = self.get_message_page()
+        return {
+            "type": "conversation",
+            "current_agent": conversation.current_agent.first_name
+            if conversation.current_agent
+            else None,
+            "messages": messages,
+            "messages_before": messages[0]
+            if len(messages) == operator_interface.serializers.MESSAGE_WINDOW
+            else None,
+            "cursor": cursor,
+        }
+
+    def get_message_page(self, before: typing.Optional[int] = None) -> typing.List[int]:
+        messages = self.platform.messages.all()
+        if before is not None:
+            messages = messages.filter(operator_interface.serializers.before_message(before))
+        page = messages.order_by("-timestamp", "-id").values_list("id", flat=True)[
+            : operator_interface.serializers.MESSAGE_WINDOW
+        ]
+        return list(reversed(page))
 
-    def send_error(self, error: str):
-        self.send_json({"type": "error", "msg": error})
-
-    def send_conversation(
-        self, platform: operator_interface.models.ConversationPlatform
-    ):
-        conversation = platform.conversation
-        self.send_json(
-            {
-                "type": "conversation",
-                "current_agent": conversation.current_agent.first_name
-                if conversation.current_agent
-                else None,
-                "messages": [m.id for m in platform.messages.all()],
-            }
+    def get_message(self, msg_id: int) -> typing.Optional[dict]:
+        message = self.platform.messages.select_related("user").filter(id=msg_id).first()
+        return serialize_message(message) if message else None
+
+    def get_platform(self, token: str) -> operator_interface.models.ConversationPlatform:
+        return operator_interface.models.ConversationPlatform.objects.get(
+            platform=operator_interface.models.ConversationPlatform.CHAT,
+            platform_id=token,
         )
 
     def recv_message(self, content, mid):
@@ -95,10 +177,21 @@ class ChatConsumer(JsonWebsocketConsumer):
             state=operator_interface.models.Message.DELIVERED,
             message_id=mid,
         )
-        message.save()
-        operator_interface.tasks.process_message.delay(message.id)
-        self.send_message(message)
-        self.send_conversation(message.platform)
+        operator_interface.outbox.dispatch(message)
+        return serialize_message(message), self.make_delta([message])
+
+    def read_message(self, msg_id):
+        try:
+            msg = operator_interface.models.Message.objects.get(id=msg_id)
+            if (
+                msg.direction == operator_interface.models.Message.TO_CUSTOMER
+                and msg.platform_id == self.platform.id
+                and msg.state != operator_interface.models.Message.READ
+            ):
+                msg.state = operator_interface.models.Message.READ
+                msg.save()
+        except operator_interface.models.Message.DoesNotExist:
+            pass
 
     def register_push(self, msg):
         if not (msg.get("endpoint") and msg.get("keys")):
@@ -126,7 +219,7 @@ class ChatConsumer(JsonWebsocketConsumer):
         self.platform.additional_platform_data = json.dumps(data)
         self.platform.save()
 
-    def receive_json(self, message, **kwargs):
+    async def receive_json(self, message, **kwargs):
         msg_type = message.get("type")
         if self.platform is None and msg_type != "resyncReq":
             return
@@ -135,42 +228,52 @@ class ChatConsumer(JsonWebsocketConsumer):
             token = message["token"]
 
             try:
-                platform = operator_interface.models.ConversationPlatform.objects.get(
-                    platform=operator_interface.models.ConversationPlatform.CHAT,
-                    platform_id=token,
-                )
+                platform = await database_sync_to_async(self.get_platform)(token)
             except operator_interface.models.ConversationPlatform.DoesNotExist:
-                self.close()
+                await self.close()
                 return
             self.platform = platform
 
-            async_to_sync(self.channel_layer.group_add)(
+            await self.channel_layer.group_add(
                 f"customer_chat_{platform.id}", self.channel_name
             )
-            self.send_conversation(platform)
+
+            last_seen = message.get("last_seen")
+            if last_seen is None:
+                await self.send_json(await database_sync_to_async(self.get_conversation)())
+            else:
+                missed = await database_sync_to_async(self.get_missed_messages)(last_seen)
+                if missed is None:
+                    await self.send_json(await database_sync_to_async(self.get_conversation)())
+                    return
+                messages, delta = missed
+                for msg in messages:
+                    await self.send_json(msg)
+                await self.send_json(delta)
         elif msg_type == "sendMessage":
             content = message["content"]
             mid = message["id"]
-            self.recv_message(content, mid)
+            msg, delta = await database_sync_to_async(self.recv_message)(content, mid)
+            await self.send_json(msg)
+            await self.send_json(delta)
         elif msg_type == "readMessage":
-            msg_id = message["id"]
-            try:
-                msg = operator_interface.models.Message.objects.get(id=msg_id)
-                if (
-                    msg.direction == operator_interface.models.Message.TO_CUSTOMER
-                    and msg.platform_id == self.platform.id
-                ):
-                    msg.state = operator_interface.models.Message.READ
-                    msg.save()
-            except operator_interface.models.Message.DoesNotExist:
-                pass
+            await database_sync_to_async(self.read_message)(message["id"])
         elif msg_type == "getMessage":
-            msg_id = message["id"]
-            try:
-                msg = operator_interface.models.Message.objects.get(id=msg_id)
-                if msg.platform_id == self.platform.id:
-                    self.send_message(msg)
-            except operator_interface.models.Message.DoesNotExist:
-                pass
+            msg = await database_sync_to_async(self.get_message)(message["id"])
+            if msg:
+                await self.send_json(msg)
+        elif msg_type == "getMessagePage":
+            before = message["before"]
+            messages = await database_sync_to_async(self.get_message_page)(before)
+            await self.send_json(
+                {
+                    "type": "message_page",
+                    "before": before,
+                    "messages": messages,
+                    "messages_before": messages[0]
+                    if len(messages) == operator_interface.serializers.MESSAGE_WINDOW
+                    else None,
+                }
+            )
         elif msg_type == "pushSubscription":
-            self.register_push(message["data"])
+            await database_sync_to_async(self.register_push)(message["data"])
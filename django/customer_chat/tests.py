@@ -1,3 +1,82 @@
+import datetime
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
 from django.test import TestCase
+from django.utils import timezone
+
+import operator_interface.models
+import operator_interface.serializers
+from . import consumers
+
+Message = operator_interface.models.Message
+
+
+class ChatConsumerTestCase(TestCase):
+    def setUp(self):
+        conversation = operator_interface.models.Conversation.objects.create()
+        self.platform = operator_interface.models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=operator_interface.models.ConversationPlatform.CHAT,
+            platform_id="token",
+        )
+        self.seen = Message.objects.create(
+            platform=self.platform, direction=Message.TO_CUSTOMER, text="Seen"
+        )
+        Message.objects.filter(id=self.seen.id).update(
+            updated_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.last_seen = operator_interface.serializers.to_cursor(timezone.now())
+        self.missed = [
+            Message.objects.create(
+                platform=self.platform, direction=Message.TO_CUSTOMER, text=f"Missed {i}"
+            )
+            for i in range(2)
+        ]
+
+    @async_to_sync
+    async def resync(self, last_seen=None):
+        communicator = WebsocketCommunicator(consumers.ChatConsumer.as_asgi(), "/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(
+            {"type": "resyncReq", "token": "token", "last_seen": last_seen}
+        )
+        responses = [await communicator.receive_json_from()]
+        while responses[-1]["type"] == "message":
+            responses.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return responses
+
+    def test_full_sync(self):
+        conversation, = self.resync()
+
+        self.assertEqual(conversation["type"], "conversation")
+        self.assertEqual(
+            conversation["messages"], [self.seen.id] + [m.id for m in self.missed]
+        )
+        self.assertIsNone(conversation["messages_before"])
+
+    def test_resume_from_last_seen(self):
+        *messages, delta = self.resync(self.last_seen)
+
+        missed_ids = [m.id for m in self.missed]
+        self.assertEqual([m["id"] for m in messages], missed_ids)
+        self.assertEqual(delta["type"], "conversation_delta")
+        self.assertEqual(delta["messages"], missed_ids)
+        self.assertEqual(
+            list(Message.objects.filter(id__in=missed_ids).values_list("state", flat=True)),
+            [Message.DELIVERED] * 2,
+        )
+        self.assertEqual(Message.objects.get(id=self.seen.id).state, Message.SENDING)
+
+    def test_too_many_missed_sends_conversation(self):
+        with mock.patch("operator_interface.serializers.MAX_RESYNC_CHANGES", 1):
+            conversation, = self.resync(self.last_seen)
 
-# Create your tests here.
+        self.assertEqual(conversation["type"], "conversation")
+        self.assertEqual(
+            conversation["messages"], [self.seen.id] + [m.id for m in self.missed]
+        )
+        self.assertFalse(Message.objects.filter(state=Message.DELIVERED).exists())
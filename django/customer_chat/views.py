@@ -1,6 +1,7 @@
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
 from django.urls import reverse
 from django.shortcuts import render
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
@@ -22,27 +23,17 @@ def config(request):
         token = None
         user_profile = None
         if request.user.is_authenticated:
-            try:
-                conversation = operator_interface.models.Conversation.objects.get(
-                    conversation_user_id=request.user.username
+            platform = operator_interface.models.ConversationPlatform.objects.filter(
+                conversation__conversation_user_id=request.user.username,
+                platform=operator_interface.models.ConversationPlatform.CHAT,
+            ).first()
+            if platform is None:
+                platform = operator_interface.models.ConversationPlatform.create(
+                    operator_interface.models.ConversationPlatform.CHAT,
+                    secrets.token_urlsafe(64),
+                    customer_user_id=request.user.username,
                 )
-            except operator_interface.models.Conversation.DoesNotExist:
-                conversation = operator_interface.models.Conversation(
-                    conversation_user_id=request.user.username
-                )
-                conversation.save()
-
-            try:
-                platform = conversation.conversationplatform_set.get(
-                    platform=operator_interface.models.ConversationPlatform.CHAT
-                )
-            except operator_interface.models.ConversationPlatform.DoesNotExist:
-                platform = operator_interface.models.ConversationPlatform(
-                    conversation=conversation,
-                    platform=operator_interface.models.ConversationPlatform.CHAT,
-                    platform_id=secrets.token_urlsafe(64),
-                )
-                platform.save()
+            conversation = platform.conversation
 
             token = platform.platform_id
             user_profile = {"name": request.user.first_name, "is_authenticated": True}
@@ -66,12 +57,17 @@ def config(request):
                             },
                         )
                         msgs = old_platform.messages.all()
-                        msgs.update(platform=platform)
+                        msgs.update(platform=platform, updated_at=timezone.now())
                         old_platform.conversation.conversationplatform_set.all().update(
                             conversation=conversation
                         )
                         old_platform.conversation.delete()
                         old_platform.delete()
+                        operator_interface.models.refresh_activity(
+                            operator_interface.models.Conversation.objects.filter(
+                                id=conversation.id
+                            )
+                        )
                     except operator_interface.models.ConversationPlatform.DoesNotExist:
                         pass
 
@@ -105,16 +101,11 @@ def config(request):
         if request.user.is_authenticated:
             return HttpResponseBadRequest()
 
-        conversation = operator_interface.models.Conversation(
-            conversation_name=request.POST.get("name", "Unknown")
-        )
-        conversation.save()
-        platform = operator_interface.models.ConversationPlatform(
-            conversation=conversation,
-            platform=operator_interface.models.ConversationPlatform.CHAT,
-            platform_id=secrets.token_urlsafe(64),
+        platform = operator_interface.models.ConversationPlatform.create(
+            operator_interface.models.ConversationPlatform.CHAT,
+            secrets.token_urlsafe(64),
+            conversation_name=request.POST.get("name", "Unknown"),
         )
-        platform.save()
         request.session["chat_session_token"] = platform.platform_id
 
         return HttpResponse(
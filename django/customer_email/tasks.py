@@ -6,7 +6,10 @@ import typing
 import email.parser
 import email.policy
 import django_keycloak_auth.users
-import operator_interface.tasks
+import operator_interface.delivery
+import operator_interface.outbox
+import operator_interface.profile_pictures
+import operator_interface.users
 from . import models
 from django.shortcuts import reverse
 from django.utils import html
@@ -17,22 +20,25 @@ from sendgrid.helpers.mail import Mail, Header
 import html2text
 
 
-sg = SendGridAPIClient(settings.SENDGRID_KEY)
+_sg = None
+
+
+def get_sendgrid_client() -> SendGridAPIClient:
+    global _sg
+    if _sg is None:
+        _sg = SendGridAPIClient(settings.SENDGRID_KEY)
+    return _sg
 
 
 def attempt_get_user_id(
     msg_from: email.headerregistry.UniqueAddressHeader,
 ) -> typing.Optional[str]:
-    def match_user(u):
-        usr_email = u.user.get("email", "")
-        for address in msg_from.addresses:
-            if address.addr_spec == usr_email:
-                return True
+    for address in msg_from.addresses:
+        user_id = operator_interface.users.get_user_id_by_email(address.addr_spec)
+        if user_id:
+            return user_id
 
-        return False
-
-    user = next(filter(match_user, django_keycloak_auth.users.get_users()), None)
-    return user.user.get("id") if user else None
+    return None
 
 
 def get_platform(msg_from: email.headerregistry.UniqueAddressHeader):
@@ -122,7 +128,7 @@ def handle_email(
     customer_name = msg_from.addresses[0].display_name.split(" ")
 
     if not platform.conversation.conversation_user_id:
-        kc_user = django_keycloak_auth.users.get_or_create_user(
+        kc_user = operator_interface.users.get_or_create_user(
             email=msg_from.addresses[0].addr_spec,
             email_verifed=True,
             last_name=customer_name[-1],
@@ -136,7 +142,7 @@ def handle_email(
             platform.conversation.update_user_id(kc_user.get("id"))
 
     if platform.conversation.conversation_user_id:
-        django_keycloak_auth.users.update_user(
+        operator_interface.users.update_user(
             str(platform.conversation.conversation_user_id),
             last_name=customer_name[-1],
             first_name=" ".join(customer_name[:-1]),
@@ -153,8 +159,7 @@ def handle_email(
             state=Message.DELIVERED,
             device_data=msg_device,
         )
-        message_m.save()
-        operator_interface.tasks.process_message.delay(message_m.id)
+        operator_interface.outbox.dispatch(message_m)
 
         for img in attachments_img:
             message_m: Message = Message(
@@ -165,8 +170,7 @@ def handle_email(
                 state=Message.DELIVERED,
                 device_data=msg_device,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
         for link in attachments_other:
             message_m: Message = Message(
@@ -177,8 +181,7 @@ def handle_email(
                 state=Message.DELIVERED,
                 device_data=msg_device,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -212,9 +215,7 @@ def send_message(mid: int):
     message_content = render_to_string("emails/message.html", {
         "content": linebreaksbr(msg_content),
         "sender_name": message.user.first_name if message.user else None,
-        "sender_pic": settings.EXTERNAL_URL_BASE + reverse("operator:profile_pic", args=[
-            message.user.id
-        ]) if message.user else None,
+        "sender_pic": operator_interface.profile_pictures.url(message.user) if message.user else None,
         "attachments": msg_attachments
     })
 
@@ -231,11 +232,7 @@ def send_message(mid: int):
     email_msg.add_header(Header("References", references))
     email_msg.add_header(Header("In-Reply-To", last_message.platform_message_id))
     email_msg.add_header(Header("Message-Id", msg_id))
-    try:
-        sg.send(email_msg)
-        message.state = Message.DELIVERED
-        message.platform_message_id = msg_id
-        message.save()
-    except Exception:
-        message.state = Message.FAILED
-        message.save()
+    operator_interface.delivery.send_parts(message, [lambda: get_sendgrid_client().send(email_msg)])
+    message.state = Message.DELIVERED
+    message.platform_message_id = msg_id
+    message.save()
@@ -1,27 +1,27 @@
 import datetime
 import json
 import logging
-import os.path
 import re
 import typing
-import urllib.parse
 import uuid
 import jwt.exceptions
-from io import BytesIO
 
 import django_keycloak_auth.users
-import requests
 from celery import shared_task
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.files.storage import DefaultStorage
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.shortcuts import reverse
-from django.utils import html
+from django.utils import html, timezone
 
 import operator_interface.consumers
+import operator_interface.media
+import operator_interface.outbox
+import operator_interface.profile_pictures
+import operator_interface.profile_refresh
 import operator_interface.tasks
+import operator_interface.users
 from operator_interface.models import Conversation, ConversationPlatform, Message
+import wewillfixyourpc_bot.http_client
 
 
 @shared_task
@@ -42,7 +42,7 @@ def handle_facebook_message(psid: dict, message: dict, timestamp: int) -> None:
         )
     message_m: typing.Optional[Message] = None
     if not is_echo:
-        update_facebook_profile(psid, platform.conversation.id)
+        schedule_profile_refresh(psid, platform.conversation.id)
         if not Message.message_exits(platform, mid):
             handle_mark_facebook_message_read.delay(psid)
             if text:
@@ -60,38 +60,36 @@ def handle_facebook_message(psid: dict, message: dict, timestamp: int) -> None:
                     att_type: typing.Text = attachment.get("type")
                     if att_type == "image" or att_type == "file":
                         url = payload.get("url")
-                        r = requests.get(url)
-                        if r.status_code == 200:
-                            orig_file_name = os.path.basename(
-                                urllib.parse.urlparse(url).path
+                        try:
+                            media = operator_interface.media.ingest_url(url)
+                        except operator_interface.media.MediaError as e:
+                            logging.warning(f"Couldn't ingest Facebook attachment: {e}")
+                            continue
+
+                        if att_type == "image":
+                            message_m = Message(
+                                platform=platform,
+                                platform_message_id=mid,
+                                image=media.url,
+                                direction=Message.FROM_CUSTOMER,
+                                state=Message.DELIVERED,
+                                timestamp=datetime.datetime.fromtimestamp(
+                                    timestamp / 1000
+                                ),
+                            )
+                        else:
+                            message_m = Message(
+                                platform=platform,
+                                platform_message_id=mid,
+                                direction=Message.FROM_CUSTOMER,
+                                state=Message.DELIVERED,
+                                timestamp=datetime.datetime.fromtimestamp(
+                                    timestamp / 1000
+                                ),
+                                text=f'<a href="{media.url}" target="_blank">'
+                                f"{html.conditional_escape(media.name)}"
+                                f"</a>",
                             )
-                            fs = DefaultStorage()
-                            file_name = fs.save(orig_file_name, BytesIO(r.content))
-
-                            if att_type == "image":
-                                message_m = Message(
-                                    platform=platform,
-                                    platform_message_id=mid,
-                                    image=fs.base_url + file_name,
-                                    direction=Message.FROM_CUSTOMER,
-                                    state=Message.DELIVERED,
-                                    timestamp=datetime.datetime.fromtimestamp(
-                                        timestamp / 1000
-                                    ),
-                                )
-                            else:
-                                message_m = Message(
-                                    platform=platform,
-                                    platform_message_id=mid,
-                                    direction=Message.FROM_CUSTOMER,
-                                    state=Message.DELIVERED,
-                                    timestamp=datetime.datetime.fromtimestamp(
-                                        timestamp / 1000
-                                    ),
-                                    text=f'<a href="{fs.base_url + file_name}" target="_blank">'
-                                    f"{html.conditional_escape(orig_file_name)}"
-                                    f"</a>",
-                                )
                     elif att_type == "location":
                         message_m = Message(
                             platform=platform,
@@ -126,8 +124,7 @@ def handle_facebook_message(psid: dict, message: dict, timestamp: int) -> None:
             reply_to_m = Message.objects.filter(platform_message_id=reply_to_mid).first()
             if reply_to_m:
                 message_m.reply_to = reply_to_m
-        message_m.save()
-        operator_interface.tasks.process_message.delay(message_m.id)
+        operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -162,7 +159,7 @@ def handle_facebook_postback(psid: dict, postback: dict, timestamp: int) -> None
         message_m.save()
         handle_mark_facebook_message_read.delay(psid)
         operator_interface.tasks.send_message_to_interface.delay(message_m.id)
-        update_facebook_profile.delay(psid, platform.conversation.id)
+        schedule_profile_refresh(psid, platform.conversation.id)
 
 
 @shared_task
@@ -181,11 +178,11 @@ def handle_facebook_read(psid: dict, read: dict) -> None:
                 timestamp__lte=datetime.datetime.fromtimestamp(watermark / 1000),
             )
             message_ids = [m.id for m in messages]
-            messages.update(state=Message.READ)
+            messages.update(state=Message.READ, updated_at=timezone.now())
             for message in message_ids:
                 operator_interface.tasks.send_message_to_interface.delay(message)
 
-            update_facebook_profile.delay(psid, platform.conversation.id)
+            schedule_profile_refresh(psid, platform.conversation.id)
 
 
 @shared_task
@@ -210,7 +207,7 @@ def handle_facebook_optin(psid: dict, optin: dict) -> None:
             ConversationPlatform.FACEBOOK, psid, customer_user_id=user_id
         )
 
-    update_facebook_profile.delay(psid, platform.conversation.id)
+    schedule_profile_refresh(psid, platform.conversation.id)
     if user_id:
         platform.conversation.update_user_id(user_id)
     message_m: Message = Message(
@@ -220,8 +217,7 @@ def handle_facebook_optin(psid: dict, optin: dict) -> None:
         " We'll be sure to keep you updated.",
         direction=Message.TO_CUSTOMER,
     )
-    message_m.save()
-    operator_interface.tasks.process_message(message_m.id)
+    operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -238,7 +234,7 @@ def handle_facebook_reaction(reaction: dict) -> None:
 
 
 def attempt_get_user_id(psid: str) -> typing.Optional[str]:
-    profile_r = requests.get(
+    profile_r = wewillfixyourpc_bot.http_client.get(
         f"https://graph.facebook.com/{psid}",
         params={
             "fields": "ids_for_apps",
@@ -267,10 +263,16 @@ def attempt_get_user_id(psid: str) -> typing.Optional[str]:
     return None
 
 
+def schedule_profile_refresh(psid: str, cid) -> None:
+    operator_interface.profile_refresh.schedule(
+        update_facebook_profile, ConversationPlatform.FACEBOOK, psid, psid, cid
+    )
+
+
 @shared_task
 def update_facebook_profile(psid: str, cid) -> None:
     conversation: Conversation = Conversation.objects.get(id=cid)
-    profile_r = requests.get(
+    profile_r = wewillfixyourpc_bot.http_client.get(
         f"https://graph.facebook.com/{psid}",
         params={
             "fields": "name,timezone,locale,gender,first_name,last_name,profile_pic",
@@ -291,26 +293,17 @@ def update_facebook_profile(psid: str, cid) -> None:
         locale = profile.get("locale")
         gender = profile.get("gender")
 
-        if not conversation.conversation_pic and profile_pic:
-            pic_r = requests.get(profile_pic)
-            if pic_r.status_code == 200:
-                conversation.conversation_pic.save(
-                    psid,
-                    InMemoryUploadedFile(
-                        file=BytesIO(pic_r.content),
-                        size=len(pic_r.content),
-                        charset=pic_r.encoding,
-                        content_type=pic_r.headers.get("content-type"),
-                        field_name=psid,
-                        name=psid,
-                    ),
-                )
+        pic_changed = False
+        if profile_pic:
+            pic_changed = operator_interface.profile_refresh.save_picture(
+                conversation, profile_pic, psid
+            )
         if not conversation.conversation_name:
             conversation.conversation_name = name
-        conversation.save()
+        conversation.save(update_fields=["conversation_pic", "conversation_name", "updated_at"])
 
         if conversation.conversation_user_id:
-            django_keycloak_auth.users.update_user(
+            operator_interface.users.update_user(
                 str(conversation.conversation_user_id),
                 first_name=first_name,
                 last_name=last_name,
@@ -319,17 +312,19 @@ def update_facebook_profile(psid: str, cid) -> None:
                 timezone=user_timezone,
                 force_update=False,
             )
-            if conversation.conversation_pic:
-                django_keycloak_auth.users.update_user(
+            if pic_changed:
+                operator_interface.users.update_user(
                     str(conversation.conversation_user_id),
                     profile_pictrue=conversation.conversation_pic.url,
                     force_update=False,
                 )
 
+        operator_interface.profile_refresh.refreshed(ConversationPlatform.FACEBOOK, psid)
+
 
 @shared_task
 def handle_mark_facebook_message_read(psid: str) -> None:
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://graph.facebook.com/me/messages",
         params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
         json={"recipient": {"id": psid}, "sender_action": "mark_seen"},
@@ -339,7 +334,7 @@ def handle_mark_facebook_message_read(psid: str) -> None:
 @shared_task
 def handle_facebook_message_typing_on(pid: int) -> None:
     platform: ConversationPlatform = ConversationPlatform.objects.get(id=pid)
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://graph.facebook.com/me/messages",
         params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
         json={"recipient": {"id": platform.platform_id}, "sender_action": "typing_on"},
@@ -349,7 +344,7 @@ def handle_facebook_message_typing_on(pid: int) -> None:
 @shared_task
 def handle_facebook_message_typing_off(pid: int) -> None:
     platform: ConversationPlatform = ConversationPlatform.objects.get(id=pid)
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://graph.facebook.com/me/messages",
         params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
         json={"recipient": {"id": platform.platform_id}, "sender_action": "typing_off"},
@@ -365,13 +360,14 @@ def send_facebook_message(mid: int) -> None:
     if message.user is not None:
         try:
             if message.user.userprofile.fb_persona_id is None:
-                persona_r = requests.post(
+                persona_r = wewillfixyourpc_bot.http_client.post(
                     "https://graph.facebook.com/me/personas",
                     params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
                     json={
                         "name": message.user.first_name,
-                        "profile_picture_url": settings.EXTERNAL_URL_BASE
-                        + reverse("operator:profile_pic", args=[message.user.id]),
+                        "profile_picture_url": operator_interface.profile_pictures.url(
+                            message.user, size=operator_interface.profile_pictures.SIZES[-1]
+                        ),
                     },
                 )
                 if persona_r.status_code == 200:
@@ -384,7 +380,7 @@ def send_facebook_message(mid: int) -> None:
         except User.userprofile.RelatedObjectDoesNotExist:
             pass
 
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://graph.facebook.com/me/messages",
         params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
         json={"recipient": {"id": psid}, "sender_action": "typing_off"},
@@ -545,7 +541,7 @@ def send_facebook_message(mid: int) -> None:
             "payload": {"url": message.image},
         }
 
-    message_r = requests.post(
+    message_r = wewillfixyourpc_bot.http_client.post(
         "https://graph.facebook.com/me/messages",
         params={"access_token": settings.FACEBOOK_ACCESS_TOKEN},
         json=request_body,
@@ -554,11 +550,10 @@ def send_facebook_message(mid: int) -> None:
         logging.error(
             f"Error sending facebook message: {message_r.status_code} {message_r.text}"
         )
-        message.sate = Message.FAILED
-        message.save()
-    else:
-        message_json = message_r.json()
-        mid = message_json["message_id"]
-        message.platform_message_id = mid
-        message.state = Message.DELIVERED
-        message.save()
+    message_r.raise_for_status()
+
+    message_json = message_r.json()
+    mid = message_json["message_id"]
+    message.platform_message_id = mid
+    message.state = Message.DELIVERED
+    message.save()
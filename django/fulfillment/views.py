@@ -2,7 +2,8 @@ from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from . import models, forms
 import json
-import django_keycloak_auth.users
+import operator_interface.profiles
+import operator_interface.users
 
 
 def form(request, form_type, form_id):
@@ -16,7 +17,7 @@ def form(request, form_type, form_id):
                 unlock_form.clean()
                 phone_unlock = unlock_form_o.phone_unlock
 
-                django_keycloak_auth.users.update_user(
+                operator_interface.users.update_user(
                     unlock_form_o.customer_id,
                     force_update=True,
                     first_name=unlock_form.cleaned_data.get("first_name"),
@@ -55,14 +56,14 @@ def form(request, form_type, form_id):
 
                 return redirect("payment:gactions_payment", payment_id="")
         else:
-            user = django_keycloak_auth.users.get_user_by_id(unlock_form_o.customer_id)
+            user = operator_interface.profiles.get_user(unlock_form_o.customer_id)
             unlock_form = forms.UnlockForm(
                 initial={
-                    "first_name": user.user.get("firstName"),
-                    "last_name": user.user.get("lastName"),
-                    "email": user.user.get("email"),
+                    "first_name": user.get("firstName"),
+                    "last_name": user.get("lastName"),
+                    "email": user.get("email"),
                     "phone": next(
-                        iter(user.user.get("attributes", {}).get("phone", [])), ""
+                        iter(user.get("attributes", {}).get("phone", [])), ""
                     ),
                 }
             )
@@ -12,7 +12,6 @@ import google.auth.transport.requests
 import google.oauth2.id_token
 import jose.exceptions
 import jwt
-import requests
 from django.utils import timezone, html
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
@@ -20,8 +19,11 @@ from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbid
 from django.views.decorators.csrf import csrf_exempt
 
 import operator_interface.consumers
+import operator_interface.outbox
 import operator_interface.tasks
+import operator_interface.users
 from operator_interface.models import Conversation, Message
+import wewillfixyourpc_bot.http_client
 
 logger = logging.getLogger(__name__)
 emoji_pattern = re.compile(
@@ -85,9 +87,8 @@ def process_inputs(inputs, conversation):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
             outputs_l.append(
-                operator_interface.tasks.process_message.delay(message_m.id)
+                operator_interface.outbox.result(operator_interface.outbox.dispatch(message_m))
             )
         elif intent == "actions.intent.TEXT":
             arguments = i.get("arguments", {})
@@ -99,9 +100,8 @@ def process_inputs(inputs, conversation):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
             outputs_l.append(
-                operator_interface.tasks.process_message.delay(message_m.id)
+                operator_interface.outbox.result(operator_interface.outbox.dispatch(message_m))
             )
         elif intent == "actions.intent.SIGN_IN":
             arguments = i.get("arguments", {})
@@ -420,7 +420,7 @@ def webhook(request):
         profile_pic = user_id_token.get("picture")
 
         if not conversation.conversation_user_id:
-            user = django_keycloak_auth.users.get_or_create_user(
+            user = operator_interface.users.get_or_create_user(
                 federated_provider="google",
                 federated_user_id=user_id_token.get("sub"),
                 federated_user_name=user_id_token.get("email"),
@@ -444,7 +444,7 @@ def webhook(request):
                 federated_user_name=user_id_token.get("email"),
             )
 
-            django_keycloak_auth.users.update_user(
+            operator_interface.users.update_user(
                 conversation.conversation_user_id,
                 first_name=user_id_token.get("given_name"),
                 last_name=user_id_token.get("family_name"),
@@ -454,7 +454,7 @@ def webhook(request):
             )
 
         if profile_pic:
-            r = requests.get(profile_pic)
+            r = wewillfixyourpc_bot.http_client.get(profile_pic)
             if r.status_code == 200:
                 file_name = os.path.basename(urllib.parse.urlparse(profile_pic).path)
                 conversation.conversation_pic = InMemoryUploadedFile(
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from . import models
+from . import delivery, models
 
 
 class UserProfileInline(admin.StackedInline):
@@ -19,10 +19,38 @@ class ConversationRatingAdmin(admin.ModelAdmin):
     readonly_fields = ("time",)
 
 
+@admin.register(models.DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ("message", "timestamp", "attempts", "error")
+    readonly_fields = ("message", "timestamp", "attempts", "error")
+    actions = ("replay",)
+
+    def replay(self, request, queryset):
+        mids = delivery.replay(queryset)
+        self.message_user(request, f"Replaying {len(mids)} message(s)")
+
+    replay.short_description = "Replay selected messages"
+
+
+@admin.register(models.DeliveryAttempt)
+class DeliveryAttemptAdmin(admin.ModelAdmin):
+    list_display = ("message", "attempt", "timestamp", "latency_ms", "outcome")
+    list_filter = ("outcome",)
+    readonly_fields = ("message", "attempt", "timestamp", "latency_ms", "outcome", "error")
+
+
+@admin.register(models.MediaObject)
+class MediaObjectAdmin(admin.ModelAdmin):
+    list_display = ("name", "content_type", "size", "created_at")
+    list_filter = ("content_type",)
+    search_fields = ("name", "sha256")
+
+
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 admin.site.register(models.Conversation)
 admin.site.register(models.ConversationPlatform)
+admin.site.register(models.CustomerIdentity)
 admin.site.register(models.Message)
 admin.site.register(models.MessageEntity)
 admin.site.register(models.PresetMessage)
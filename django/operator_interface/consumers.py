@@ -1,4 +1,4 @@
-import datetime
+import asyncio
 import json
 import uuid
 import payment
@@ -6,34 +6,142 @@ import typing
 import dateutil.parser
 import secrets
 import django_keycloak_auth.users
-import keycloak.exceptions
 import phonenumbers
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+import redis.exceptions
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.layers import get_channel_layer
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.db import transaction
-from django.db.models import Max, Count
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.utils import html
+from django.utils import html, timezone
 
+import operator_interface.delivery
 import operator_interface.models
+import operator_interface.outbox
+import operator_interface.serializers
 import operator_interface.tasks
+import operator_interface.users
 import fulfillment.models
+import wewillfixyourpc_bot.redis_client
 
 channel_layer = get_channel_layer()
 
+DEBOUNCE_KEY = "operator_interface_event:{}:{}"
+DEBOUNCE_STATS_KEY = "operator_interface_event_stats"
+CONVERSATION_SUMMARY = "conversation_summary"
+CONVERSATION_UPDATE = "conversation_update"
+MESSAGE_UPDATE = "message_update"
+
+
+def conversation_group(cid) -> str:
+    return f"operator_interface_conversation_{cid}"
+
+
+def send_conversation_summary(cid):
+    try:
+        conversation = operator_interface.models.Conversation.objects.get(id=cid)
+    except operator_interface.models.Conversation.DoesNotExist:
+        return
+
+    async_to_sync(channel_layer.group_send)(
+        "operator_interface",
+        {
+            "type": "conversation_list_update",
+            "conversation": operator_interface.serializers.serialize_conversation_summary(
+                conversation
+            ),
+        },
+    )
+
+
+def send_conversation_update(cid):
+    try:
+        conversation = operator_interface.models.Conversation.objects.get(id=cid)
+    except operator_interface.models.Conversation.DoesNotExist:
+        return
+
+    async_to_sync(channel_layer.group_send)(
+        conversation_group(cid),
+        {
+            "type": "conversation_update",
+            "conversation": operator_interface.serializers.serialize_conversations(
+                [conversation]
+            )[0],
+        },
+    )
+
+
+def send_message_update(mid):
+    try:
+        message = operator_interface.serializers.get_message(mid)
+    except operator_interface.models.Message.DoesNotExist:
+        return
+
+    async_to_sync(channel_layer.group_send)(
+        conversation_group(message.platform.conversation_id),
+        {
+            "type": "message_update",
+            "message": operator_interface.serializers.serialize_message(message),
+        },
+    )
+
+
+def send_event(kind: str, object_id: int):
+    if kind == CONVERSATION_SUMMARY:
+        send_conversation_summary(object_id)
+    elif kind == CONVERSATION_UPDATE:
+        send_conversation_update(object_id)
+    elif kind == MESSAGE_UPDATE:
+        send_message_update(object_id)
+
+
+def schedule_event(kind: str, object_id: int):
+    window = settings.OPERATOR_INTERFACE_DEBOUNCE_MS
+    try:
+        client = wewillfixyourpc_bot.redis_client.get_client()
+        scheduled = client.set(
+            DEBOUNCE_KEY.format(kind, object_id), 1, nx=True, px=window
+        )
+        client.hincrby(
+            DEBOUNCE_STATS_KEY, f"{kind}:{'sent' if scheduled else 'suppressed'}", 1
+        )
+    except redis.exceptions.RedisError:
+        send_event(kind, object_id)
+        return
+
+    if scheduled:
+        operator_interface.tasks.send_interface_event.apply_async(
+            (kind, object_id), countdown=window / 1000
+        )
+
+
+def schedule_events(*events: typing.Tuple[str, int]):
+    def schedule():
+        for kind, object_id in set(events):
+            schedule_event(kind, object_id)
+
+    transaction.on_commit(schedule)
+
+
+def get_event_stats() -> typing.Dict[str, typing.Dict[str, int]]:
+    stats = {}
+    for key, value in wewillfixyourpc_bot.redis_client.get_client() \
+            .hgetall(DEBOUNCE_STATS_KEY).items():
+        kind, outcome = key.decode().split(":", 1)
+        stats.setdefault(kind, {})[outcome] = int(value)
+    return stats
+
 
 @receiver(post_save, sender=operator_interface.models.Conversation)
 def conversation_saved(
         sender, instance: operator_interface.models.Conversation, **kwargs
 ):
-    transaction.on_commit(
-        lambda: async_to_sync(channel_layer.group_send)(
-            "operator_interface", {"type": "conversation_update", "cid": instance.id}
-        )
+    schedule_events(
+        (CONVERSATION_SUMMARY, instance.id), (CONVERSATION_UPDATE, instance.id)
     )
 
 
@@ -41,12 +149,7 @@ def conversation_saved(
 def conversation_platform_saved(
         sender, instance: operator_interface.models.ConversationPlatform, **kwargs
 ):
-    transaction.on_commit(
-        lambda: async_to_sync(channel_layer.group_send)(
-            "operator_interface",
-            {"type": "conversation_update", "cid": instance.conversation.id},
-        )
-    )
+    schedule_events((CONVERSATION_UPDATE, instance.conversation_id))
 
 
 @receiver(post_delete, sender=operator_interface.models.Conversation)
@@ -62,20 +165,25 @@ def conversation_deleted(
 
 @receiver(post_save, sender=operator_interface.models.Message)
 def message_saved(sender, instance: operator_interface.models.Message, **kwargs):
-    transaction.on_commit(
-        lambda: async_to_sync(channel_layer.group_send)(
-            "operator_interface", {"type": "message_update", "mid": instance.id}
-        )
-    )
+    events = [(MESSAGE_UPDATE, instance.id)]
+    if kwargs.get("created"):
+        events.append((CONVERSATION_SUMMARY, instance.platform.conversation_id))
+    schedule_events(*events)
 
 
 @receiver(post_save, sender=fulfillment.models.RepairBooking)
-def repair_booking_saved(sender, instance: operator_interface.models.Message, **kwargs):
-    transaction.on_commit(
-        lambda: async_to_sync(channel_layer.group_send)(
-            "operator_interface", {"type": "repair_booking_update", "bid": instance.id}
-        )
-    )
+def repair_booking_saved(sender, instance: fulfillment.models.RepairBooking, **kwargs):
+    def send():
+        booking = operator_interface.serializers.serialize_booking(instance)
+        for cid in operator_interface.models.Conversation.objects.filter(
+                conversation_user_id=instance.customer_id
+        ).values_list("id", flat=True):
+            async_to_sync(channel_layer.group_send)(
+                conversation_group(cid),
+                {"type": "repair_booking_update", "booking": booking},
+            )
+
+    transaction.on_commit(send)
 
 
 # TODO: Integrate with new system
@@ -93,40 +201,41 @@ def repair_booking_saved(sender, instance: operator_interface.models.Message, **
 #     )
 
 
-class OperatorConsumer(JsonWebsocketConsumer):
+class OperatorError(Exception):
+    pass
+
+
+async def delay(task, *args):
+    await sync_to_async(task.delay, thread_sensitive=False)(*args)
+
+
+class OperatorConsumer(AsyncJsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user: typing.Optional[User] = None
+        self.subscriptions: typing.Set[int] = set()
 
-    def close(self, code=None):
-        return super().close(code)
+    async def message_update(self, event):
+        await self.send_json(event["message"])
 
-    def message(self, event):
-        message = self.get_message(event["mid"])
-        self.send_message(message)
-        self.send_conversation(message.platform.conversation)
+    async def conversation_update(self, event):
+        await self.send_conversation_data(event["conversation"])
 
-    def message_update(self, event):
-        message = self.get_message(event["mid"])
-        self.send_message(message)
+    async def conversation_list_update(self, event):
+        await self.send_conversation_data(event["conversation"])
 
-    def conversation_update(self, event):
-        conversation = self.get_conversation(event["cid"])
-        self.send_conversation(conversation)
+    async def conversation_delete(self, event):
+        await self.send_json({"type": "conversation_delete", "id": event["cid"]})
 
-    def conversation_delete(self, event):
-        self.send_json({"type": "conversation_delete", "id": event["cid"]})
-
-    def conversation_merge(self, event):
-        conversation = self.get_conversation(event["ncid"])
-        self.send_conversation(conversation)
-        self.send_json(
+    async def conversation_merge(self, event):
+        conversation = await database_sync_to_async(self.get_conversation)(event["ncid"])
+        await self.send_conversation(conversation)
+        await self.send_json(
             {"type": "conversation_merge", "nid": event["ncid"], "id": event["cid"]}
         )
 
-    def repair_booking_update(self, event):
-        booking = self.get_booking(event["bid"])
-        self.send_booking(booking)
+    async def repair_booking_update(self, event):
+        await self.send_json(event["booking"])
 
     # TODO: Integrate with new system
     # def payment_update(self, event):
@@ -137,146 +246,87 @@ class OperatorConsumer(JsonWebsocketConsumer):
     #     payment_item = self.get_payment_item(event["pid"])
     #     self.send_payment_item(payment_item)
 
-    def connect(self, *_args, **_kwargs):
-        print(self.scope)
-        self.user = self.scope["user"]
+    async def connect(self):
+        self.user = await database_sync_to_async(self.get_user)()
 
-        if not self.user.is_authenticated or not self.user.is_staff:
-            self.close()
+        if not self.user or not self.user.is_staff:
+            await self.close()
             return
 
-        self.accept()
-        async_to_sync(self.channel_layer.group_add)(
-            "operator_interface", self.channel_name
-        )
+        await self.accept()
+        await self.channel_layer.group_add("operator_interface", self.channel_name)
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            "operator_interface", self.channel_name
-        )
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard("operator_interface", self.channel_name)
+        for cid in self.subscriptions:
+            await self.channel_layer.group_discard(conversation_group(cid), self.channel_name)
+        self.subscriptions.clear()
 
-    def send_message(self, message: operator_interface.models.Message):
-        self.send_json(
-            {
-                "type": "message",
-                "id": message.id,
-                "direction": message.direction,
-                "timestamp": int(message.timestamp.timestamp()),
-                "text": message.text,
-                "image": message.image,
-                "state": message.state,
-                "platform": message.platform.platform,
-                "platform_id": message.platform.platform_id,
-                "payment_request": str(message.payment_request)
-                if message.payment_request
-                else None,
-                "payment_confirm": str(message.payment_confirm)
-                if message.payment_confirm
-                else None,
-                "conversation_id": message.platform.conversation.id,
-                "request": message.request,
-                "sent_by": message.user.first_name if message.user else None,
-                "end": message.end,
-                "request_live_agent": message.request_live_agent,
-                "guessed_intent": message.guessed_intent,
-                "entities": [
-                    {"entity": e.entity, "value": e.value}
-                    for e in message.messageentity_set.all()
-                ],
-                "selection": message.selection,
-                "card": message.card,
-            }
-        )
+    async def subscribe(self, cid: int):
+        if cid not in self.subscriptions:
+            self.subscriptions.add(cid)
+            await self.channel_layer.group_add(conversation_group(cid), self.channel_name)
+
+    async def unsubscribe(self, cid: int):
+        if cid in self.subscriptions:
+            self.subscriptions.discard(cid)
+            await self.channel_layer.group_discard(conversation_group(cid), self.channel_name)
 
-    def send_error(self, error: str):
-        self.send_json({"type": "error", "msg": error})
+    async def send_error(self, error: str):
+        await self.send_json({"type": "error", "msg": error})
 
-    def send_config(self):
-        self.send_json(
+    async def send_config(self):
+        await self.send_json(
             {
                 "type": "config",
                 "config": {
                     "user_name": f"{self.user.first_name} {self.user.last_name}",
-                    "preset_responses": list(map(lambda m: {
-                        "id": m.id,
-                        "description": m.description,
-                        "message": m.message,
-                    }, operator_interface.models.PresetMessage.objects.all()))
+                    "preset_responses": await database_sync_to_async(self.get_preset_responses)(),
                 },
             }
         )
 
-    def send_conversation(self, conversation: operator_interface.models.Conversation):
-        pic = settings.STATIC_URL + "operator_interface/img/default_profile_normal.png"
-        if conversation.conversation_pic:
-            pic = conversation.conversation_pic.url
+    async def send_conversation(
+            self, conversation: operator_interface.models.Conversation, inline_messages=0
+    ):
+        await self.send_conversations([conversation], inline_messages)
 
-        if conversation.conversation_user_id:
-            bookings = fulfillment.models.RepairBooking.objects.filter(
-                customer_id=conversation.conversation_user_id
-            )
-            try:
-                user = django_keycloak_auth.users.get_user_by_id(
-                    str(conversation.conversation_user_id)
-                ).user
-            except keycloak.exceptions.KeycloakClientError:
-                user = {}
-        else:
-            user = {
-                "name": conversation.conversation_name,
-                "attributes": {"profile_picture": [pic]},
-            }
-            bookings = []
-
-        first_name = user.get("firstName", "")
-        last_name = user.get("lastName", "")
-        attributes = user.get("attributes", {})
-        timezone = next(iter(attributes.get("timezone", [])), None)
-        phone_number = next(iter(attributes.get("phone", [])), None)
-        locale = next(iter(attributes.get("locale", [])), None)
-        gender = next(iter(attributes.get("gender", [])), None)
-        pic = next(iter(attributes.get("profile_picture", [])), pic)
-
-        platforms = conversation.conversationplatform_set.all()
-        messages = [m for p in map(lambda p: p.messages.all(), platforms) for m in p]
-        messages.sort(key=lambda m: m.timestamp)
-        payments = []
-        for m in messages:
-            if m.payment_request and str(m.payment_request) not in payments:
-                payments.append(str(m.payment_request))
-            if m.payment_confirm and str(m.payment_confirm) not in payments:
-                payments.append(str(m.payment_confirm))
-
-        self.send_json(
-            {
-                "type": "conversation",
-                "id": conversation.id,
-                "agent_responding": conversation.agent_responding,
-                "current_user_responding": conversation.current_agent.id == self.user.id
-                if conversation.current_agent else False,
-                "user_responding": conversation.current_agent is not None,
-                "customer_id": str(conversation.conversation_user_id)
-                if conversation.conversation_user_id else None,
-                "customer_name": user.get("name", f"{first_name} {last_name}"),
-                "customer_first_name": first_name,
-                "customer_last_name": last_name,
-                "customer_username": user.get("username"),
-                "customer_pic": pic,
-                "timezone": timezone,
-                "customer_email": user.get("email"),
-                "customer_phone": phone_number,
-                "customer_locale": locale,
-                "customer_gender": gender,
-                "messages": [m.id for m in messages],
-                "repair_bookings": [b.id for b in bookings],
-                "payments": payments,
-                "can_message": conversation.can_message(),
-                "typing": conversation.is_typing(),
-            }
+    async def send_conversations(
+            self,
+            conversations: typing.Iterable[operator_interface.models.Conversation],
+            inline_messages=0,
+    ):
+        conversations = list(conversations)
+        data, customers = await asyncio.gather(
+            database_sync_to_async(operator_interface.serializers.serialize_conversations)(
+                conversations, inline_messages, False
+            ),
+            asyncio.gather(*(
+                operator_interface.serializers.get_customer_async(conversation)
+                for conversation in conversations
+            )),
         )
-
-    def send_payment(self, payment: payment.Payment):
-        self.send_json(
+        for conversation, conversation_data, customer in zip(conversations, data, customers):
+            conversation_data.update(
+                operator_interface.serializers.serialize_customer(conversation, customer)
+            )
+            await self.send_conversation_data(conversation_data)
+
+    async def send_messages(self, messages: typing.List[dict], **extra):
+        await self.send_json({
+            **extra,
+            "type": "messages",
+            "messages": messages,
+        })
+
+    async def send_conversation_data(self, data: dict):
+        await self.send_json({
+            **data,
+            "current_user_responding": data["current_agent_id"] == self.user.id,
+        })
+
+    async def send_payment(self, payment: payment.Payment):
+        await self.send_json(
             {
                 "type": "payment",
                 "id": str(payment.id),
@@ -297,34 +347,18 @@ class OperatorConsumer(JsonWebsocketConsumer):
             }
         )
 
-    def send_booking(self, booking: fulfillment.models.RepairBooking):
-        self.send_json(
-            {
-                "type": "booking",
-                "id": str(booking.id),
-                "time": str(booking.time.isoformat()),
-                "repair": {
-                    "id": booking.repair.id,
-                    "time": booking.repair.repair_time,
-                    "price": str(booking.repair.price),
-                    "repair": {
-                        "id": booking.repair.repair.id,
-                        "name": booking.repair.repair.name,
-                        "display_name": booking.repair.repair.display_name,
-                    },
-                    "device": {
-                        "id": booking.repair.device.id,
-                        "name": booking.repair.device.name,
-                        "display_name": booking.repair.device.display_name,
-                        "brand": {
-                            "id": booking.repair.device.brand.id,
-                            "name": booking.repair.device.brand.name,
-                            "display_name": booking.repair.device.brand.display_name,
-                        },
-                    },
-                },
-            }
-        )
+    def get_user(self) -> typing.Optional[User]:
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            return None
+        return User.objects.get(pk=user.pk)
+
+    def get_preset_responses(self) -> typing.List[dict]:
+        return list(map(lambda m: {
+            "id": m.id,
+            "description": m.description,
+            "message": m.message,
+        }, operator_interface.models.PresetMessage.objects.all()))
 
     def make_message(self, cid, text):
         conversation = self.get_conversation(cid)
@@ -335,28 +369,59 @@ class OperatorConsumer(JsonWebsocketConsumer):
             message_id=uuid.uuid4(),
             user=self.user,
         )
-        self.save_object(message)
-        operator_interface.tasks.process_message.delay(message.id)
+        operator_interface.outbox.dispatch(message)
 
-    def get_messages(self, last_message):
-        for conversation in operator_interface.models.Conversation.objects.all():
-            for platform in conversation.conversationplatform_set.all():
-                for message in platform.messages.filter(timestamp__gt=last_message):
-                    yield message
+    async def resync(self, cursor: int):
+        new_cursor = operator_interface.serializers.to_cursor(timezone.now())
+        changes = await database_sync_to_async(self.get_changes)(cursor)
+        if changes is None:
+            await self.send_json({"type": "resync", "reload": True})
+            return
+        conversations, messages = changes
+        await self.send_conversations(conversations)
+        for message in messages:
+            await self.send_json(message)
+        await self.send_json({"type": "resync", "cursor": new_cursor})
+
+    def get_changes(self, cursor: int):
+        changes = operator_interface.serializers.get_changes(cursor)
+        if changes is None:
+            return None
+        conversations, messages = changes
+        return conversations, [
+            operator_interface.serializers.serialize_message(m) for m in messages
+        ]
 
     def get_conversations(self, offset):
-        for conversation in (
+        return list(
             operator_interface.models.Conversation.objects
-                    .annotate(order_timestamp=Max('conversationplatform__messages__timestamp'))
-                    .annotate(message_count=Count('conversationplatform__messages'))
-                    .filter(message_count__gte=1)
-                    .order_by('-order_timestamp')
-                    .distinct()[offset:offset+50]
-        ):
-            yield conversation
+                .filter(message_count__gte=1)
+                .order_by("-last_message_at")[offset:offset+50]
+        )
 
     def get_message(self, mid):
-        return operator_interface.models.Message.objects.get(id=mid)
+        return operator_interface.serializers.serialize_message(
+            operator_interface.serializers.get_message(mid)
+        )
+
+    def get_messages(self, ids):
+        return [
+            operator_interface.serializers.serialize_message(m)
+            for m in operator_interface.serializers.get_messages(ids)
+        ]
+
+    def get_message_page(self, cid, before, limit):
+        return [
+            operator_interface.serializers.serialize_message(m)
+            for m in operator_interface.serializers.get_message_page(cid, before, limit)
+        ]
+
+    def replay_failed(self, cid):
+        operator_interface.delivery.replay(
+            operator_interface.models.DeadLetter.objects.filter(
+                message__platform__conversation_id=cid
+            )
+        )
 
     def get_message_entity(self, eid):
         return operator_interface.models.MessageEntity.objects.get(id=eid)
@@ -365,16 +430,21 @@ class OperatorConsumer(JsonWebsocketConsumer):
         return operator_interface.models.Conversation.objects.get(id=cid)
 
     def get_booking(self, bid):
-        return fulfillment.models.RepairBooking.objects.get(id=bid)
+        return operator_interface.serializers.serialize_booking(
+            fulfillment.models.RepairBooking.objects.get(id=bid)
+        )
+
+    def get_last_usable_platform_id(self, cid):
+        return self.get_conversation(cid).last_usable_platform().id
 
     def save_object(self, obj):
         obj.save()
 
-    def make_payment_request(self, cid, items):
-        conversation = self.get_conversation(cid)
+    async def make_payment_request(self, cid, items):
+        conversation = await database_sync_to_async(self.get_conversation)(cid)
 
         try:
-            payment_id = payment.create_payment(
+            payment_id = await payment.create_payment(
                 settings.DEFAULT_PAYMENT_ENVIRONMENT,
                 conversation.conversation_user_id,
                 [
@@ -389,9 +459,14 @@ class OperatorConsumer(JsonWebsocketConsumer):
                 ],
             )
         except payment.PaymentException:
-            self.send_error("There was an error creating the payment")
+            await self.send_error("There was an error creating the payment")
             return
 
+        await database_sync_to_async(self.send_payment_request)(conversation, payment_id)
+
+    def send_payment_request(
+            self, conversation: operator_interface.models.Conversation, payment_id: uuid.UUID
+    ):
         message = operator_interface.models.Message(
             platform=conversation.last_usable_platform(),
             direction=operator_interface.models.Message.TO_CUSTOMER,
@@ -400,8 +475,7 @@ class OperatorConsumer(JsonWebsocketConsumer):
             text="To complete payment follow this link 💸",
             payment_request=payment_id,
         )
-        self.save_object(message)
-        operator_interface.tasks.process_message.delay(message.id)
+        operator_interface.outbox.dispatch(message)
 
     def book_repair(self, cid, rid, time):
         conversation = self.get_conversation(cid)
@@ -417,12 +491,10 @@ class OperatorConsumer(JsonWebsocketConsumer):
             try:
                 phone = phonenumbers.parse(value, settings.PHONENUMBER_DEFAULT_REGION)
             except phonenumbers.phonenumberutil.NumberParseException:
-                self.send_error("Invalid phone number")
-                return None
+                raise OperatorError("Invalid phone number")
 
             if not phonenumbers.is_valid_number(phone):
-                self.send_error("Invalid phone number")
-                return None
+                raise OperatorError("Invalid phone number")
             else:
                 phone = phonenumbers.format_number(
                     phone, phonenumbers.PhoneNumberFormat.E164
@@ -440,27 +512,25 @@ class OperatorConsumer(JsonWebsocketConsumer):
             conversation: operator_interface.models.Conversation,
             attribute: str,
             value: str,
-    ):
+    ) -> typing.Optional[operator_interface.models.Conversation]:
         value = json.loads(value)
         attr = self.decode_attribute(attribute, value)
         if attr:
             if conversation.conversation_user_id:
-                django_keycloak_auth.users.update_user(
+                operator_interface.users.update_user(
                     str(conversation.conversation_user_id), force_update=True, **attr
                 )
-                self.send_conversation(conversation)
+                return conversation
             elif attribute not in ["email", "phone-number"]:
-                self.send_error(
+                raise OperatorError(
                     "No user account is currently associated with this conversation, "
                     "please set an email or phone number first"
                 )
             elif attribute == "email":
                 attr = attr["email"]
-                user = django_keycloak_auth.users.get_user_by_federated_identity(
-                    email=attr
-                )
+                user_id = operator_interface.users.get_user_id_by_email(attr)
 
-                if user:
+                if user_id:
                     message = operator_interface.models.Message(
                         platform=conversation.last_usable_platform(),
                         text="An account is already associated with that email address. Please log in.",
@@ -468,15 +538,14 @@ class OperatorConsumer(JsonWebsocketConsumer):
                         user=self.user,
                         request="sign_in",
                     )
-                    self.save_object(message)
-                    operator_interface.tasks.process_message.delay(message.id)
+                    operator_interface.outbox.dispatch(message)
                 else:
                     name = (
                         conversation.conversation_name
                         if conversation.conversation_name
                         else ""
                     ).split(" ")
-                    user = django_keycloak_auth.users.get_or_create_user(
+                    user = operator_interface.users.get_or_create_user(
                         email=attr,
                         last_name=name[-1] if len(name) else "",
                         first_name=" ".join(name[:-1]),
@@ -486,7 +555,7 @@ class OperatorConsumer(JsonWebsocketConsumer):
                             "VERIFY_EMAIL",
                         ],
                     )
-                    self.send_conversation(conversation.update_user_id(user.get("id")))
+                    updated_conversation = conversation.update_user_id(user.get("id"))
                     message = operator_interface.models.Message(
                         platform=conversation.last_usable_platform(),
                         text="Welcome to your We Will Fix Your PC account. Your username is "
@@ -496,32 +565,12 @@ class OperatorConsumer(JsonWebsocketConsumer):
                         user=self.user,
                     )
                     self.save_object(message)
+                    return updated_conversation
             elif attribute == "phone-number":
                 attr = attr["phone"]
+                user_id = operator_interface.users.get_user_id_by_phone(attr)
 
-                def match_user(u):
-                    numbers = u.user.get("attributes", {}).get("phone", [])
-                    for num in numbers:
-                        try:
-                            num = phonenumbers.parse(
-                                num, settings.PHONENUMBER_DEFAULT_REGION
-                            )
-                        except phonenumbers.NumberParseException:
-                            continue
-                        if (
-                                phonenumbers.format_number(
-                                    num, phonenumbers.PhoneNumberFormat.E164
-                                )
-                                == attr
-                        ):
-                            return True
-
-                    return False
-
-                user = next(
-                    filter(match_user, django_keycloak_auth.users.get_users()), None
-                )
-                if user:
+                if user_id:
                     message = operator_interface.models.Message(
                         platform=conversation.last_usable_platform(),
                         text="An account is already associated with that phone number. Please log in.",
@@ -529,15 +578,14 @@ class OperatorConsumer(JsonWebsocketConsumer):
                         user=self.user,
                         request="sign_in",
                     )
-                    self.save_object(message)
-                    operator_interface.tasks.process_message.delay(message.id)
+                    operator_interface.outbox.dispatch(message)
                 else:
                     name = (
                         conversation.conversation_name
                         if conversation.conversation_name
                         else ""
                     ).split(" ")
-                    user = django_keycloak_auth.users.get_or_create_user(
+                    user = operator_interface.users.get_or_create_user(
                         phone=attr,
                         last_name=name[-1] if len(name) else "",
                         first_name=" ".join(name[:-1]),
@@ -547,7 +595,7 @@ class OperatorConsumer(JsonWebsocketConsumer):
                             "VERIFY_EMAIL",
                         ],
                     )
-                    self.send_conversation(conversation.update_user_id(user.get("id")))
+                    updated_conversation = conversation.update_user_id(user.get("id"))
                     password = secrets.token_hex(4)
                     django_keycloak_auth.users.get_user_by_id(
                         user.get("id")
@@ -560,8 +608,8 @@ class OperatorConsumer(JsonWebsocketConsumer):
                         direction=operator_interface.models.Message.TO_CUSTOMER,
                         user=self.user,
                     )
-                    self.save_object(message)
-                    operator_interface.tasks.process_message.delay(message.id)
+                    operator_interface.outbox.dispatch(message)
+                    return updated_conversation
 
     def request_sign_in(self, conversation: operator_interface.models.Conversation):
         if not conversation.conversation_user_id:
@@ -572,32 +620,26 @@ class OperatorConsumer(JsonWebsocketConsumer):
                 user=self.user,
                 request="sign_in",
             )
-            self.save_object(message)
-            operator_interface.tasks.process_message.delay(message.id)
+            operator_interface.outbox.dispatch(message)
 
     def make_new_conversation(self, phone_number: str, name: str, text: str)\
             -> typing.Optional[operator_interface.models.ConversationPlatform]:
         if not phone_number:
-            self.send_error("Invalid phone number")
-            return
+            raise OperatorError("Invalid phone number")
 
         if not name:
-            self.send_error("Invalid name")
-            return
+            raise OperatorError("Invalid name")
 
         if not text:
-            self.send_error("Invalid message")
-            return
+            raise OperatorError("Invalid message")
 
         try:
             n = phonenumbers.parse(phone_number, settings.PHONENUMBER_DEFAULT_REGION)
         except phonenumbers.phonenumberutil.NumberParseException:
-            self.send_error("Invalid phone number")
-            return None
+            raise OperatorError("Invalid phone number")
 
         if not phonenumbers.is_valid_number(n):
-            self.send_error("Invalid phone number")
-            return None
+            raise OperatorError("Invalid phone number")
 
         formatted_num = phonenumbers.format_number(
             n, phonenumbers.PhoneNumberFormat.E164
@@ -631,9 +673,6 @@ class OperatorConsumer(JsonWebsocketConsumer):
                 pass
 
         if not platform:
-            conv = operator_interface.models.Conversation(conversation_name=name)
-            conv.save()
-
             if operator_interface.models.ConversationPlatform.is_whatsapp_template(text):
                 platform_id = operator_interface.models.ConversationPlatform.WHATSAPP
                 platform_rcpt_id = formatted_num
@@ -641,12 +680,9 @@ class OperatorConsumer(JsonWebsocketConsumer):
                 platform_id = operator_interface.models.ConversationPlatform.AS207960
                 platform_rcpt_id = f"msisdn-messaging;{formatted_num}"
 
-            platform = operator_interface.models.ConversationPlatform(
-                conversation=conv,
-                platform=platform_id,
-                platform_id=platform_rcpt_id,
+            platform = operator_interface.models.ConversationPlatform.create(
+                platform_id, platform_rcpt_id, conversation_name=name
             )
-            platform.save()
 
         if platform:
             message = operator_interface.models.Message(
@@ -656,51 +692,77 @@ class OperatorConsumer(JsonWebsocketConsumer):
                 message_id=uuid.uuid4(),
                 user=self.user,
             )
-            self.save_object(message)
-            operator_interface.tasks.process_message.delay(message.id)
+            operator_interface.outbox.dispatch(message)
+
+    async def receive_json(self, message, *args, **kwargs):
+        try:
+            await self.handle_message(message)
+        except OperatorError as e:
+            await self.send_error(str(e))
 
-    def receive_json(self, message, *args, **kwargs):
+    async def handle_message(self, message):
         if message["type"] == "resyncReq":
-            self.send_config()
-            last_message = message["lastMessage"]
-            last_message = datetime.datetime.fromtimestamp(last_message)
-            conversations = set()
-            for message in self.get_messages(last_message):
-                if message.platform.conversation not in conversations:
-                    conversations.add(message.platform.conversation)
-            for conversation in conversations:
-                self.send_conversation(conversation)
+            await self.send_config()
+            cursor = message.get("cursor")
+            if cursor is None:
+                cursor = message["lastMessage"] * 1000000
+            await self.resync(cursor)
         elif message["type"] == "getConversations":
-            self.send_config()
             offset = message["offset"]
-            for conversation in self.get_conversations(offset):
-                self.send_conversation(conversation)
+            cursor = operator_interface.serializers.to_cursor(timezone.now())
+            conversations, _ = await asyncio.gather(
+                database_sync_to_async(self.get_conversations)(offset), self.send_config()
+            )
+            await self.send_conversations(conversations)
+            if offset == 0:
+                await self.send_json({"type": "resync", "cursor": cursor})
+        elif message["type"] == "subscribe":
+            await self.subscribe(int(message["cid"]))
+        elif message["type"] == "unsubscribe":
+            await self.unsubscribe(int(message["cid"]))
         elif message["type"] == "getMessage":
             msg_id = message["id"]
             try:
-                msg = self.get_message(msg_id)
-                self.send_message(msg)
+                await self.send_json(await database_sync_to_async(self.get_message)(msg_id))
             except operator_interface.models.Message.DoesNotExist:
                 pass
+        elif message["type"] == "getMessages":
+            if "ids" in message:
+                await self.send_messages(
+                    await database_sync_to_async(self.get_messages)(message["ids"])
+                )
+            else:
+                limit = max(1, min(
+                    message.get("limit", operator_interface.serializers.MAX_MESSAGE_PAGE_SIZE),
+                    operator_interface.serializers.MAX_MESSAGE_PAGE_SIZE,
+                ))
+                messages = await database_sync_to_async(self.get_message_page)(
+                    message["cid"], message.get("before"), limit
+                )
+                await self.send_messages(
+                    messages,
+                    cid=message["cid"],
+                    before=message.get("before"),
+                    messages_before=messages[0]["id"] if len(messages) == limit else None,
+                )
         elif message["type"] == "getConversation":
             conv_id = message["id"]
             try:
-                conv = self.get_conversation(conv_id)
-                self.send_conversation(conv)
+                conv = await database_sync_to_async(self.get_conversation)(conv_id)
+                await self.send_conversation(conv, message.get("inline_messages", 0))
             except operator_interface.models.Conversation.DoesNotExist:
                 pass
         elif message["type"] == "getPayment":
             payment_id = message["id"]
             try:
-                payment_o = async_to_sync(payment.get_payment)(payment_id)
-                self.send_payment(payment_o)
+                payment_o = await payment.get_payment(payment_id)
+                await self.send_payment(payment_o)
             except payment.PaymentException:
                 pass
         elif message["type"] == "getBooking":
             booking_id = message["id"]
             try:
-                booking_o = self.get_booking(booking_id)
-                self.send_booking(booking_o)
+                await self.send_json(await database_sync_to_async(self.get_booking)(booking_id))
             except fulfillment.models.RepairBooking.DoesNotExist:
                 pass
         # elif message["type"] == "getPaymentItem":
@@ -713,60 +775,63 @@ class OperatorConsumer(JsonWebsocketConsumer):
         elif message["type"] == "msg":
             text = message["text"]
             cid = message["cid"]
-            self.make_message(cid, text)
+            await database_sync_to_async(self.make_message)(cid, text)
+        elif message["type"] == "replayFailed":
+            cid = message["cid"]
+            await database_sync_to_async(self.replay_failed)(cid)
         elif message["type"] == "newMsg":
             text = message["text"]
             name = message["name"]
             number = message["msisdn"]
-            self.make_new_conversation(number, name, text)
+            await database_sync_to_async(self.make_new_conversation)(number, name, text)
         elif message["type"] == "endConv":
             cid = message["cid"]
-            operator_interface.tasks.end_conversation.delay(cid)
+            await delay(operator_interface.tasks.end_conversation, cid)
         elif message["type"] == "finishConv":
             cid = message["cid"]
-            operator_interface.tasks.hand_back.delay(cid)
+            await delay(operator_interface.tasks.hand_back, cid)
         elif message["type"] == "takeOver":
             cid = message["cid"]
-            operator_interface.tasks.take_over.delay(cid, self.user.id)
+            await delay(operator_interface.tasks.take_over, cid, self.user.id)
         elif message["type"] == "preset_msg":
             cid = message["cid"]
             pid = message["id"]
-            operator_interface.tasks.send_preset_message.delay(cid, pid, self.user.id)
+            await delay(operator_interface.tasks.send_preset_message, cid, pid, self.user.id)
         elif message["type"] == "attribute_update":
             cid = message["cid"]
             try:
-                conv = self.get_conversation(cid)
-                self.attribute_update(conv, message["attribute"], message["value"])
+                conv = await database_sync_to_async(self.get_conversation)(cid)
+                conv = await database_sync_to_async(self.attribute_update)(
+                    conv, message["attribute"], message["value"]
+                )
+                if conv:
+                    await self.send_conversation(conv)
             except operator_interface.models.Conversation.DoesNotExist:
                 pass
         elif message["type"] == "request_sign_in":
             cid = message["cid"]
             try:
-                conv = self.get_conversation(cid)
-                self.request_sign_in(conv)
+                conv = await database_sync_to_async(self.get_conversation)(cid)
+                await database_sync_to_async(self.request_sign_in)(conv)
             except operator_interface.models.Conversation.DoesNotExist:
                 pass
         elif message["type"] == "typing_on":
             cid = message["cid"]
             try:
-                conv = self.get_conversation(cid)
-                operator_interface.tasks.process_typing_on.delay(
-                    conv.last_usable_platform().id
-                )
+                platform_id = await database_sync_to_async(self.get_last_usable_platform_id)(cid)
+                await delay(operator_interface.tasks.process_typing_on, platform_id)
             except operator_interface.models.Conversation.DoesNotExist:
                 pass
         elif message["type"] == "typing_off":
             cid = message["cid"]
             try:
-                conv = self.get_conversation(cid)
-                operator_interface.tasks.process_typing_off.delay(
-                    conv.last_usable_platform().id
-                )
+                platform_id = await database_sync_to_async(self.get_last_usable_platform_id)(cid)
+                await delay(operator_interface.tasks.process_typing_off, platform_id)
             except operator_interface.models.Conversation.DoesNotExist:
                 pass
         elif message["type"] == "requestPayment":
             cid = message["cid"]
-            self.make_payment_request(cid, message["items"])
+            await self.make_payment_request(cid, message["items"])
         elif message["type"] == "bookRepair":
             cid = message["cid"]
-            self.book_repair(cid, message["rid"], message["time"])
+            await database_sync_to_async(self.book_repair)(cid, message["rid"], message["time"])
@@ -0,0 +1,98 @@
+import random
+import time
+import typing
+
+import python_http_client.exceptions
+import requests.exceptions
+import sentry_sdk
+import twilio.base.exceptions
+from django.conf import settings
+from django.db import transaction
+
+import operator_interface.models
+import operator_interface.tasks
+
+RETRYABLE_STATUSES = (408, 425, 429)
+
+
+def _status(exc: Exception) -> typing.Optional[int]:
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code
+    elif isinstance(exc, twilio.base.exceptions.TwilioRestException):
+        return exc.status
+    elif isinstance(exc, python_http_client.exceptions.HTTPError):
+        return exc.status_code
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    status = _status(exc)
+    if status is None:
+        return False
+    return status in RETRYABLE_STATUSES or status >= 500
+
+
+def backoff(attempt: int) -> float:
+    # Full jitter, so messages that failed together during an outage don't all retry together
+    return random.uniform(0, min(settings.OUTBOUND_RETRY_CAP, settings.OUTBOUND_RETRY_BASE * 2 ** attempt))
+
+
+def describe(exc: Exception) -> str:
+    status = _status(exc)
+    description = f"{type(exc).__name__}: {exc}"
+    return f"HTTP {status} {description}" if status is not None else description
+
+
+def record_attempt(
+        mid: int, attempt: int, start: float, outcome: str, exc: typing.Optional[Exception] = None
+) -> None:
+    operator_interface.models.DeliveryAttempt.objects.create(
+        message_id=mid,
+        attempt=attempt,
+        latency_ms=round((time.monotonic() - start) * 1000),
+        outcome=outcome,
+        error=describe(exc) if exc else "",
+    )
+
+
+def send_parts(message: "operator_interface.models.Message", parts: typing.Sequence[typing.Callable[[], None]]) -> None:
+    # Each part is its own request to the platform, so a retry after a partial failure carries
+    # on from the part that failed rather than sending the customer the earlier ones again
+    for i, send in enumerate(parts):
+        if i < message.parts_sent:
+            continue
+        send()
+        message.parts_sent = i + 1
+        operator_interface.models.Message.objects.filter(id=message.id).update(parts_sent=i + 1)
+
+
+def dead_letter(mid: int, attempts: int, exc: Exception) -> None:
+    sentry_sdk.capture_exception(exc)
+    with transaction.atomic():
+        operator_interface.models.DeadLetter.objects.update_or_create(
+            message_id=mid, defaults={"attempts": attempts, "error": describe(exc)}
+        )
+        message = operator_interface.models.Message.objects.get(id=mid)
+        message.state = operator_interface.models.Message.FAILED
+        message.save()
+
+
+def replay(dead_letters) -> typing.List[int]:
+    with transaction.atomic():
+        mids = list(
+            dead_letters.select_for_update().values_list("message_id", flat=True)
+        )
+        operator_interface.models.DeadLetter.objects.filter(message_id__in=mids).delete()
+        messages = list(
+            operator_interface.models.Message.objects.filter(id__in=mids).select_related("platform")
+        )
+        for message in messages:
+            message.state = operator_interface.models.Message.SENDING
+            message.save()
+
+    # Replaying a backlog all at once would blow straight through the platform's rate limit
+    for message in messages:
+        operator_interface.tasks.queue_outbound_message(message.platform, message.id)
+    return mids
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from operator_interface import models
+
+
+class Command(BaseCommand):
+    help = "Recalculates the denormalised message activity columns on conversations and platforms"
+    requires_migrations_checks = True
+
+    def handle(self, *args, **options):
+        conversations = models.Conversation.objects.all()
+        models.refresh_activity(conversations)
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated {conversations.count()} conversations")
+        )
@@ -0,0 +1,191 @@
+import datetime
+import random
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from operator_interface import models
+
+INDEXES = [
+    (models.Conversation, "conversation_user_id_idx"),
+    (models.Message, "message_platform_direction_idx"),
+    (models.Message, "message_platform_timestamp_idx"),
+    (models.Message, "platform_message_id_idx"),
+    (models.Message, "message_payment_request_idx"),
+]
+CONSTRAINTS = [(models.ConversationPlatform, "unique_platform_id")]
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway messaging dataset and prints the query plans of the hot " \
+           "lookups with and without their indexes. All changes are rolled back at the end, " \
+           "but the tables are locked while it runs so don't point it at production."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000000)
+        parser.add_argument("--conversations", type=int, default=25000)
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sample = self.seed(
+                options["conversations"], options["messages"], options["batch_size"]
+            )
+
+            with transaction.atomic():
+                self.drop_indexes()
+                self.explain("Without indexes", sample)
+                transaction.set_rollback(True)
+
+            self.explain("With indexes", sample)
+            transaction.set_rollback(True)
+
+    def seed(self, conversation_count, message_count, batch_size):
+        self.stdout.write(
+            f"Seeding {conversation_count} conversations and {message_count} messages"
+        )
+        platform_types = [p[0] for p in models.ConversationPlatform.PLATFORM_CHOICES]
+
+        models.Conversation.objects.bulk_create(
+            [
+                models.Conversation(
+                    conversation_name=f"Benchmark {i}",
+                    conversation_user_id=uuid.uuid4() if i % 3 else None,
+                )
+                for i in range(conversation_count)
+            ],
+            batch_size=batch_size,
+        )
+        conversations = list(
+            models.Conversation.objects.filter(conversation_name__startswith="Benchmark ")
+        )
+
+        models.ConversationPlatform.objects.bulk_create(
+            [
+                models.ConversationPlatform(
+                    conversation=conversation,
+                    platform=platform_type,
+                    platform_id=f"benchmark-{conversation.id}-{platform_type}",
+                )
+                for conversation in conversations
+                for platform_type in random.sample(platform_types, random.randint(1, 3))
+            ],
+            batch_size=batch_size,
+        )
+        platforms = list(
+            models.ConversationPlatform.objects.filter(platform_id__startswith="benchmark-")
+        )
+
+        now = timezone.now()
+        created = 0
+        while created < message_count:
+            batch = []
+            for _ in range(min(batch_size, message_count - created)):
+                batch.append(
+                    models.Message(
+                        platform=random.choice(platforms),
+                        direction=random.choice(
+                            (models.Message.FROM_CUSTOMER, models.Message.TO_CUSTOMER)
+                        ),
+                        text="Benchmark",
+                        timestamp=now - datetime.timedelta(
+                            seconds=random.randint(0, 60 * 60 * 24 * 365)
+                        ),
+                        platform_message_id=uuid.uuid4().hex,
+                        payment_request=uuid.uuid4() if random.random() < 0.01 else None,
+                    )
+                )
+            models.Message.objects.bulk_create(batch)
+            created += len(batch)
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                for model in (models.Conversation, models.ConversationPlatform, models.Message):
+                    cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+        platform = random.choice(platforms)
+        message = models.Message.objects.filter(platform=platform).first() \
+            or models.Message.objects.first()
+        return {
+            "platform": platform,
+            "message": message,
+            "payment_request": models.Message.objects.exclude(payment_request=None)
+            .values_list("payment_request", flat=True).first(),
+            "conversation_user_id": next(
+                (c.conversation_user_id for c in conversations if c.conversation_user_id), None
+            ),
+        }
+
+    def drop_indexes(self):
+        schema_editor = connection.schema_editor()
+        statements = [
+            next(i for i in model._meta.indexes if i.name == name).remove_sql(
+                model, schema_editor
+            )
+            for model, name in INDEXES
+        ]
+        if connection.vendor == "postgresql":
+            statements.extend(
+                next(c for c in model._meta.constraints if c.name == name).remove_sql(
+                    model, schema_editor
+                )
+                for model, name in CONSTRAINTS
+            )
+
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(str(statement))
+
+    def explain(self, title, sample):
+        platform = sample["platform"]
+        message = sample["message"]
+        queries = [
+            (
+                "ConversationPlatform.exists",
+                models.ConversationPlatform.objects.filter(
+                    platform=platform.platform, platform_id=platform.platform_id
+                ),
+            ),
+            (
+                "Message.message_exits",
+                models.Message.objects.filter(
+                    platform=message.platform_id,
+                    platform_message_id=message.platform_message_id,
+                ),
+            ),
+            (
+                "Reply/status lookup by platform_message_id",
+                models.Message.objects.filter(platform_message_id=message.platform_message_id),
+            ),
+            (
+                "Message by payment_request",
+                models.Message.objects.filter(payment_request=sample["payment_request"]),
+            ),
+            (
+                "Conversation by conversation_user_id",
+                models.Conversation.objects.filter(
+                    conversation_user_id=sample["conversation_user_id"]
+                ),
+            ),
+            (
+                "Last inbound message (can_message)",
+                platform.messages.order_by("-timestamp")
+                .filter(direction=models.Message.FROM_CUSTOMER)[:1],
+            ),
+            (
+                "Latest message window (send_conversation)",
+                platform.messages.order_by("-timestamp")[:50],
+            ),
+        ]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_LABEL(f"  {name}"))
+            if connection.vendor == "postgresql":
+                plan = queryset.explain(analyze=True)
+            else:
+                plan = queryset.explain()
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
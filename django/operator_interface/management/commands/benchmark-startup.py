@@ -0,0 +1,79 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+ENTRY_POINTS = {
+    "manage": ["manage.py", "check"],
+    "celery": ["-c", "from wewillfixyourpc_bot.celery import app; app.loader.import_default_modules()"],
+    "asgi": ["-c", "import wewillfixyourpc_bot.asgi"],
+}
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+class Command(BaseCommand):
+    help = "Times a cold start of the manage.py, Celery and ASGI entry points in fresh interpreters " \
+           "and lists the slowest imports, as reported by python -X importtime. Use --json and " \
+           "redirect the output (>> startup.jsonl) to track results over time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("entry_points", nargs="*", help=f"Any of {', '.join(ENTRY_POINTS)}, defaults to all")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per entry point, the fastest is kept")
+        parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+        parser.add_argument("--json", action="store_true", help="Print one JSON object per line for each entry point")
+
+    def handle(self, *args, **options):
+        unknown = set(options["entry_points"]) - set(ENTRY_POINTS)
+        if unknown:
+            raise CommandError(f"Unknown entry points: {', '.join(sorted(unknown))}")
+
+        for name in options["entry_points"] or ENTRY_POINTS:
+            wall, imports = min(
+                (self.run(ENTRY_POINTS[name]) for _ in range(options["repeat"])),
+                key=lambda run: run[0],
+            )
+            top_level = sum(cumulative for cumulative, depth, _ in imports if depth == 0)
+            slowest = sorted(
+                ((cumulative, module) for cumulative, _, module in imports), reverse=True
+            )[:options["top"]]
+
+            if options["json"]:
+                self.stdout.write(json.dumps({
+                    "timestamp": timezone.now().isoformat(),
+                    "release": os.getenv("RELEASE"),
+                    "entry_point": name,
+                    "wall_ms": round(wall * 1000),
+                    "import_ms": round(top_level / 1000),
+                    "slowest": [[module, round(cumulative / 1000)] for cumulative, module in slowest],
+                }))
+                continue
+
+            self.stdout.write(f"{name}: {wall * 1000:.0f}ms wall, {top_level / 1000:.0f}ms importing")
+            for cumulative, module in slowest:
+                self.stdout.write(f"  {cumulative / 1000:>8.1f}ms  {module}")
+
+    def run(self, args):
+        start = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *args],
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        wall = time.monotonic() - start
+        if result.returncode != 0:
+            raise CommandError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+
+        imports = []
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                imports.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+        return wall, imports
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+import wewillfixyourpc_bot.http_client
+
+
+class Command(BaseCommand):
+    help = "Shows outbound HTTP request counts, outcomes and latency histograms per host"
+
+    def handle(self, *args, **options):
+        buckets = [f"le_{b}" for b in wewillfixyourpc_bot.http_client.LATENCY_BUCKETS] + ["le_inf"]
+
+        for host, events in sorted(wewillfixyourpc_bot.http_client.get_stats().items()):
+            total = events.get("requests", 0)
+            self.stdout.write(self.style.MIGRATE_HEADING(host))
+            self.stdout.write(f"  requests: {total}")
+            for event, count in sorted(events.items()):
+                if event.startswith("status_") or event.startswith("error_"):
+                    self.stdout.write(f"  {event}: {count}")
+
+            cumulative = 0
+            for bucket in buckets:
+                cumulative += events.get(bucket, 0)
+                share = cumulative / total if total else 0
+                self.stdout.write(f"  {bucket[3:]:>5}s: {cumulative:>8} ({share:.1%})")
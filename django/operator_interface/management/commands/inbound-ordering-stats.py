@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+import operator_interface.ordering
+
+
+class Command(BaseCommand):
+    help = "Shows how long inbound message tasks waited for their conversation's ordering lock"
+
+    def handle(self, *args, **options):
+        stats = operator_interface.ordering.get_stats()
+        acquired = stats.get("acquired", 0)
+        total = acquired + stats.get("timeouts", 0)
+
+        self.stdout.write(f"acquired: {acquired}, timed out: {stats.get('timeouts', 0)}")
+        self.stdout.write(
+            f"messages handled by another message's task: {stats.get('handled_for_other_task', 0)}"
+        )
+        if total:
+            self.stdout.write(f"mean wait: {stats.get('wait_ms', 0) / total:.0f}ms")
+
+        cumulative = 0
+        for bucket in [f"wait_le_{b}" for b in operator_interface.ordering.WAIT_BUCKETS] + ["wait_le_inf"]:
+            cumulative += stats.get(bucket, 0)
+            share = cumulative / total if total else 0
+            self.stdout.write(f"  {bucket[8:]:>5}s: {cumulative:>8} ({share:.1%})")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+import operator_interface.consumers
+
+
+class Command(BaseCommand):
+    help = "Shows how many operator interface broadcasts were sent and how many were coalesced away"
+
+    def handle(self, *args, **options):
+        for kind, stats in sorted(operator_interface.consumers.get_event_stats().items()):
+            sent = stats.get("sent", 0)
+            suppressed = stats.get("suppressed", 0)
+            self.stdout.write(f"{kind}: {sent} sent, {suppressed} suppressed")
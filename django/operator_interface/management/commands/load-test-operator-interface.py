@@ -0,0 +1,87 @@
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Opens increasing numbers of concurrent operator interface sockets against a running " \
+           "ASGI server and reports how many it sustains. Each socket repeatedly loads the " \
+           "first page of conversations, like a freshly opened operator tab does."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="ws://localhost:8000/ws/operator/")
+        parser.add_argument(
+            "--session-id", required=True,
+            help="Session cookie of a logged in staff user",
+        )
+        parser.add_argument("--connections", type=int, nargs="+", default=[25, 50, 100, 200, 400])
+        parser.add_argument("--requests", type=int, default=5)
+        parser.add_argument("--timeout", type=float, default=10)
+        parser.add_argument("--max-failure-rate", type=float, default=0.01)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        sustained = 0
+        for connections in options["connections"]:
+            latencies, failures = await self.run_level(connections, options)
+            total = connections * options["requests"]
+            failure_rate = failures / total
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{connections} sockets"))
+            self.stdout.write(f"  requests: {total}, failed: {failures} ({failure_rate:.1%})")
+            if latencies:
+                latencies.sort()
+                self.stdout.write(
+                    f"  latency p50: {statistics.median(latencies) * 1000:.0f}ms, "
+                    f"p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms, "
+                    f"max: {latencies[-1] * 1000:.0f}ms"
+                )
+            if failure_rate > options["max_failure_rate"]:
+                break
+            sustained = connections
+
+        self.stdout.write(self.style.SUCCESS(f"Sustained {sustained} concurrent sockets"))
+
+    async def run_level(self, connections, options):
+        cookies = {settings.SESSION_COOKIE_NAME: options["session_id"]}
+        async with aiohttp.ClientSession(cookies=cookies) as session:
+            results = await asyncio.gather(*(
+                self.run_socket(session, options) for _ in range(connections)
+            ))
+
+        latencies = [latency for socket_latencies, _ in results for latency in socket_latencies]
+        failures = sum(socket_failures for _, socket_failures in results)
+        return latencies, failures
+
+    async def run_socket(self, session: aiohttp.ClientSession, options):
+        latencies = []
+        try:
+            ws = await asyncio.wait_for(session.ws_connect(options["url"]), options["timeout"])
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return latencies, options["requests"]
+
+        async with ws:
+            for i in range(options["requests"]):
+                start = time.monotonic()
+                try:
+                    await ws.send_json({"type": "getConversations", "offset": 0})
+                    await asyncio.wait_for(self.wait_for_resync(ws), options["timeout"])
+                except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError):
+                    return latencies, options["requests"] - i
+                latencies.append(time.monotonic() - start)
+
+        return latencies, 0
+
+    @staticmethod
+    async def wait_for_resync(ws: aiohttp.ClientWebSocketResponse):
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            if msg.json().get("type") == "resync":
+                return
+        raise ConnectionError("Socket closed")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+import operator_interface.rate_limit
+
+
+class Command(BaseCommand):
+    help = "Shows how many outbound messages each platform's rate limit has delayed, " \
+           "how long they waited and how many are still queued"
+
+    def handle(self, *args, **options):
+        buckets = [f"wait_le_{b}" for b in operator_interface.rate_limit.WAIT_BUCKETS] + ["wait_le_inf"]
+
+        for platform, stats in sorted(operator_interface.rate_limit.get_stats().items()):
+            immediate = stats.get("immediate", 0)
+            delayed = stats.get("delayed", 0)
+            total = immediate + delayed
+            sent_from_queue = stats.get("sent_from_queue", 0)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(platform))
+            self.stdout.write(f"  queue depth: {stats['queue_depth']} ({stats['queue_overdue']} overdue)")
+            self.stdout.write(f"  sent immediately: {immediate}, delayed: {delayed}")
+            if total:
+                self.stdout.write(f"  mean wait: {stats.get('wait_ms', 0) / total:.0f}ms")
+            if sent_from_queue:
+                self.stdout.write(
+                    f"  mean worker lag past slot: {stats.get('lag_ms', 0) / sent_from_queue:.0f}ms"
+                )
+
+            cumulative = 0
+            for bucket in buckets:
+                cumulative += stats.get(bucket, 0)
+                share = cumulative / total if total else 0
+                self.stdout.write(f"  {bucket[8:]:>5}s: {cumulative:>8} ({share:.1%})")
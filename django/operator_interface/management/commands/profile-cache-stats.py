@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+import operator_interface.profiles
+
+
+class Command(BaseCommand):
+    help = "Shows how many Keycloak profile lookups have been served from cache"
+
+    def handle(self, *args, **options):
+        shared = operator_interface.profiles.get_stats()["shared"]
+        hits = shared.get("redis_hit", 0)
+        misses = shared.get("miss", 0)
+        total = hits + misses
+
+        self.stdout.write(f"Redis hits: {hits}")
+        self.stdout.write(f"Keycloak fetches: {misses}")
+        if total:
+            self.stdout.write(f"Hit rate: {hits / total:.1%}")
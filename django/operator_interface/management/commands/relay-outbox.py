@@ -0,0 +1,33 @@
+import time
+
+import kombu.exceptions
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+import operator_interface.outbox
+
+
+class Command(BaseCommand):
+    help = "Publishes message dispatches that missed their post-commit publish to Celery, in batches"
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the outbox once and exit")
+
+    def handle(self, *args, **options):
+        batch_size = settings.OUTBOX_RELAY_BATCH_SIZE
+        while True:
+            close_old_connections()
+            try:
+                relayed = operator_interface.outbox.relay_pending(batch_size)
+            except kombu.exceptions.OperationalError as e:
+                self.stderr.write(f"Broker unavailable: {e}")
+                relayed = 0
+
+            if relayed:
+                self.stdout.write(f"Relayed {relayed} outbox entries")
+            if relayed < batch_size:
+                if options["once"]:
+                    return
+                time.sleep(settings.OUTBOX_RELAY_INTERVAL)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+import operator_interface.users
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the local phone number and email index of Keycloak customers"
+    requires_migrations_checks = True
+
+    def handle(self, *args, **options):
+        count = operator_interface.users.sync_users()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} customer identities"))
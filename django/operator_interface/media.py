@@ -0,0 +1,237 @@
+import hashlib
+import mimetypes
+import os.path
+import tempfile
+import typing
+import urllib.parse
+
+import magic
+import redis.exceptions
+import requests
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import DefaultStorage
+
+import operator_interface.models
+import wewillfixyourpc_bot.http_client
+import wewillfixyourpc_bot.redis_client
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+MIME_SNIFF_SIZE = 2048
+URL_KEY = "outbound_media_url:{}"
+URL_TTL = 60 * 60 * 24
+PROVIDER_ID_KEY = "outbound_media_id:{}:{}"
+PROVIDER_LOCK_KEY = "outbound_media_lock:{}:{}"
+INGEST_LOCK_KEY = "media_ingest_lock:{}"
+INGEST_LOCK_TIMEOUT = 60
+INGEST_LOCK_WAIT = 30
+UPLOAD_LOCK_TIMEOUT = 300
+UPLOAD_LOCK_WAIT = 120
+
+
+class MediaError(Exception):
+    pass
+
+
+class MediaTooLarge(MediaError):
+    pass
+
+
+def _path(digest: str, name: str, content_type: str) -> str:
+    ext = os.path.splitext(name)[1].lower() or mimetypes.guess_extension(content_type) or ""
+    return f"media/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def _dimensions(f, content_type: str) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+    if not content_type.startswith("image/"):
+        return None, None
+    try:
+        with Image.open(f) as img:
+            return img.size
+    except (UnidentifiedImageError, OSError):
+        return None, None
+
+
+def ingest_chunks(
+        chunks: typing.Iterable[bytes], name: str, max_size: typing.Optional[int] = None
+) -> operator_interface.models.MediaObject:
+    max_size = max_size or settings.MEDIA_MAX_SIZE
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+
+    # The content addressed path isn't known until the last chunk, so spool to a temporary
+    # file that only spills to disk for larger files rather than holding it all in memory
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as f:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise MediaTooLarge(f"{name} is larger than {max_size} bytes")
+            if len(head) < MIME_SNIFF_SIZE:
+                head += chunk[:MIME_SNIFF_SIZE - len(head)]
+            digest.update(chunk)
+            f.write(chunk)
+
+        digest = digest.hexdigest()
+        existing = operator_interface.models.MediaObject.objects.filter(sha256=digest).first()
+        if existing:
+            return existing
+
+        content_type = magic.from_buffer(head, mime=True)
+        f.seek(0)
+        width, height = _dimensions(f, content_type)
+
+        # Two workers ingesting the same file would both find nothing stored, and storage renames
+        # the second save rather than overwriting, so store under a lock on the digest
+        lock = wewillfixyourpc_bot.redis_client.get_client().lock(
+            INGEST_LOCK_KEY.format(digest), timeout=INGEST_LOCK_TIMEOUT, blocking_timeout=INGEST_LOCK_WAIT
+        )
+        try:
+            acquired = lock.acquire()
+        except redis.exceptions.RedisError:
+            acquired = False
+
+        try:
+            existing = operator_interface.models.MediaObject.objects.filter(sha256=digest).first()
+            if existing:
+                return existing
+
+            fs = DefaultStorage()
+            path = _path(digest, name, content_type)
+            if not fs.exists(path):
+                f.seek(0)
+                saved = fs.save(path, File(f))
+                # Only possible when the lock couldn't be taken, the content is identical either way
+                if saved != path:
+                    fs.delete(saved)
+
+            media, _ = operator_interface.models.MediaObject.objects.get_or_create(
+                sha256=digest,
+                defaults={
+                    "path": path,
+                    "name": name,
+                    "size": size,
+                    "content_type": content_type,
+                    "width": width,
+                    "height": height,
+                },
+            )
+            return media
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.exceptions.RedisError:
+                    pass
+
+
+def ingest_file(f, name: str, max_size: typing.Optional[int] = None) -> operator_interface.models.MediaObject:
+    return ingest_chunks(iter(lambda: f.read(CHUNK_SIZE), b""), name, max_size)
+
+
+def ingest_response(
+        r: requests.Response, name: str, max_size: typing.Optional[int] = None
+) -> operator_interface.models.MediaObject:
+    max_size = max_size or settings.MEDIA_MAX_SIZE
+    with r:
+        if int(r.headers.get("Content-Length") or 0) > max_size:
+            raise MediaTooLarge(f"{name} is larger than {max_size} bytes")
+        try:
+            return ingest_chunks(r.iter_content(CHUNK_SIZE), name, max_size)
+        except requests.exceptions.RequestException as e:
+            raise MediaError(f"Failed to download {name}: {e}") from e
+
+
+def ingest_url(
+        url: str, name: typing.Optional[str] = None, max_size: typing.Optional[int] = None, **kwargs
+) -> operator_interface.models.MediaObject:
+    name = name or os.path.basename(requests.utils.urlparse(url).path)
+    try:
+        r = wewillfixyourpc_bot.http_client.get(url, stream=True, **kwargs)
+        r.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise MediaError(f"Failed to download {name}: {e}") from e
+    return ingest_response(r, name, max_size)
+
+
+def _storage_path(url: str) -> typing.Optional[str]:
+    base_url = DefaultStorage().base_url
+    if url.startswith(base_url):
+        return urllib.parse.unquote(url[len(base_url):])
+    return None
+
+
+def resolve(url: str) -> operator_interface.models.MediaObject:
+    path = _storage_path(url)
+    if path:
+        media = operator_interface.models.MediaObject.objects.filter(path=path).first()
+        if media:
+            return media
+
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    try:
+        digest = client.get(URL_KEY.format(url))
+    except redis.exceptions.RedisError:
+        digest = None
+    if digest:
+        media = operator_interface.models.MediaObject.objects.filter(sha256=digest.decode()).first()
+        if media:
+            return media
+
+    fs = DefaultStorage()
+    if path and fs.exists(path):
+        with fs.open(path, "rb") as f:
+            media = ingest_file(f, os.path.basename(path))
+    else:
+        media = ingest_url(url)
+
+    try:
+        client.set(URL_KEY.format(url), media.sha256, ex=URL_TTL)
+    except redis.exceptions.RedisError:
+        pass
+    return media
+
+
+def provider_media_id(
+        provider: str, media: operator_interface.models.MediaObject, upload: typing.Callable[[], str], ttl: int
+) -> str:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    key = PROVIDER_ID_KEY.format(provider, media.sha256)
+    try:
+        cached = client.get(key)
+    except redis.exceptions.RedisError:
+        return upload()
+    if cached:
+        return cached.decode()
+
+    # Sending the same image to many customers at once would otherwise have every worker
+    # upload it in parallel, so one uploads while the rest wait for its id
+    lock = client.lock(
+        PROVIDER_LOCK_KEY.format(provider, media.sha256),
+        timeout=UPLOAD_LOCK_TIMEOUT,
+        blocking_timeout=UPLOAD_LOCK_WAIT,
+    )
+    try:
+        acquired = lock.acquire()
+    except redis.exceptions.RedisError:
+        acquired = False
+
+    try:
+        if acquired:
+            cached = client.get(key)
+            if cached:
+                return cached.decode()
+        media_id = upload()
+        try:
+            client.set(key, media_id, ex=ttl)
+        except redis.exceptions.RedisError:
+            pass
+        return media_id
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.exceptions.RedisError:
+                pass
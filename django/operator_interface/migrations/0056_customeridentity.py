@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0055_presetmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerIdentity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identity_type', models.CharField(choices=[('P', 'Phone number'), ('E', 'Email')], max_length=1)),
+                ('value', models.CharField(max_length=255)),
+                ('user_id', models.UUIDField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='customeridentity',
+            index=models.Index(fields=['identity_type', 'value'], name='operator_in_identit_acdf21_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:49
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_platforms(apps, schema_editor):
+    ConversationPlatform = apps.get_model("operator_interface", "ConversationPlatform")
+    Message = apps.get_model("operator_interface", "Message")
+    duplicates = (
+        ConversationPlatform.objects.values("platform", "platform_id")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        platforms = list(
+            ConversationPlatform.objects.filter(
+                platform=duplicate["platform"], platform_id=duplicate["platform_id"]
+            ).order_by("id")
+        )
+        for platform in platforms[1:]:
+            Message.objects.filter(platform=platform).update(platform=platforms[0])
+            platform.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0056_customeridentity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['conversation_user_id'], name='conversation_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['platform', 'direction', 'timestamp'], name='message_platform_direction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['platform_message_id'], name='platform_message_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['payment_request'], name='message_payment_request_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_platforms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversationplatform',
+            constraint=models.UniqueConstraint(fields=('platform', 'platform_id'), name='unique_platform_id'),
+        ),
+    ]
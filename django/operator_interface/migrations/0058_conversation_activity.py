@@ -0,0 +1,116 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:52
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def activity_subqueries(messages):
+    inbound = messages.filter(direction="O")
+    last_outbound = messages.filter(direction="I").order_by("-timestamp")
+    unread = inbound.filter(
+        timestamp__gt=Coalesce(
+            Subquery(last_outbound.values("timestamp")[:1]),
+            Value(
+                datetime.datetime.min.replace(tzinfo=datetime.timezone.utc),
+                output_field=models.DateTimeField(),
+            ),
+        )
+    )
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(
+                queryset.order_by()
+                .annotate(count=Func(F("id"), function="COUNT"))
+                .values("count")
+            ),
+            0,
+        )
+
+    def last(queryset):
+        return Subquery(queryset.order_by("-timestamp").values("timestamp")[:1])
+
+    return {
+        "last_message_at": last(messages),
+        "last_inbound_at": last(inbound),
+        "message_count": count(messages),
+        "unread_count": count(unread),
+    }
+
+
+def backfill_activity(apps, schema_editor):
+    Conversation = apps.get_model("operator_interface", "Conversation")
+    ConversationPlatform = apps.get_model("operator_interface", "ConversationPlatform")
+    Message = apps.get_model("operator_interface", "Message")
+
+    ConversationPlatform.objects.update(
+        **activity_subqueries(Message.objects.filter(platform=OuterRef("pk")))
+    )
+    Conversation.objects.update(
+        **activity_subqueries(
+            Message.objects.filter(platform__conversation=OuterRef("pk"))
+        )
+    )
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0057_messaging_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_inbound_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversationplatform',
+            name='last_inbound_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationplatform',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationplatform',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversationplatform',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['-last_message_at'], name='conversation_last_message_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationplatform',
+            index=models.Index(fields=['conversation', '-last_message_at'], name='platform_last_message_idx'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
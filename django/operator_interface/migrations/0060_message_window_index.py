@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0059_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['platform', '-timestamp'], name='message_platform_timestamp_idx'),
+        ),
+    ]
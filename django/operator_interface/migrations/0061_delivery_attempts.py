@@ -0,0 +1,43 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0060_message_window_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryAttempt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.PositiveSmallIntegerField()),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('outcome', models.CharField(choices=[('D', 'Delivered'), ('R', 'Retrying'), ('F', 'Failed')], max_length=1)),
+                ('error', models.TextField(blank=True, default='')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_attempts', to='operator_interface.message')),
+            ],
+            options={
+                'ordering': ('timestamp',),
+            },
+        ),
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField()),
+                ('error', models.TextField(blank=True, default='')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letter', to='operator_interface.message')),
+            ],
+            options={
+                'ordering': ('timestamp',),
+            },
+        ),
+    ]
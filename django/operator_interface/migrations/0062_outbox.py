@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0061_delivery_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entries', to='operator_interface.message')),
+            ],
+            options={
+                'verbose_name_plural': 'outbox entries',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxentry',
+            index=models.Index(fields=['created_at'], name='outbox_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0063_media_objects'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='picture_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='picture_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0064_profile_picture_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customeridentity',
+            name='indexed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='customeridentity',
+            name='user_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='customeridentity',
+            constraint=models.UniqueConstraint(fields=('identity_type', 'value', 'user_id'), name='unique_customer_identity'),
+        ),
+    ]
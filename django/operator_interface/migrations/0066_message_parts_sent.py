@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operator_interface', '0065_customer_identity_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='parts_sent',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
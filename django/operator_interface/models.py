@@ -1,14 +1,20 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 import json
+import logging
 import uuid
 import datetime
-import django_keycloak_auth.users
 import keycloak.exceptions
 import re
-from django.db.models import Count
+from django.db.models import Case, When, Value, F, Func, Q, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.core.files.storage import DefaultStorage
+
+import operator_interface.profile_pictures
+import operator_interface.profiles
+
+logger = logging.getLogger(__name__)
 
 
 class UserProfile(models.Model):
@@ -16,15 +22,25 @@ class UserProfile(models.Model):
         User, on_delete=models.CASCADE, related_name="userprofile"
     )
     picture = models.ImageField()
+    picture_hash = models.CharField(max_length=64, blank=True, default="")
+    picture_updated_at = models.DateTimeField(blank=True, null=True)
     fb_persona_id = models.CharField(max_length=255, blank=True, null=True)
     as207960_persona_id = models.CharField(max_length=255, blank=True, null=True)
 
     def save(self, *args, **kwargs):
+        picture_changed = self.pk is None
         if self.pk is not None:
             old = UserProfile.objects.get(pk=self.pk)
             if self.picture.name != old.picture.name:
                 self.fb_persona_id = None
+                picture_changed = True
         super().save(*args, **kwargs)
+        if picture_changed and self.picture:
+            # The profile is already saved, a picture that can't be read is left to the view to retry
+            try:
+                operator_interface.profile_pictures.refresh(self)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Couldn't generate profile picture variants for {self.user_id}: {e}")
 
 
 class NotificationSubscription(models.Model):
@@ -40,6 +56,20 @@ class NotificationSubscription(models.Model):
         self.subscription_info = json.dumps(value)
 
 
+ACTIVITY_FIELDS = ("last_message_at", "last_inbound_at", "message_count", "unread_count")
+
+
+def _exclude_activity(instance: models.Model, kwargs: dict) -> None:
+    # Activity is only written by F() updates and refresh_activity, so a full save from an
+    # instance loaded before the latest message would put back its out of date counts
+    if instance._state.adding or kwargs.get("update_fields") is not None or kwargs.get("force_insert"):
+        return
+    kwargs["update_fields"] = [
+        f.name for f in instance._meta.concrete_fields
+        if not f.primary_key and f.name not in ACTIVITY_FIELDS
+    ]
+
+
 class Conversation(models.Model):
     agent_responding = models.BooleanField(default=False)
     current_agent = models.ForeignKey(
@@ -48,30 +78,42 @@ class Conversation(models.Model):
     conversation_user_id = models.UUIDField(blank=True, null=True)
     conversation_name = models.CharField(max_length=255, blank=True, null=True)
     conversation_pic = models.ImageField(blank=True, null=True)
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    last_inbound_at = models.DateTimeField(blank=True, null=True)
+    message_count = models.PositiveIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation_user_id"], name="conversation_user_id_idx"),
+            models.Index(fields=["-last_message_at"], name="conversation_last_message_idx"),
+            models.Index(fields=["updated_at"], name="conversation_updated_at_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        _exclude_activity(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         if not self.conversation_user_id:
             return self.conversation_name if self.conversation_name else "Unknown"
         try:
-            user = django_keycloak_auth.users.get_user_by_id(
-                self.conversation_user_id
-            ).user
+            user = operator_interface.profiles.get_user(self.conversation_user_id)
         except keycloak.exceptions.KeycloakClientError as e:
             return self.conversation_name if self.conversation_name else "Unknown"
         return f"{user.get('firstName')} {user.get('lastName')}"
 
     def last_platform(self):
-        messages = Message.objects.filter(platform__conversation=self)
-        last_message = messages.order_by("-timestamp").first()
-        if last_message is None:
-            return None
-        return last_message.platform
+        return (
+            self.conversationplatform_set.filter(message_count__gte=1)
+            .order_by("-last_message_at")
+            .first()
+        )
 
     def last_usable_platform(self, tag=None, alert=False, text=None):
-        platforms = (
-            self.conversationplatform_set.annotate(page_count=Count("messages"))
-            .filter(page_count__gte=1)
-            .order_by("-messages__timestamp")
+        platforms = self.conversationplatform_set.filter(message_count__gte=1).order_by(
+            "-last_message_at"
         )
         for platform in platforms:
             if platform.can_message(tag, alert, text):
@@ -81,11 +123,15 @@ class Conversation(models.Model):
     def update_user_id(self, user_id):
         if user_id == self.conversation_user_id:
             return self
+        operator_interface.profiles.invalidate_user(self.conversation_user_id)
+        operator_interface.profiles.invalidate_user(user_id)
         other_conversation = Conversation.objects.filter(Q(conversation_user_id=user_id), ~Q(id=self.id))
         if len(other_conversation) > 0:
             for platform in self.conversationplatform_set.all():
                 platform.conversation = other_conversation[0]
                 platform.save()
+            refresh_activity(Conversation.objects.filter(id=other_conversation[0].id))
+            other_conversation[0].refresh_from_db()
             other_conversation[0].current_agent = self.current_agent
             other_conversation[0].agent_responding = self.agent_responding
             other_conversation[0].save()
@@ -134,6 +180,26 @@ class ConversationPlatform(models.Model):
     platform_id = models.CharField(max_length=255)
     additional_platform_data = models.TextField(blank=True, null=True)
     is_typing = models.BooleanField(default=False)
+    last_message_at = models.DateTimeField(blank=True, null=True)
+    last_inbound_at = models.DateTimeField(blank=True, null=True)
+    message_count = models.PositiveIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["platform", "platform_id"], name="unique_platform_id"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["conversation", "-last_message_at"], name="platform_last_message_idx"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        _exclude_activity(self, kwargs)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         platform = list(filter(lambda p: p[0] == self.platform, self.PLATFORM_CHOICES))
@@ -149,17 +215,28 @@ class ConversationPlatform(models.Model):
             return None
 
     @classmethod
-    def create(cls, platform, platform_id, customer_user_id=None):
-        conv = None
-        if customer_user_id is not None:
-            conv = Conversation.objects.filter(conversation_user_id=customer_user_id).first()
-        if conv is None:
-            conv = Conversation(conversation_user_id=customer_user_id)
-            conv.save()
-
-        plat = cls(platform=platform, platform_id=platform_id, conversation=conv)
-        plat.save()
-        return plat
+    def create(
+            cls, platform, platform_id, customer_user_id=None, conversation=None, conversation_name=None,
+            **kwargs
+    ):
+        try:
+            with transaction.atomic():
+                conv = conversation
+                if conv is None and customer_user_id is not None:
+                    conv = Conversation.objects.filter(conversation_user_id=customer_user_id).first()
+                if conv is None:
+                    conv = Conversation(
+                        conversation_user_id=customer_user_id, conversation_name=conversation_name
+                    )
+                    conv.save()
+
+                plat = cls(platform=platform, platform_id=platform_id, conversation=conv, **kwargs)
+                plat.save()
+                return plat
+        except IntegrityError:
+            # Lost a race with another first message from the same sender, the conversation
+            # created for this one rolled back with it
+            return cls.objects.get(platform=platform, platform_id=platform_id)
 
     @classmethod
     def is_whatsapp_template(cls, text):
@@ -173,6 +250,19 @@ class ConversationPlatform(models.Model):
 
         return any(t.fullmatch(text) for t in TEMPLATES)
 
+    def last_inbound(self):
+        if hasattr(self, "last_inbound_timestamp"):
+            return self.last_inbound_timestamp, self.last_inbound_end
+
+        last_message = (
+            self.messages.order_by("-timestamp")
+            .filter(direction=Message.FROM_CUSTOMER)
+            .first()
+        )
+        if last_message:
+            return last_message.timestamp, last_message.end
+        return None, None
+
     def can_message(self, tag=None, alert=False, text=None):
         if self.platform == self.FACEBOOK:
             if tag in [
@@ -182,22 +272,14 @@ class ConversationPlatform(models.Model):
             ]:
                 return True
             elif tag == "HUMAN_AGENT":
-                last_message = (
-                    self.messages.order_by("-timestamp")
-                    .filter(direction=Message.FROM_CUSTOMER)
-                    .first()
-                )
-                if last_message and last_message.timestamp > timezone.now() - datetime.timedelta(
+                last_inbound = self.last_inbound_at
+                if last_inbound and last_inbound > timezone.now() - datetime.timedelta(
                     days=7
                 ):
                     return True
             else:
-                last_message = (
-                    self.messages.order_by("-timestamp")
-                    .filter(direction=Message.FROM_CUSTOMER)
-                    .first()
-                )
-                if last_message and last_message.timestamp > timezone.now() - datetime.timedelta(
+                last_inbound = self.last_inbound_at
+                if last_inbound and last_inbound > timezone.now() - datetime.timedelta(
                     hours=24
                 ):
                     return True
@@ -206,12 +288,8 @@ class ConversationPlatform(models.Model):
             if text and self.is_whatsapp_template(text):
                 return True
             else:
-                last_message = (
-                    self.messages.order_by("-timestamp")
-                    .filter(direction=Message.FROM_CUSTOMER)
-                    .first()
-                )
-                if last_message and last_message.timestamp > timezone.now() - datetime.timedelta(
+                last_inbound = self.last_inbound_at
+                if last_inbound and last_inbound > timezone.now() - datetime.timedelta(
                     hours=24
                 ):
                     return True
@@ -231,11 +309,9 @@ class ConversationPlatform(models.Model):
             # return len(push) > 0
             return False
         elif self.platform == self.ABC:
-            last_message: Message = self.messages.order_by("-timestamp").filter(
-                direction=Message.FROM_CUSTOMER
-            ).first()
-            if last_message:
-                return not last_message.end
+            last_inbound, last_inbound_end = self.last_inbound()
+            if last_inbound:
+                return not last_inbound_end
             return True
         elif self.platform == self.EMAIL and alert:
             return False
@@ -243,6 +319,29 @@ class ConversationPlatform(models.Model):
             return True
 
 
+class CustomerIdentity(models.Model):
+    PHONE = "P"
+    EMAIL = "E"
+    IDENTITY_TYPES = ((PHONE, "Phone number"), (EMAIL, "Email"))
+
+    identity_type = models.CharField(max_length=1, choices=IDENTITY_TYPES)
+    value = models.CharField(max_length=255)
+    user_id = models.UUIDField(db_index=True)
+    user_created_at = models.DateTimeField(blank=True, null=True)
+    indexed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["identity_type", "value"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["identity_type", "value", "user_id"], name="unique_customer_identity"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.value} - {self.user_id}"
+
+
 class ConversationRating(models.Model):
     sender_id = models.CharField(max_length=255)
     time = models.DateTimeField(auto_now_add=True)
@@ -290,13 +389,65 @@ class Message(models.Model):
     reply_to = models.ForeignKey("self", on_delete=models.SET_NULL, related_name="replies", blank=True, null=True)
     reaction = models.CharField(blank=True, null=True, max_length=5)
     device_data = models.CharField(blank=True, null=True, max_length=255)
+    parts_sent = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("timestamp",)
+        indexes = [
+            models.Index(fields=["updated_at"], name="message_updated_at_idx"),
+            models.Index(
+                fields=["platform", "direction", "timestamp"],
+                name="message_platform_direction_idx",
+            ),
+            models.Index(
+                fields=["platform", "-timestamp"], name="message_platform_timestamp_idx"
+            ),
+            models.Index(fields=["platform_message_id"], name="platform_message_id_idx"),
+            models.Index(fields=["payment_request"], name="message_payment_request_idx"),
+        ]
 
     def __str__(self):
         return f"{str(self.platform)} - {self.timestamp.isoformat()}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_platform_id = instance.__dict__.get("platform_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        loaded_platform_id = getattr(self, "_loaded_platform_id", None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self.record_activity()
+            elif loaded_platform_id is not None and loaded_platform_id != self.platform_id:
+                # Moved to another platform, e.g. falling back from WhatsApp to SMS
+                refresh_activity(Conversation.objects.filter(
+                    id__in=ConversationPlatform.objects.filter(
+                        id__in=[loaded_platform_id, self.platform_id]
+                    ).values("conversation_id")
+                ))
+        self._loaded_platform_id = self.platform_id
+
+    def record_activity(self):
+        updates = {
+            "message_count": F("message_count") + 1,
+            "last_message_at": latest_timestamp("last_message_at", self.timestamp),
+        }
+        if self.direction == self.FROM_CUSTOMER:
+            updates["last_inbound_at"] = latest_timestamp("last_inbound_at", self.timestamp)
+            updates["unread_count"] = F("unread_count") + 1
+        else:
+            updates["unread_count"] = 0
+
+        ConversationPlatform.objects.filter(id=self.platform_id).update(**updates)
+        Conversation.objects.filter(conversationplatform__id=self.platform_id).update(
+            updated_at=timezone.now(), **updates
+        )
+
     @classmethod
     def message_exits(cls, platform, message_id):
         try:
@@ -306,6 +457,87 @@ class Message(models.Model):
             return False
 
 
+class OutboxEntry(models.Model):
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, related_name="outbox_entries"
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("id",)
+        verbose_name_plural = "outbox entries"
+        indexes = [models.Index(fields=["created_at"], name="outbox_created_at_idx")]
+
+    def __str__(self):
+        return f"{self.message_id} - {self.created_at.isoformat()}"
+
+
+class DeliveryAttempt(models.Model):
+    DELIVERED = "D"
+    RETRYING = "R"
+    FAILED = "F"
+    OUTCOMES = (
+        (DELIVERED, "Delivered"),
+        (RETRYING, "Retrying"),
+        (FAILED, "Failed"),
+    )
+
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, related_name="delivery_attempts"
+    )
+    attempt = models.PositiveSmallIntegerField()
+    timestamp = models.DateTimeField(default=timezone.now)
+    latency_ms = models.PositiveIntegerField()
+    outcome = models.CharField(max_length=1, choices=OUTCOMES)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ("timestamp",)
+
+    def __str__(self):
+        return f"{self.message_id} - attempt {self.attempt}"
+
+
+class DeadLetter(models.Model):
+    message = models.OneToOneField(
+        Message, on_delete=models.CASCADE, related_name="dead_letter"
+    )
+    timestamp = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField()
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ("timestamp",)
+
+    def __str__(self):
+        return f"{self.message_id} - {self.error}"
+
+
+class MediaObject(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, blank=True, default="")
+    size = models.PositiveIntegerField()
+    content_type = models.CharField(max_length=255)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.sha256})"
+
+    @property
+    def url(self):
+        return DefaultStorage().url(self.path)
+
+    @property
+    def is_image(self):
+        return self.content_type.startswith("image/")
+
+    def open(self):
+        return DefaultStorage().open(self.path, "rb")
+
+
 class MessageSuggestion(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE)
     suggested_response = models.TextField()
@@ -330,3 +562,57 @@ class PresetMessage(models.Model):
 
     def __str__(self):
         return self.description
+
+
+def latest_timestamp(field, timestamp):
+    return Case(
+        When(**{f"{field}__gt": timestamp}, then=F(field)),
+        default=Value(timestamp, output_field=models.DateTimeField()),
+    )
+
+
+def activity_subqueries(messages):
+    inbound = messages.filter(direction=Message.FROM_CUSTOMER)
+    last_outbound = messages.filter(direction=Message.TO_CUSTOMER).order_by("-timestamp")
+    unread = inbound.filter(
+        timestamp__gt=Coalesce(
+            Subquery(last_outbound.values("timestamp")[:1]),
+            Value(
+                datetime.datetime.min.replace(tzinfo=datetime.timezone.utc),
+                output_field=models.DateTimeField(),
+            ),
+        )
+    )
+
+    def count(queryset):
+        return Coalesce(
+            Subquery(
+                queryset.order_by()
+                .annotate(count=Func(F("id"), function="COUNT"))
+                .values("count")
+            ),
+            0,
+        )
+
+    def last(queryset):
+        return Subquery(queryset.order_by("-timestamp").values("timestamp")[:1])
+
+    return {
+        "last_message_at": last(messages),
+        "last_inbound_at": last(inbound),
+        "message_count": count(messages),
+        "unread_count": count(unread),
+    }
+
+
+def refresh_activity(conversations):
+    with transaction.atomic():
+        ConversationPlatform.objects.filter(conversation__in=conversations).update(
+            **activity_subqueries(Message.objects.filter(platform=OuterRef("pk")))
+        )
+        conversations.update(
+            updated_at=timezone.now(),
+            **activity_subqueries(
+                Message.objects.filter(platform__conversation=OuterRef("pk"))
+            )
+        )
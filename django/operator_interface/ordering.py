@@ -0,0 +1,115 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+import typing
+
+import redis.exceptions
+import redis.lock
+from django.conf import settings
+
+import wewillfixyourpc_bot.redis_client
+
+LOCK_KEY = "inbound_lock:{}"
+PENDING_KEY = "inbound_pending:{}"
+REDIS_STATS_KEY = "inbound_ordering_stats"
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def _wait_bucket(wait: float) -> str:
+    i = bisect.bisect_left(WAIT_BUCKETS, wait)
+    return f"wait_le_{WAIT_BUCKETS[i]}" if i < len(WAIT_BUCKETS) else "wait_le_inf"
+
+
+def _record(client: redis.Redis, wait: float, acquired: bool) -> None:
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(REDIS_STATS_KEY, "acquired" if acquired else "timeouts", 1)
+        pipe.hincrby(REDIS_STATS_KEY, _wait_bucket(wait), 1)
+        pipe.hincrby(REDIS_STATS_KEY, "wait_ms", math.ceil(wait * 1000))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+@contextlib.contextmanager
+def _extended(lock: redis.lock.Lock):
+    # A slow handler can outlast the lock's timeout, so keep extending it for as long as it's held
+    stop = threading.Event()
+
+    def keep_alive():
+        while not stop.wait(settings.INBOUND_LOCK_TIMEOUT / 3):
+            try:
+                lock.reacquire()
+            except redis.exceptions.RedisError:
+                return
+
+    thread = threading.Thread(target=keep_alive, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def process_in_order(
+        cid: int, mid: int, handler: typing.Callable[[int], typing.Any], queued=False
+) -> None:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    pending_key = PENDING_KEY.format(cid)
+    if not queued:
+        try:
+            client.zadd(pending_key, {str(mid): mid})
+        except redis.exceptions.RedisError:
+            handler(mid)
+            return
+
+    # Whoever holds the conversation's lock handles every pending message in id order, so
+    # a message whose task started late is never handled before one that arrived earlier
+    lock = client.lock(
+        LOCK_KEY.format(cid),
+        timeout=settings.INBOUND_LOCK_TIMEOUT,
+        blocking_timeout=settings.INBOUND_LOCK_WAIT,
+        thread_local=False,
+    )
+    start = time.monotonic()
+    acquired = lock.acquire()
+    _record(client, time.monotonic() - start, acquired)
+    if not acquired:
+        raise LockTimeout(f"Timed out waiting for the inbound lock on conversation {cid}")
+
+    try:
+        with _extended(lock):
+            while True:
+                pending = client.zrange(pending_key, 0, 0)
+                if not pending:
+                    break
+                # Removed before handling so a failing message isn't retried by every later task
+                if not client.zrem(pending_key, pending[0]):
+                    continue
+                next_mid = int(pending[0])
+                if next_mid != mid:
+                    client.hincrby(REDIS_STATS_KEY, "handled_for_other_task", 1)
+                handler(next_mid)
+                try:
+                    lock.reacquire()
+                except redis.exceptions.LockError:
+                    # Someone else holds the lock now and will handle the rest
+                    client.hincrby(REDIS_STATS_KEY, "lock_lost", 1)
+                    break
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            pass
+
+
+def get_stats() -> typing.Dict[str, int]:
+    stats = wewillfixyourpc_bot.redis_client.get_client().hgetall(REDIS_STATS_KEY)
+    return {k.decode(): int(v) for k, v in stats.items()}
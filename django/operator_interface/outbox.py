@@ -0,0 +1,77 @@
+import datetime
+import logging
+
+import celery.result
+import kombu.exceptions
+import redis.exceptions
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+import operator_interface.models
+import operator_interface.tasks
+import wewillfixyourpc_bot.redis_client
+
+PROCESSED_KEY = "processed_message:{}"
+PROCESSED_TTL = 60 * 60 * 24
+TASK_ID = "outbox-{}"
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(message: operator_interface.models.Message) -> operator_interface.models.OutboxEntry:
+    with transaction.atomic():
+        message.save()
+        entry = operator_interface.models.OutboxEntry.objects.create(message=message)
+        transaction.on_commit(lambda: _relay_committed(entry.id))
+    return entry
+
+
+def result(entry: operator_interface.models.OutboxEntry) -> celery.result.AsyncResult:
+    return operator_interface.tasks.process_message.AsyncResult(TASK_ID.format(entry.id))
+
+
+def _relay_committed(entry_id: int) -> None:
+    try:
+        relay(operator_interface.models.OutboxEntry.objects.filter(id=entry_id))
+    except kombu.exceptions.OperationalError as e:
+        logger.warning(f"Couldn't publish outbox entry {entry_id}, leaving it for the relay: {e}")
+
+
+def relay(entries) -> int:
+    task = operator_interface.tasks.process_message
+    with transaction.atomic():
+        batch = list(entries.select_for_update(skip_locked=True).values_list("id", "message_id"))
+        if not batch:
+            return 0
+
+        # Entries are only deleted once every publish in the batch has gone through, so a broker
+        # failure part way leaves them all to be retried and consumers have to tolerate repeats
+        with task.app.producer_or_acquire() as producer:
+            for entry_id, mid in batch:
+                task.apply_async((mid,), producer=producer, task_id=TASK_ID.format(entry_id))
+        operator_interface.models.OutboxEntry.objects.filter(id__in=[i for i, _ in batch]).delete()
+    return len(batch)
+
+
+def is_processed(mid: int) -> bool:
+    # A relay can publish the same message more than once, repeats after the first was handled are skipped
+    try:
+        return bool(wewillfixyourpc_bot.redis_client.get_client().exists(PROCESSED_KEY.format(mid)))
+    except redis.exceptions.RedisError:
+        return False
+
+
+def mark_processed(mid: int) -> None:
+    try:
+        wewillfixyourpc_bot.redis_client.get_client().set(PROCESSED_KEY.format(mid), 1, ex=PROCESSED_TTL)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def relay_pending(limit: int) -> int:
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.OUTBOX_RELAY_GRACE)
+    return relay(
+        operator_interface.models.OutboxEntry.objects.filter(created_at__lte=cutoff)
+        .order_by("id")[:limit]
+    )
@@ -0,0 +1,78 @@
+import hashlib
+import io
+import typing
+
+from PIL import Image
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.base import ContentFile
+from django.core.files.storage import DefaultStorage
+from django.shortcuts import reverse
+from django.utils import timezone
+
+SIZES = (64, 128, 256)
+DEFAULT_SIZE = 64
+VARIANT_PATH = "profile_pictures/{}/{}.jpg"
+VERSION_LENGTH = 16
+VERSIONED_MAX_AGE = 60 * 60 * 24 * 365
+UNVERSIONED_MAX_AGE = 60 * 5
+
+
+def variant_size(size: typing.Optional[str]) -> int:
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return DEFAULT_SIZE
+    return next((s for s in SIZES if s >= size), SIZES[-1])
+
+
+def variant_path(digest: str, size: int) -> str:
+    return VARIANT_PATH.format(digest, size)
+
+
+def version(digest: str) -> str:
+    return digest[:VERSION_LENGTH]
+
+
+def refresh(profile) -> None:
+    with profile.picture.open("rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    fs = DefaultStorage()
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        for size in SIZES:
+            path = variant_path(digest, size)
+            if fs.exists(path):
+                continue
+            variant = img.copy()
+            variant.thumbnail((size, size))
+            out = io.BytesIO()
+            variant.save(out, "JPEG", quality=85, optimize=True)
+            fs.save(path, ContentFile(out.getvalue()))
+
+    old_digest = profile.picture_hash
+    profile.picture_hash = digest
+    profile.picture_updated_at = timezone.now()
+    type(profile).objects.filter(pk=profile.pk).update(
+        picture_hash=profile.picture_hash, picture_updated_at=profile.picture_updated_at
+    )
+
+    if old_digest and old_digest != digest and \
+            not type(profile).objects.filter(picture_hash=old_digest).exists():
+        for size in SIZES:
+            fs.delete(variant_path(old_digest, size))
+
+
+def url(user, size: int = DEFAULT_SIZE) -> str:
+    picture_url = settings.EXTERNAL_URL_BASE + reverse("operator:profile_pic", args=[user.id])
+    params = []
+    try:
+        if user.userprofile.picture_hash:
+            params.append(f"v={version(user.userprofile.picture_hash)}")
+    except ObjectDoesNotExist:
+        pass
+    if size != DEFAULT_SIZE:
+        params.append(f"size={size}")
+    return f"{picture_url}?{'&'.join(params)}" if params else picture_url
@@ -0,0 +1,84 @@
+import redis.exceptions
+from django.conf import settings
+
+import operator_interface.media
+import operator_interface.models
+import wewillfixyourpc_bot.http_client
+import wewillfixyourpc_bot.redis_client
+
+REFRESH_KEY = "profile_refresh:{}:{}"
+PICTURE_KEY = "profile_picture:{}"
+PICTURE_TTL = 60 * 60 * 24 * 30
+PENDING_TTL = 60 * 10
+
+
+def should_refresh(platform: str, platform_id: str) -> bool:
+    # Only a short claim is taken here to stop a burst of messages queueing duplicate refreshes,
+    # the full TTL is set by refreshed() so a failed refresh is retried on a later message
+    try:
+        return bool(wewillfixyourpc_bot.redis_client.get_client().set(
+            REFRESH_KEY.format(platform, platform_id), 1, nx=True, ex=PENDING_TTL
+        ))
+    except redis.exceptions.RedisError:
+        return True
+
+
+def refreshed(platform: str, platform_id: str) -> None:
+    try:
+        wewillfixyourpc_bot.redis_client.get_client().set(
+            REFRESH_KEY.format(platform, platform_id), 1, ex=settings.PROFILE_REFRESH_TTL
+        )
+    except redis.exceptions.RedisError:
+        pass
+
+
+def schedule(task, platform: str, platform_id: str, *args) -> None:
+    if should_refresh(platform, platform_id):
+        task.delay(*args)
+
+
+def save_picture(
+        conversation: operator_interface.models.Conversation, url: str, name: str, **kwargs
+) -> bool:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    key = PICTURE_KEY.format(conversation.id)
+    try:
+        cached = {k.decode(): v.decode() for k, v in client.hgetall(key).items()}
+    except redis.exceptions.RedisError:
+        cached = {}
+
+    headers = kwargs.pop("headers", {})
+    if conversation.conversation_pic and cached.get("url") == url:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    r = wewillfixyourpc_bot.http_client.get(url, headers=headers, stream=True, **kwargs)
+    if r.status_code != 200:
+        r.close()
+        return False
+
+    # Picture URLs are often signed and change on every fetch, but the media store is content
+    # addressed so an unchanged picture resolves to the same path as before
+    try:
+        media = operator_interface.media.ingest_response(r, name)
+    except operator_interface.media.MediaError:
+        return False
+    changed = conversation.conversation_pic.name != media.path
+    if changed:
+        conversation.conversation_pic.name = media.path
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "url": url,
+            "etag": r.headers.get("ETag", ""),
+            "last_modified": r.headers.get("Last-Modified", ""),
+            "hash": media.sha256,
+        })
+        pipe.expire(key, PICTURE_TTL)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+    return changed
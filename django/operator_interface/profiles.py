@@ -0,0 +1,202 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+import django_keycloak_auth.users
+import redis.exceptions
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+import wewillfixyourpc_bot.keycloak_client
+import wewillfixyourpc_bot.redis_client
+
+REDIS_KEY = "keycloak_profile:{}"
+REDIS_STATS_KEY = "keycloak_profile_cache_stats"
+INVALIDATION_CHANNEL = "keycloak_profile_invalidations"
+LISTENER_RETRY = 5
+
+logger = logging.getLogger(__name__)
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_listener_pid = None
+stats = collections.Counter()
+
+
+def _get_local(user_id: str) -> typing.Optional[dict]:
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires < time.monotonic():
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return user
+
+
+def _clear_local() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def _drop_local(user_id: str) -> None:
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def _listen(client: redis.Redis) -> None:
+    pubsub = client.pubsub()
+    try:
+        pubsub.subscribe(INVALIDATION_CHANNEL)
+        for message in pubsub.listen():
+            if message["type"] == "subscribe":
+                # Anything invalidated while this process wasn't subscribed was missed
+                _clear_local()
+            elif message["type"] == "message":
+                _drop_local(message["data"].decode())
+    finally:
+        pubsub.close()
+
+
+def _listen_forever() -> None:
+    while True:
+        try:
+            _listen(wewillfixyourpc_bot.redis_client.get_client())
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Lost profile invalidation subscription, retrying: {e}")
+        time.sleep(LISTENER_RETRY)
+
+
+def _ensure_listener() -> None:
+    # Other processes publish invalidations, so every process that caches locally listens for
+    # them. Threads don't survive a fork, hence one listener per pid.
+    global _listener_pid
+    with _cache_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+    threading.Thread(target=_listen_forever, daemon=True).start()
+
+
+def _set_local(user_id: str, user: dict) -> None:
+    _ensure_listener()
+    with _cache_lock:
+        _cache[user_id] = (
+            time.monotonic() + settings.KEYCLOAK_PROFILE_CACHE_LOCAL_TTL,
+            user,
+        )
+        _cache.move_to_end(user_id)
+        while len(_cache) > settings.KEYCLOAK_PROFILE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _record(event: str, pipe=None) -> None:
+    stats[event] += 1
+    if pipe is not None:
+        pipe.hincrby(REDIS_STATS_KEY, event, 1)
+
+
+def _get_shared(user_id: str) -> typing.Optional[dict]:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    try:
+        cached = client.get(REDIS_KEY.format(user_id))
+    except redis.exceptions.RedisError:
+        return None
+
+    if cached is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        _record("redis_hit", pipe)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+    return json.loads(cached)
+
+
+def _set_shared(user_id: str, user: dict) -> None:
+    try:
+        pipe = wewillfixyourpc_bot.redis_client.get_client().pipeline(transaction=False)
+        pipe.set(
+            REDIS_KEY.format(user_id),
+            json.dumps(user),
+            ex=settings.KEYCLOAK_PROFILE_CACHE_TTL,
+        )
+        _record("miss", pipe)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get_user(user_id) -> dict:
+    user_id = str(user_id)
+
+    user = _get_local(user_id)
+    if user is not None:
+        _record("local_hit")
+        return user
+
+    user = _get_shared(user_id)
+    if user is not None:
+        _set_local(user_id, user)
+        return user
+
+    user = django_keycloak_auth.users.get_user_by_id(user_id).user
+    _set_local(user_id, user)
+    _set_shared(user_id, user)
+    return user
+
+
+async def get_user_async(user_id) -> dict:
+    user_id = str(user_id)
+
+    user = _get_local(user_id)
+    if user is not None:
+        _record("local_hit")
+        return user
+
+    user = await sync_to_async(_get_shared, thread_sensitive=False)(user_id)
+    if user is not None:
+        _set_local(user_id, user)
+        return user
+
+    user = await wewillfixyourpc_bot.keycloak_client.get_user(user_id)
+    _set_local(user_id, user)
+    await sync_to_async(_set_shared, thread_sensitive=False)(user_id, user)
+    return user
+
+
+def invalidate_user(user_id) -> None:
+    if not user_id:
+        return
+    user_id = str(user_id)
+
+    _drop_local(user_id)
+    _record("invalidation")
+    try:
+        pipe = wewillfixyourpc_bot.redis_client.get_client().pipeline(transaction=False)
+        pipe.delete(REDIS_KEY.format(user_id))
+        pipe.publish(INVALIDATION_CHANNEL, user_id)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get_stats() -> dict:
+    try:
+        shared = {
+            k.decode(): int(v)
+            for k, v in wewillfixyourpc_bot.redis_client.get_client()
+            .hgetall(REDIS_STATS_KEY)
+            .items()
+        }
+    except redis.exceptions.RedisError:
+        shared = {}
+
+    return {"process": dict(stats), "shared": shared}
@@ -0,0 +1,124 @@
+import bisect
+import math
+import time
+import typing
+
+import redis.exceptions
+from django.conf import settings
+
+import wewillfixyourpc_bot.redis_client
+
+BUCKET_KEY = "outbound_rate_limit:{}"
+QUEUE_KEY = "outbound_queue:{}"
+REDIS_STATS_KEY = "outbound_rate_limit_stats"
+WAIT_BUCKETS = (0, 0.1, 0.5, 1, 5, 30, 60, 300)
+
+# A token bucket in GCRA form: each key stores the theoretical arrival time of the next
+# send, so a burst of callers each reserve a future slot instead of all polling for tokens.
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local send_at = now
+local tats = {}
+for i, key in ipairs(KEYS) do
+    local tolerance = tonumber(ARGV[i * 2 + 1])
+    local tat = math.max(tonumber(redis.call("GET", key) or now), now)
+    tats[i] = tat
+    send_at = math.max(send_at, tat - tolerance)
+end
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 2])
+    local tat = math.max(tats[i], send_at) + interval
+    redis.call("SET", key, tostring(tat), "PX", math.ceil(tat - now) + 1000)
+end
+return tostring(send_at - now)
+"""
+
+_reserve_script = None
+
+
+def _buckets(platform: str, recipient: str) -> typing.List[typing.Tuple[str, float, float]]:
+    limits = settings.OUTBOUND_RATE_LIMITS.get(platform, {})
+    buckets = []
+    for scope, key in (("platform", platform), ("recipient", f"{platform}:{recipient}")):
+        if scope in limits:
+            count, period = limits[scope]
+            interval = period * 1000 / count
+            buckets.append((BUCKET_KEY.format(key), interval, interval * (count - 1)))
+    return buckets
+
+
+def _wait_bucket(wait: float) -> str:
+    i = bisect.bisect_left(WAIT_BUCKETS, wait)
+    return f"wait_le_{WAIT_BUCKETS[i]}" if i < len(WAIT_BUCKETS) else "wait_le_inf"
+
+
+def reserve(platform: str, recipient: str) -> float:
+    global _reserve_script
+
+    buckets = _buckets(platform, recipient)
+    if not buckets:
+        return 0
+
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    if _reserve_script is None:
+        _reserve_script = client.register_script(RESERVE_SCRIPT)
+
+    args = [time.time() * 1000]
+    for _, interval, tolerance in buckets:
+        args.extend([interval, tolerance])
+    try:
+        wait = float(_reserve_script(keys=[b[0] for b in buckets], args=args)) / 1000
+    except redis.exceptions.RedisError:
+        return 0
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hincrby(REDIS_STATS_KEY, f"{platform}:{'delayed' if wait else 'immediate'}", 1)
+        pipe.hincrby(REDIS_STATS_KEY, f"{platform}:{_wait_bucket(wait)}", 1)
+        pipe.hincrby(REDIS_STATS_KEY, f"{platform}:wait_ms", math.ceil(wait * 1000))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+    return wait
+
+
+def enqueue(platform: str, mid: int, wait: float) -> None:
+    try:
+        wewillfixyourpc_bot.redis_client.get_client().zadd(
+            QUEUE_KEY.format(platform), {str(mid): time.time() + wait}
+        )
+    except redis.exceptions.RedisError:
+        pass
+
+
+def dequeue(platform: str, mid: int) -> None:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    try:
+        send_at = client.zscore(QUEUE_KEY.format(platform), str(mid))
+        if send_at is None:
+            return
+        pipe = client.pipeline(transaction=False)
+        pipe.zrem(QUEUE_KEY.format(platform), str(mid))
+        pipe.hincrby(REDIS_STATS_KEY, f"{platform}:sent_from_queue", 1)
+        pipe.hincrby(
+            REDIS_STATS_KEY, f"{platform}:lag_ms", max(0, math.ceil((time.time() - send_at) * 1000))
+        )
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def get_stats() -> typing.Dict[str, typing.Dict[str, int]]:
+    client = wewillfixyourpc_bot.redis_client.get_client()
+    platforms = {}
+    for key, value in client.hgetall(REDIS_STATS_KEY).items():
+        platform, event = key.decode().split(":", 1)
+        platforms.setdefault(platform, {})[event] = int(value)
+
+    now = time.time()
+    for platform in set(platforms) | set(settings.OUTBOUND_RATE_LIMITS):
+        queue_key = QUEUE_KEY.format(platform)
+        stats = platforms.setdefault(platform, {})
+        stats["queue_depth"] = client.zcard(queue_key)
+        stats["queue_overdue"] = client.zcount(queue_key, "-inf", now)
+    return platforms
@@ -0,0 +1,385 @@
+import collections
+import datetime
+import typing
+
+import keycloak.exceptions
+from django.conf import settings
+from django.db.models import (
+    Min, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects
+)
+
+import fulfillment.models
+import operator_interface.models
+import operator_interface.profiles
+
+
+RESYNC_OVERLAP = datetime.timedelta(seconds=5)
+MAX_MESSAGE_PAGE_SIZE = 100
+# Past this many changes a resync costs more than reloading, so the client is told to reload
+MAX_RESYNC_CHANGES = 500
+MESSAGE_WINDOW = 50
+
+
+def to_cursor(timestamp: datetime.datetime) -> int:
+    return int(timestamp.timestamp() * 1000000)
+
+
+def from_cursor(cursor: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(cursor / 1000000, tz=datetime.timezone.utc)
+
+
+def platforms_with_last_inbound():
+    inbound = operator_interface.models.Message.objects.filter(
+        platform=OuterRef("pk"),
+        direction=operator_interface.models.Message.FROM_CUSTOMER,
+    ).order_by("-timestamp")
+
+    return operator_interface.models.ConversationPlatform.objects.annotate(
+        last_inbound_timestamp=Subquery(inbound.values("timestamp")[:1]),
+        last_inbound_end=Subquery(inbound.values("end")[:1]),
+    )
+
+
+def conversation_pic(conversation: operator_interface.models.Conversation) -> str:
+    if conversation.conversation_pic:
+        return conversation.conversation_pic.url
+    return settings.STATIC_URL + "operator_interface/img/default_profile_normal.png"
+
+
+def anonymous_customer(conversation: operator_interface.models.Conversation) -> dict:
+    return {
+        "name": conversation.conversation_name,
+        "attributes": {"profile_picture": [conversation_pic(conversation)]},
+    }
+
+
+def get_customer(conversation: operator_interface.models.Conversation) -> dict:
+    if not conversation.conversation_user_id:
+        return anonymous_customer(conversation)
+
+    try:
+        return operator_interface.profiles.get_user(conversation.conversation_user_id)
+    except keycloak.exceptions.KeycloakClientError:
+        return {}
+
+
+async def get_customer_async(conversation: operator_interface.models.Conversation) -> dict:
+    if not conversation.conversation_user_id:
+        return anonymous_customer(conversation)
+
+    try:
+        return await operator_interface.profiles.get_user_async(
+            conversation.conversation_user_id
+        )
+    except keycloak.exceptions.KeycloakClientError:
+        return {}
+
+
+def serialize_customer(
+        conversation: operator_interface.models.Conversation, customer: dict
+) -> dict:
+    first_name = customer.get("firstName", "")
+    last_name = customer.get("lastName", "")
+    attributes = customer.get("attributes", {})
+
+    return {
+        "customer_id": str(conversation.conversation_user_id)
+        if conversation.conversation_user_id else None,
+        "customer_name": customer.get("name", f"{first_name} {last_name}"),
+        "customer_first_name": first_name,
+        "customer_last_name": last_name,
+        "customer_username": customer.get("username"),
+        "customer_pic": next(
+            iter(attributes.get("profile_picture", [])), conversation_pic(conversation)
+        ),
+        "timezone": next(iter(attributes.get("timezone", [])), None),
+        "customer_email": customer.get("email"),
+        "customer_phone": next(iter(attributes.get("phone", [])), None),
+        "customer_locale": next(iter(attributes.get("locale", [])), None),
+        "customer_gender": next(iter(attributes.get("gender", [])), None),
+    }
+
+
+def serialize_conversations(
+        conversations: typing.Iterable[operator_interface.models.Conversation],
+        inline_messages: int = 0,
+        include_customer: bool = True,
+) -> typing.List[dict]:
+    conversations = list(conversations)
+    if not conversations:
+        return []
+
+    prefetch_related_objects(
+        conversations,
+        Prefetch("conversationplatform_set", queryset=platforms_with_last_inbound()),
+    )
+
+    conversation_ids = [c.id for c in conversations]
+    messages = get_message_windows(conversation_ids)
+    payments = get_payment_ids(conversation_ids)
+
+    customer_ids = [
+        str(c.conversation_user_id) for c in conversations if c.conversation_user_id
+    ]
+    bookings = collections.defaultdict(list)
+    if customer_ids:
+        for customer_id, bid in fulfillment.models.RepairBooking.objects.filter(
+            customer_id__in=customer_ids
+        ).values_list("customer_id", "id"):
+            bookings[customer_id].append(bid)
+
+    recent_messages = collections.defaultdict(list)
+    inline_messages = min(inline_messages, MESSAGE_WINDOW)
+    if inline_messages > 0:
+        for message in get_messages(
+                [mid for cid in conversation_ids for mid in messages[cid][-inline_messages:]]
+        ):
+            recent_messages[message.platform.conversation_id].append(
+                serialize_message(message)
+            )
+
+    data = []
+    for conversation in conversations:
+        conversation_data = serialize_conversation(
+            conversation,
+            messages[conversation.id],
+            payments[conversation.id],
+            bookings[str(conversation.conversation_user_id)]
+            if conversation.conversation_user_id
+            else [],
+            include_customer,
+        )
+        if inline_messages > 0:
+            conversation_data["recent_messages"] = recent_messages[conversation.id]
+        data.append(conversation_data)
+    return data
+
+
+def get_message_windows(
+        conversation_ids: typing.List[int], size: int = MESSAGE_WINDOW
+) -> typing.Dict[int, typing.List[int]]:
+    thresholds = operator_interface.models.Conversation.objects.filter(
+        id__in=conversation_ids
+    ).annotate(
+        threshold=Subquery(
+            operator_interface.models.Message.objects.filter(
+                platform__conversation_id=OuterRef("pk")
+            )
+            .order_by("-timestamp")
+            .values("timestamp")[size - 1:size]
+        )
+    ).values_list("id", "threshold")
+
+    window = Q()
+    for cid, threshold in thresholds:
+        if threshold is None:
+            window |= Q(platform__conversation_id=cid)
+        else:
+            window |= Q(platform__conversation_id=cid, timestamp__gte=threshold)
+
+    messages = collections.defaultdict(list)
+    if not window:
+        return messages
+    for cid, mid in (
+        operator_interface.models.Message.objects.filter(window)
+        .order_by("timestamp")
+        .values_list("platform__conversation_id", "id")
+    ):
+        messages[cid].append(mid)
+    for cid in messages:
+        messages[cid] = messages[cid][-size:]
+    return messages
+
+
+def get_payment_ids(
+        conversation_ids: typing.List[int],
+) -> typing.Dict[int, typing.List[str]]:
+    found = []
+    for field in ("payment_request", "payment_confirm"):
+        found.extend(
+            operator_interface.models.Message.objects.filter(
+                platform__conversation_id__in=conversation_ids
+            )
+            .exclude(**{field: None})
+            .values_list("platform__conversation_id", field)
+            .annotate(first=Min("timestamp"))
+            .order_by()
+        )
+
+    payments = collections.defaultdict(dict)
+    for cid, payment_id, _ in sorted(found, key=lambda p: p[2]):
+        payments[cid].setdefault(str(payment_id))
+    return collections.defaultdict(
+        list, {cid: list(ids) for cid, ids in payments.items()}
+    )
+
+
+def serialize_conversation(
+        conversation: operator_interface.models.Conversation,
+        messages: typing.List[int],
+        payments: typing.List[str],
+        bookings: typing.List[int],
+        include_customer: bool = True,
+) -> dict:
+    data = {
+        "type": "conversation",
+        "id": conversation.id,
+        "agent_responding": conversation.agent_responding,
+        "current_agent_id": conversation.current_agent_id,
+        "user_responding": conversation.current_agent_id is not None,
+        "messages": messages,
+        "messages_before": messages[0]
+        if messages and conversation.message_count > len(messages) else None,
+        "repair_bookings": bookings,
+        "payments": payments,
+        "unread_count": conversation.unread_count,
+        "can_message": conversation.can_message(),
+        "typing": conversation.is_typing(),
+        "cursor": to_cursor(conversation.updated_at),
+    }
+    if include_customer:
+        data.update(serialize_customer(conversation, get_customer(conversation)))
+    return data
+
+
+def serialize_conversation_summary(
+        conversation: operator_interface.models.Conversation,
+) -> dict:
+    last_message_id = (
+        operator_interface.models.Message.objects.filter(
+            platform__conversation_id=conversation.id
+        )
+        .order_by("-timestamp")
+        .values_list("id", flat=True)
+        .first()
+    )
+    return {
+        "type": "conversation_summary",
+        "id": conversation.id,
+        "agent_responding": conversation.agent_responding,
+        "current_agent_id": conversation.current_agent_id,
+        "user_responding": conversation.current_agent_id is not None,
+        "last_message_id": last_message_id,
+        "last_message_at": int(conversation.last_message_at.timestamp())
+        if conversation.last_message_at else None,
+        "unread_count": conversation.unread_count,
+    }
+
+
+def serialize_message(message: operator_interface.models.Message) -> dict:
+    return {
+        "type": "message",
+        "id": message.id,
+        "direction": message.direction,
+        "timestamp": int(message.timestamp.timestamp()),
+        "text": message.text,
+        "image": message.image,
+        "state": message.state,
+        "platform": message.platform.platform,
+        "platform_id": message.platform.platform_id,
+        "payment_request": str(message.payment_request)
+        if message.payment_request
+        else None,
+        "payment_confirm": str(message.payment_confirm)
+        if message.payment_confirm
+        else None,
+        "conversation_id": message.platform.conversation_id,
+        "request": message.request,
+        "sent_by": message.user.first_name if message.user else None,
+        "end": message.end,
+        "request_live_agent": message.request_live_agent,
+        "guessed_intent": message.guessed_intent,
+        "entities": [
+            {"entity": e.entity, "value": e.value}
+            for e in message.messageentity_set.all()
+        ],
+        "selection": message.selection,
+        "card": message.card,
+        "cursor": to_cursor(message.updated_at),
+    }
+
+
+def messages_for_serialization():
+    return operator_interface.models.Message.objects.select_related(
+        "platform", "user"
+    ).prefetch_related("messageentity_set")
+
+
+def get_message(mid: int) -> operator_interface.models.Message:
+    return messages_for_serialization().get(id=mid)
+
+
+def get_messages(ids: typing.List[int]) -> typing.List[operator_interface.models.Message]:
+    return list(
+        messages_for_serialization()
+        .filter(id__in=ids[:MAX_MESSAGE_PAGE_SIZE])
+        .order_by("timestamp")
+    )
+
+
+def get_message_page(
+        cid: int, before: typing.Optional[int] = None, limit: int = MAX_MESSAGE_PAGE_SIZE
+) -> typing.List[operator_interface.models.Message]:
+    messages = messages_for_serialization().filter(platform__conversation_id=cid)
+    if before is not None:
+        messages = messages.filter(before_message(before))
+    page = messages.order_by("-timestamp", "-id")[:max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))]
+    return list(reversed(page))
+
+
+def before_message(mid: int) -> Q:
+    # Keyset on (timestamp, id), merged sessions and bulk imports often share a timestamp
+    timestamp = operator_interface.models.Message.objects.filter(id=mid) \
+        .values_list("timestamp", flat=True).first()
+    if timestamp is None:
+        return Q(pk__in=[])
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=mid)
+
+
+def serialize_booking(booking: fulfillment.models.RepairBooking) -> dict:
+    return {
+        "type": "booking",
+        "id": str(booking.id),
+        "time": str(booking.time.isoformat()),
+        "repair": {
+            "id": booking.repair.id,
+            "time": booking.repair.repair_time,
+            "price": str(booking.repair.price),
+            "repair": {
+                "id": booking.repair.repair.id,
+                "name": booking.repair.repair.name,
+                "display_name": booking.repair.repair.display_name,
+            },
+            "device": {
+                "id": booking.repair.device.id,
+                "name": booking.repair.device.name,
+                "display_name": booking.repair.device.display_name,
+                "brand": {
+                    "id": booking.repair.device.brand.id,
+                    "name": booking.repair.device.brand.name,
+                    "display_name": booking.repair.device.brand.display_name,
+                },
+            },
+        },
+    }
+
+
+def get_changes(cursor: int):
+    """Returns the conversations and messages changed since the cursor, or None when there are
+    more than MAX_RESYNC_CHANGES of either and the client should reload instead."""
+    since = from_cursor(cursor) - RESYNC_OVERLAP
+    messages = list(
+        messages_for_serialization().filter(updated_at__gte=since)
+        .order_by("updated_at")[:MAX_RESYNC_CHANGES + 1]
+    )
+    if len(messages) > MAX_RESYNC_CHANGES:
+        return None
+    conversation_ids = {m.platform.conversation_id for m in messages}
+    conversations = list(
+        operator_interface.models.Conversation.objects.filter(
+            Q(updated_at__gte=since) | Q(id__in=conversation_ids)
+        )[:MAX_RESYNC_CHANGES + 1]
+    )
+    if len(conversations) > MAX_RESYNC_CHANGES:
+        return None
+    return conversations, messages
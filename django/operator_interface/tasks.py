@@ -1,7 +1,7 @@
 import json
+import time
 import uuid
 import sentry_sdk
-import requests
 
 from asgiref.sync import async_to_sync
 from celery import shared_task
@@ -22,7 +22,13 @@ import customer_email.tasks
 import whatsapp.tasks
 import as207960.tasks
 import keycloak.exceptions
-import django_keycloak_auth.clients
+import operator_interface.consumers
+import operator_interface.delivery
+import operator_interface.ordering
+import operator_interface.outbox
+import operator_interface.profiles
+import operator_interface.rate_limit
+import wewillfixyourpc_bot.http_client
 from django.utils import timezone
 from . import models
 from django.contrib.auth.models import User
@@ -34,9 +40,24 @@ j2_env = jinja2.Environment()
 
 @shared_task
 def send_message_to_interface(mid):
-    async_to_sync(channel_layer.group_send)(
-        "operator_interface", {"type": "message", "mid": mid}
+    cid = (
+        models.Message.objects.filter(id=mid)
+        .values_list("platform__conversation_id", flat=True)
+        .first()
     )
+    if cid is None:
+        return
+
+    operator_interface.consumers.schedule_events(
+        (operator_interface.consumers.MESSAGE_UPDATE, mid),
+        (operator_interface.consumers.CONVERSATION_SUMMARY, cid),
+        (operator_interface.consumers.CONVERSATION_UPDATE, cid),
+    )
+
+
+@shared_task(ignore_result=True)
+def send_interface_event(kind, object_id):
+    operator_interface.consumers.send_event(kind, object_id)
 
 
 @shared_task
@@ -79,7 +100,7 @@ def send_message_notifications(data):
 def extract_entities_from_message(mid):
     message = models.Message.objects.get(id=mid)
 
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         settings.RASA_HTTP_URL + "/model/parse", json={"text": message.text}
     )
     r.raise_for_status()
@@ -97,7 +118,23 @@ def extract_entities_from_message(mid):
 
 @shared_task
 def process_message(mid: int):
+    if operator_interface.outbox.is_processed(mid):
+        return None
     message: models.Message = models.Message.objects.get(id=mid)
+    if message.direction == models.Message.TO_CUSTOMER and (
+            message.state in (models.Message.DELIVERED, models.Message.READ)
+            or message.delivery_attempts.filter(outcome=models.DeliveryAttempt.DELIVERED).exists()
+    ):
+        return None
+
+    # Only marked once handled, so a worker dying part way leaves the message to a repeat
+    result = _process_message(message)
+    operator_interface.outbox.mark_processed(mid)
+    return result
+
+
+def _process_message(message: models.Message):
+    mid = message.id
     platform = message.platform
     conversation = platform.conversation
 
@@ -106,7 +143,10 @@ def process_message(mid: int):
     if message.direction == models.Message.FROM_CUSTOMER:
         # extract_entities_from_message.delay(mid)
         if conversation.agent_responding:
-            return rasa_api.tasks.handle_message(mid)
+            if platform.platform == models.ConversationPlatform.GOOGLE_ACTIONS \
+                    or not settings.INBOUND_ORDERING:
+                return rasa_api.tasks.handle_message(mid)
+            handle_inbound_message.delay(conversation.id, mid)
         else:
             if (
                 platform.messages.filter(
@@ -122,12 +162,11 @@ def process_message(mid: int):
                 conversation.current_agent = None
                 conversation.save()
 
-            admin_client = django_keycloak_auth.clients.get_keycloak_admin_client()
             if conversation.conversation_user_id:
                 try:
-                    user = admin_client.users.by_id(
+                    user = operator_interface.profiles.get_user(
                         conversation.conversation_user_id
-                    ).user
+                    )
                     name = f'{user.get("firstName", "")} {user.get("lastName", "")}'
                 except keycloak.exceptions.KeycloakClientError:
                     name = conversation.conversation_name
@@ -144,33 +183,87 @@ def process_message(mid: int):
             )
 
     elif message.direction == models.Message.TO_CUSTOMER:
-        platform = message.platform.platform
-        if platform == models.ConversationPlatform.FACEBOOK:
-            facebook.tasks.send_facebook_message(mid)
-        elif platform == models.ConversationPlatform.TWITTER:
-            twitter.tasks.send_twitter_message(mid)
-        elif platform == models.ConversationPlatform.TELEGRAM:
-            telegram_bot.tasks.send_telegram_message(mid)
-        elif platform == models.ConversationPlatform.AZURE:
-            azure_bot.tasks.send_azure_message(mid)
-        elif platform == models.ConversationPlatform.CHAT:
-            customer_chat.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.ABC:
-            apple_business_chat.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.SMS:
-            sms.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.EMAIL:
-            customer_email.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.WHATSAPP:
-            whatsapp.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.AS207960:
-            as207960.tasks.send_message(mid)
-        elif platform == models.ConversationPlatform.GOOGLE_ACTIONS:
+        if platform.platform == models.ConversationPlatform.GOOGLE_ACTIONS:
             return mid
 
+        wait = operator_interface.rate_limit.reserve(platform.platform, platform.platform_id)
+        if wait > 0:
+            operator_interface.rate_limit.enqueue(platform.platform, mid, wait)
+            send_outbound_message.apply_async((mid,), countdown=wait)
+        else:
+            send_outbound_message.delay(mid)
+
     return None
 
 
+@shared_task
+def handle_inbound_message(cid: int, mid: int, queued=False):
+    try:
+        operator_interface.ordering.process_in_order(
+            cid, mid, rasa_api.tasks.handle_message, queued
+        )
+    except operator_interface.ordering.LockTimeout:
+        handle_inbound_message.apply_async((cid, mid, True), countdown=1)
+
+
+def queue_outbound_message(
+        platform: models.ConversationPlatform, mid: int, attempt: int = 1, delay: float = 0
+):
+    wait = operator_interface.rate_limit.reserve(platform.platform, platform.platform_id)
+    if wait > 0:
+        operator_interface.rate_limit.enqueue(platform.platform, mid, wait + delay)
+    send_outbound_message.apply_async((mid, attempt), countdown=wait + delay)
+
+
+@shared_task
+def send_outbound_message(mid: int, attempt: int = 1):
+    platform = models.ConversationPlatform.objects.get(messages__id=mid)
+    operator_interface.rate_limit.dequeue(platform.platform, mid)
+
+    start = time.monotonic()
+    try:
+        dispatch_outbound_message(platform.platform, mid)
+    except Exception as e:
+        if operator_interface.delivery.is_retryable(e) and attempt < settings.OUTBOUND_MAX_ATTEMPTS:
+            operator_interface.delivery.record_attempt(
+                mid, attempt, start, models.DeliveryAttempt.RETRYING, e
+            )
+            queue_outbound_message(
+                platform, mid, attempt + 1, operator_interface.delivery.backoff(attempt)
+            )
+        else:
+            operator_interface.delivery.record_attempt(
+                mid, attempt, start, models.DeliveryAttempt.FAILED, e
+            )
+            operator_interface.delivery.dead_letter(mid, attempt, e)
+        return
+
+    operator_interface.delivery.record_attempt(mid, attempt, start, models.DeliveryAttempt.DELIVERED)
+
+
+def dispatch_outbound_message(platform: str, mid: int):
+    if platform == models.ConversationPlatform.FACEBOOK:
+        facebook.tasks.send_facebook_message(mid)
+    elif platform == models.ConversationPlatform.TWITTER:
+        twitter.tasks.send_twitter_message(mid)
+    elif platform == models.ConversationPlatform.TELEGRAM:
+        telegram_bot.tasks.send_telegram_message(mid)
+    elif platform == models.ConversationPlatform.AZURE:
+        azure_bot.tasks.send_azure_message(mid)
+    elif platform == models.ConversationPlatform.CHAT:
+        customer_chat.tasks.send_message(mid)
+    elif platform == models.ConversationPlatform.ABC:
+        apple_business_chat.tasks.send_message(mid)
+    elif platform == models.ConversationPlatform.SMS:
+        sms.tasks.send_message(mid)
+    elif platform == models.ConversationPlatform.EMAIL:
+        customer_email.tasks.send_message(mid)
+    elif platform == models.ConversationPlatform.WHATSAPP:
+        whatsapp.tasks.send_message(mid)
+    elif platform == models.ConversationPlatform.AS207960:
+        as207960.tasks.send_message(mid)
+
+
 @shared_task
 def process_event(pid, event):
     platform = models.ConversationPlatform.objects.get(id=pid)
@@ -205,8 +298,7 @@ def hand_back(cid):
             text=f"You've been handed back to the automated assistant.\n"
             f"You can always request an agent at any time by saying 'request an agent'.",
         )
-        message.save()
-        process_message(message.id)
+        operator_interface.outbox.dispatch(message)
 
 
 @shared_task
@@ -234,8 +326,7 @@ def send_welcome_message(pid):
             direction=models.Message.TO_CUSTOMER,
             text=text,
         )
-        message.save()
-        process_message(message.id)
+        operator_interface.outbox.dispatch(message)
 
 
 @shared_task
@@ -253,8 +344,7 @@ def end_conversation(cid):
         text=f"Thanks for contacting We Will Fix Your PC."
         f" On a scale of 1 to 10 how would you rate your experience with us?",
     )
-    message.save()
-    process_message(message.id)
+    operator_interface.outbox.dispatch(message)
 
 
 @shared_task
@@ -288,8 +378,7 @@ def take_over(cid, uid):
             user=user,
             text=text,
         )
-        message.save()
-        process_message(message.id)
+        operator_interface.outbox.dispatch(message)
 
 def make_preset_message(preset_message, user, conversation):
     template = j2_env.from_string(preset_message.message)
@@ -316,8 +405,7 @@ def send_preset_message(cid, pid, uid=None):
         message_id=uuid.uuid4(),
         user=user,
     )
-    message.save()
-    process_message(message.id)
+    operator_interface.outbox.dispatch(message)
 
 
 @shared_task
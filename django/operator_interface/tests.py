@@ -1,3 +1,1204 @@
-from django.test import TestCase
+import datetime
+import fnmatch
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import keycloak.exceptions
+import kombu.exceptions
+import redis.exceptions
+import requests
+from PIL import Image
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import DefaultStorage, FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import facebook.tasks
+from wewillfixyourpc_bot import aiohttp_client, http_client, keycloak_client, token_cache
+
+from . import (
+    consumers, delivery, media, models, ordering, outbox, profile_pictures, profile_refresh, profiles, rate_limit,
+    serializers, tasks, users,
+)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class SerializeConversationsTestCase(TestCase):
+    def make_conversations(self, count):
+        conversations = []
+        for i in range(count):
+            conversation = models.Conversation.objects.create(
+                conversation_name=f"Customer {i}",
+                conversation_user_id=uuid.uuid4() if i % 2 else None,
+            )
+            for platform_type in (
+                    models.ConversationPlatform.FACEBOOK,
+                    models.ConversationPlatform.ABC,
+            ):
+                platform = models.ConversationPlatform.objects.create(
+                    conversation=conversation,
+                    platform=platform_type,
+                    platform_id=f"{platform_type}-{i}",
+                )
+                for direction in (
+                        models.Message.FROM_CUSTOMER,
+                        models.Message.TO_CUSTOMER,
+                ):
+                    models.Message.objects.create(
+                        platform=platform,
+                        direction=direction,
+                        text="Hello",
+                        payment_request=uuid.uuid4(),
+                    )
+            conversations.append(conversation)
+        return conversations
+
+    def count_queries(self, conversations, inline_messages=0):
+        conversations = models.Conversation.objects.filter(
+            id__in=[c.id for c in conversations]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            data = serializers.serialize_conversations(conversations, inline_messages)
+        self.assertEqual(len(data), len(conversations))
+        return len(queries)
+
+    @mock.patch("operator_interface.profiles.get_user", return_value={})
+    def test_query_count_is_constant(self, _get_user):
+        conversations = self.make_conversations(20)
+
+        small = self.count_queries(conversations[:2])
+        large = self.count_queries(conversations)
+
+        self.assertEqual(small, large)
+
+    @mock.patch("operator_interface.profiles.get_user", return_value={})
+    def test_inline_messages_query_count_is_constant(self, _get_user):
+        conversations = self.make_conversations(20)
+
+        small = self.count_queries(conversations[:2], inline_messages=2)
+        large = self.count_queries(conversations, inline_messages=2)
+
+        self.assertEqual(small, large)
+
+    @mock.patch("operator_interface.profiles.get_user", return_value={})
+    def test_conversation_payload(self, _get_user):
+        conversation = self.make_conversations(1)[0]
+
+        data = serializers.serialize_conversations([conversation])[0]
+
+        message_ids = list(
+            models.Message.objects.filter(platform__conversation=conversation)
+            .order_by("timestamp")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(data["messages"], message_ids)
+        self.assertIsNone(data["messages_before"])
+        self.assertEqual(len(data["payments"]), 4)
+        self.assertTrue(data["can_message"])
+        self.assertNotIn("recent_messages", data)
+        self.assertFalse(data["typing"])
+
+    @mock.patch("operator_interface.profiles.get_user", return_value={})
+    def test_message_window(self, _get_user):
+        conversation = self.make_conversations(1)[0]
+        platform = conversation.conversationplatform_set.first()
+        now = timezone.now()
+        for i in range(serializers.MESSAGE_WINDOW):
+            models.Message.objects.create(
+                platform=platform,
+                direction=models.Message.FROM_CUSTOMER,
+                timestamp=now + datetime.timedelta(seconds=i),
+            )
+        conversation.refresh_from_db()
+
+        data = serializers.serialize_conversations([conversation])[0]
+
+        message_ids = list(
+            models.Message.objects.filter(platform__conversation=conversation)
+            .order_by("timestamp")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(data["messages"], message_ids[-serializers.MESSAGE_WINDOW:])
+        self.assertEqual(data["messages_before"], data["messages"][0])
+        self.assertEqual(len(data["payments"]), 4)
+
+        page = serializers.get_message_page(conversation.id, data["messages_before"])
+        self.assertEqual([m.id for m in page], message_ids[:-serializers.MESSAGE_WINDOW])
+
+    def test_message_page_shared_timestamp(self):
+        conversation = models.Conversation.objects.create()
+        platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.FACEBOOK,
+            platform_id="page",
+        )
+        now = timezone.now()
+        message_ids = [
+            models.Message.objects.create(
+                platform=platform, direction=models.Message.FROM_CUSTOMER, timestamp=now
+            ).id
+            for _ in range(5)
+        ]
+
+        page = serializers.get_message_page(conversation.id, message_ids[3], limit=2)
+        self.assertEqual([m.id for m in page], message_ids[1:3])
+        page = serializers.get_message_page(conversation.id, page[0].id, limit=2)
+        self.assertEqual([m.id for m in page], message_ids[:1])
+        self.assertEqual(serializers.get_message_page(conversation.id, 0), [])
+
+
+class ConversationActivityTestCase(TestCase):
+    def test_activity_matches_backfill(self):
+        conversation = models.Conversation.objects.create()
+        platforms = [
+            models.ConversationPlatform.objects.create(
+                conversation=conversation,
+                platform=platform_type,
+                platform_id="activity",
+            )
+            for platform_type in (
+                models.ConversationPlatform.FACEBOOK,
+                models.ConversationPlatform.TWITTER,
+            )
+        ]
+        now = timezone.now()
+        for i, (platform, direction) in enumerate((
+                (platforms[0], models.Message.FROM_CUSTOMER),
+                (platforms[0], models.Message.TO_CUSTOMER),
+                (platforms[1], models.Message.FROM_CUSTOMER),
+                (platforms[0], models.Message.FROM_CUSTOMER),
+        )):
+            models.Message.objects.create(
+                platform=platform,
+                direction=direction,
+                timestamp=now + datetime.timedelta(minutes=i),
+            )
+
+        fields = ("last_message_at", "last_inbound_at", "message_count", "unread_count")
+
+        def snapshot():
+            return (
+                models.Conversation.objects.filter(id=conversation.id).values(*fields).get(),
+                list(
+                    models.ConversationPlatform.objects.filter(conversation=conversation)
+                    .order_by("id")
+                    .values(*fields)
+                ),
+            )
+
+        recorded = snapshot()
+        self.assertEqual(recorded[0]["message_count"], 4)
+        self.assertEqual(recorded[0]["unread_count"], 2)
+        self.assertEqual(recorded[0]["last_message_at"], now + datetime.timedelta(minutes=3))
+        self.assertEqual(conversation.last_platform(), platforms[0])
+
+        models.Conversation.objects.update(message_count=0, unread_count=0)
+        models.ConversationPlatform.objects.update(last_message_at=None, message_count=0)
+        models.refresh_activity(models.Conversation.objects.all())
+
+        self.assertEqual(snapshot(), recorded)
+
+
+    def test_stale_save_keeps_activity(self):
+        conversation = models.Conversation.objects.create()
+        platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.FACEBOOK,
+            platform_id="stale",
+        )
+        stale_conversation = models.Conversation.objects.get(id=conversation.id)
+        stale_platform = models.ConversationPlatform.objects.get(id=platform.id)
+        models.Message.objects.create(platform=platform, direction=models.Message.FROM_CUSTOMER)
+
+        stale_conversation.conversation_name = "Renamed"
+        stale_conversation.save()
+        stale_platform.is_typing = True
+        stale_platform.save()
+
+        conversation.refresh_from_db()
+        platform.refresh_from_db()
+        self.assertEqual(conversation.conversation_name, "Renamed")
+        self.assertEqual((conversation.message_count, conversation.unread_count), (1, 1))
+        self.assertTrue(platform.is_typing)
+        self.assertEqual((platform.message_count, platform.unread_count), (1, 1))
+        self.assertIsNotNone(platform.last_message_at)
+
+
+class PlatformCreateTestCase(TestCase):
+    def test_concurrent_create_returns_existing(self):
+        first = models.ConversationPlatform.create(models.ConversationPlatform.SMS, "+441234567890")
+        # The second worker already checked exists() before the first committed
+        second = models.ConversationPlatform.create(
+            models.ConversationPlatform.SMS, "+441234567890", conversation_name="Second"
+        )
+
+        self.assertEqual(second, first)
+        self.assertEqual(models.Conversation.objects.count(), 1)
+        self.assertEqual(models.ConversationPlatform.objects.count(), 1)
+
+
+    def test_moved_message_updates_both_platforms(self):
+        conversation = models.Conversation.objects.create()
+        whatsapp, sms = [
+            models.ConversationPlatform.objects.create(
+                conversation=conversation, platform=platform_type, platform_id="+441234567890"
+            )
+            for platform_type in (models.ConversationPlatform.WHATSAPP, models.ConversationPlatform.SMS)
+        ]
+        message = models.Message.objects.create(platform=whatsapp, direction=models.Message.TO_CUSTOMER)
+
+        message = models.Message.objects.get(id=message.id)
+        message.platform = sms
+        message.save()
+
+        whatsapp.refresh_from_db()
+        sms.refresh_from_db()
+        self.assertEqual((whatsapp.message_count, whatsapp.last_message_at), (0, None))
+        self.assertEqual((sms.message_count, sms.last_message_at), (1, message.timestamp))
+        self.assertEqual(conversation.last_platform(), sms)
+
+
+class ResyncTestCase(TestCase):
+    def test_changes_since_cursor(self):
+        conversation = models.Conversation.objects.create()
+        platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.FACEBOOK,
+            platform_id="resync",
+        )
+        message = models.Message.objects.create(
+            platform=platform, direction=models.Message.TO_CUSTOMER
+        )
+        models.Message.objects.filter(id=message.id).update(
+            updated_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        models.Conversation.objects.filter(id=conversation.id).update(
+            updated_at=timezone.now() - datetime.timedelta(hours=1)
+        )
+        cursor = serializers.to_cursor(timezone.now())
+
+        conversations, messages = serializers.get_changes(cursor)
+        self.assertEqual(list(conversations), [])
+        self.assertEqual(messages, [])
+
+        message.state = models.Message.READ
+        message.save()
+
+        conversations, messages = serializers.get_changes(cursor)
+        self.assertEqual(list(conversations), [conversation])
+        self.assertEqual(messages, [message])
+        self.assertEqual(serializers.serialize_message(messages[0])["state"], models.Message.READ)
+
+    @mock.patch("operator_interface.serializers.MAX_RESYNC_CHANGES", 2)
+    def test_too_many_changes(self):
+        conversation = models.Conversation.objects.create()
+        platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.FACEBOOK,
+            platform_id="resync",
+        )
+        cursor = serializers.to_cursor(timezone.now())
+        for _ in range(2):
+            models.Message.objects.create(platform=platform, direction=models.Message.TO_CUSTOMER)
+        self.assertIsNotNone(serializers.get_changes(cursor))
+
+        models.Message.objects.create(platform=platform, direction=models.Message.TO_CUSTOMER)
+        self.assertIsNone(serializers.get_changes(cursor))
+
+
+class OperatorConsumerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="operator", is_staff=True)
+        self.conversation = models.Conversation.objects.create(
+            conversation_user_id=uuid.uuid4()
+        )
+        platform = models.ConversationPlatform.objects.create(
+            conversation=self.conversation,
+            platform=models.ConversationPlatform.FACEBOOK,
+            platform_id="consumer",
+        )
+        self.message = models.Message.objects.create(
+            platform=platform, direction=models.Message.FROM_CUSTOMER, text="Hello"
+        )
+
+    @async_to_sync
+    async def request(self, *requests):
+        communicator = WebsocketCommunicator(consumers.OperatorConsumer.as_asgi(), "/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        responses = []
+        for request, count in requests:
+            await communicator.send_json_to(request)
+            for _ in range(count):
+                responses.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return responses
+
+    @mock.patch(
+        "operator_interface.profiles.get_user_async",
+        new_callable=mock.AsyncMock,
+        return_value={"firstName": "Jane", "lastName": "Doe"},
+    )
+    def test_get_conversation(self, get_user):
+        data, = self.request(({
+            "type": "getConversation",
+            "id": self.conversation.id,
+            "inline_messages": 10,
+        }, 1))
+
+        get_user.assert_awaited_once_with(self.conversation.conversation_user_id)
+        self.assertEqual(data["type"], "conversation")
+        self.assertEqual(data["customer_name"], "Jane Doe")
+        self.assertEqual(data["messages"], [self.message.id])
+        self.assertEqual(data["recent_messages"][0]["text"], "Hello")
+        self.assertFalse(data["current_user_responding"])
+
+    def test_message_page(self):
+        data, = self.request(({"type": "getMessages", "cid": self.conversation.id}, 1))
+
+        self.assertEqual(data["type"], "messages")
+        self.assertEqual(data["cid"], self.conversation.id)
+        self.assertEqual([m["id"] for m in data["messages"]], [self.message.id])
+        self.assertIsNone(data["messages_before"])
+
+    def test_invalid_attribute(self):
+        data, = self.request(({
+            "type": "attribute_update",
+            "cid": self.conversation.id,
+            "attribute": "phone-number",
+            "value": '"not a number"',
+        }, 1))
+
+        self.assertEqual(data, {"type": "error", "msg": "Invalid phone number"})
+
+
+@mock.patch("operator_interface.rate_limit.dequeue")
+class OutboundDeliveryTestCase(TestCase):
+    def setUp(self):
+        conversation = models.Conversation.objects.create()
+        platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.SMS,
+            platform_id="+441234567890",
+        )
+        self.message = models.Message.objects.create(
+            platform=platform, direction=models.Message.TO_CUSTOMER, text="Hello"
+        )
+
+    def http_error(self, status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.exceptions.HTTPError(response=response)
+
+    @mock.patch("operator_interface.rate_limit.enqueue")
+    @mock.patch("operator_interface.rate_limit.reserve", return_value=2)
+    @mock.patch.object(tasks.send_outbound_message, "apply_async")
+    @mock.patch("operator_interface.tasks.dispatch_outbound_message")
+    def test_transient_error_is_retried(self, dispatch, apply_async, reserve, enqueue, _dequeue):
+        dispatch.side_effect = self.http_error(503)
+        tasks.send_outbound_message(self.message.id, 2)
+
+        reserve.assert_called_once_with(models.ConversationPlatform.SMS, "+441234567890")
+        (args,), kwargs = apply_async.call_args
+        self.assertEqual(args, (self.message.id, 3))
+        self.assertGreaterEqual(kwargs["countdown"], 2)
+        self.assertLessEqual(kwargs["countdown"], 10)
+        enqueue.assert_called_once_with(models.ConversationPlatform.SMS, self.message.id, kwargs["countdown"])
+        attempt = self.message.delivery_attempts.get()
+        self.assertEqual(attempt.outcome, models.DeliveryAttempt.RETRYING)
+        self.assertIn("HTTP 503", attempt.error)
+        self.assertFalse(models.DeadLetter.objects.exists())
+
+    @mock.patch.object(tasks.send_outbound_message, "apply_async")
+    @mock.patch("operator_interface.tasks.dispatch_outbound_message")
+    def test_permanent_error_is_dead_lettered(self, dispatch, apply_async, _dequeue):
+        dispatch.side_effect = self.http_error(400)
+        tasks.send_outbound_message(self.message.id)
+
+        apply_async.assert_not_called()
+        self.assertEqual(self.message.dead_letter.attempts, 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.state, models.Message.FAILED)
+
+    @mock.patch.object(tasks.send_outbound_message, "apply_async")
+    @mock.patch("operator_interface.tasks.dispatch_outbound_message")
+    def test_exhausted_retries_are_dead_lettered(self, dispatch, apply_async, _dequeue):
+        dispatch.side_effect = requests.exceptions.ConnectionError()
+        with self.settings(OUTBOUND_MAX_ATTEMPTS=3):
+            tasks.send_outbound_message(self.message.id, 3)
+
+        apply_async.assert_not_called()
+        self.assertEqual(self.message.dead_letter.attempts, 3)
+
+    def test_retry_skips_sent_parts(self, _dequeue):
+        sent = []
+        parts = [mock.MagicMock(side_effect=lambda i=i: sent.append(i)) for i in range(3)]
+        parts[1].side_effect = [self.http_error(503), None]
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            delivery.send_parts(self.message, parts)
+        self.assertEqual(sent, [0])
+
+        message = models.Message.objects.get(id=self.message.id)
+        self.assertEqual(message.parts_sent, 1)
+        delivery.send_parts(message, parts)
+        self.assertEqual(sent, [0, 2])
+        self.assertEqual([part.call_count for part in parts], [1, 2, 1])
+        message.refresh_from_db()
+        self.assertEqual(message.parts_sent, 3)
+
+    @mock.patch("operator_interface.rate_limit.enqueue")
+    @mock.patch("operator_interface.rate_limit.reserve", return_value=0)
+    @mock.patch.object(tasks.send_outbound_message, "apply_async")
+    def test_replay(self, send, reserve, enqueue, _dequeue):
+        models.DeadLetter.objects.create(message=self.message, attempts=6, error="HTTP 503")
+        models.Message.objects.filter(id=self.message.id).update(state=models.Message.FAILED)
+
+        self.assertEqual(delivery.replay(models.DeadLetter.objects.all()), [self.message.id])
+
+        reserve.assert_called_once_with(models.ConversationPlatform.SMS, "+441234567890")
+        send.assert_called_once_with((self.message.id, 1), countdown=0)
+        enqueue.assert_not_called()
+        self.assertFalse(models.DeadLetter.objects.exists())
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.state, models.Message.SENDING)
+
+
+@mock.patch.object(tasks.process_message.app, "producer_or_acquire")
+@mock.patch.object(tasks.process_message, "apply_async")
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        conversation = models.Conversation.objects.create()
+        self.platform = models.ConversationPlatform.objects.create(
+            conversation=conversation,
+            platform=models.ConversationPlatform.CHAT,
+            platform_id="token",
+        )
+
+    def dispatch(self, age):
+        message = models.Message(
+            platform=self.platform, direction=models.Message.TO_CUSTOMER, text="Hello"
+        )
+        outbox.dispatch(message)
+        models.OutboxEntry.objects.filter(message=message).update(
+            created_at=timezone.now() - datetime.timedelta(seconds=age)
+        )
+        return message
+
+    def test_relay_pending(self, apply_async, _producer):
+        old = [self.dispatch(60) for _ in range(3)]
+        new = self.dispatch(0)
+
+        self.assertEqual(outbox.relay_pending(10), 3)
+
+        self.assertEqual([c.args[0] for c in apply_async.call_args_list], [(m.id,) for m in old])
+        self.assertEqual(
+            list(models.OutboxEntry.objects.values_list("message_id", flat=True)), [new.id]
+        )
+
+    def test_broker_failure_keeps_entries(self, apply_async, _producer):
+        message = self.dispatch(60)
+        apply_async.side_effect = kombu.exceptions.OperationalError()
+
+        with self.assertRaises(kombu.exceptions.OperationalError):
+            outbox.relay_pending(10)
+
+        self.assertTrue(models.OutboxEntry.objects.filter(message=message).exists())
+
+    @mock.patch("operator_interface.tasks.send_message_to_interface")
+    @mock.patch("operator_interface.tasks.send_outbound_message")
+    @mock.patch("operator_interface.rate_limit.reserve", return_value=0)
+    def test_repeated_relay_sends_once(self, _reserve, send, _interface, apply_async, _producer):
+        message = self.dispatch(60)
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=FakeRedis()):
+            outbox.relay_pending(10)
+            # As if the first relay's delete had rolled back after the publish went out
+            entry = models.OutboxEntry.objects.create(message=message)
+            outbox.relay(models.OutboxEntry.objects.filter(id=entry.id))
+            self.assertEqual(apply_async.call_count, 2)
+
+            for call in apply_async.call_args_list:
+                tasks.process_message(*call.args[0])
+
+        send.delay.assert_called_once_with(message.id)
+
+    @mock.patch("operator_interface.tasks.send_message_to_interface")
+    @mock.patch("operator_interface.tasks.send_outbound_message")
+    @mock.patch("operator_interface.rate_limit.reserve", return_value=0)
+    def test_failed_processing_is_repeated(self, reserve, send, _interface, _apply_async, _producer):
+        message = self.dispatch(0)
+        reserve.side_effect = [RuntimeError(), 0]
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=FakeRedis()):
+            with self.assertRaises(RuntimeError):
+                tasks.process_message(message.id)
+            tasks.process_message(message.id)
+            tasks.process_message(message.id)
+
+        send.delay.assert_called_once_with(message.id)
+
+    @mock.patch("operator_interface.tasks.send_message_to_interface")
+    @mock.patch("operator_interface.tasks.send_outbound_message")
+    def test_delivered_message_is_not_resent(self, send, _interface, _apply_async, _producer):
+        message = self.dispatch(0)
+        models.Message.objects.filter(id=message.id).update(state=models.Message.DELIVERED)
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=FakeRedis()):
+            tasks.process_message(message.id)
+        send.delay.assert_not_called()
+
+
+class InboundOrderingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pending = {}
+        self.client = mock.MagicMock()
+        self.client.zadd.side_effect = lambda key, mapping: self.pending.update(mapping)
+        self.client.zrange.side_effect = lambda key, start, end: [
+            str(m).encode() for m in sorted(self.pending.values())
+        ][:1]
+        self.client.zrem.side_effect = \
+            lambda key, member: self.pending.pop(member.decode(), None) is not None
+        self.client.lock.return_value.acquire.return_value = True
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_earlier_messages_are_handled_first(self):
+        # Message 5's task is still waiting for the lock when message 7's task gets it
+        self.pending["5"] = 5
+        handled = []
+
+        ordering.process_in_order(1, 7, handled.append)
+        ordering.process_in_order(1, 5, handled.append, queued=True)
+
+        self.assertEqual(handled, [5, 7])
+        self.client.lock.return_value.release.assert_called()
+
+    def test_lost_lock_stops_draining(self):
+        self.pending.update({"5": 5, "6": 6})
+        self.client.lock.return_value.reacquire.side_effect = redis.exceptions.LockNotOwnedError()
+        handled = []
+
+        ordering.process_in_order(1, 7, handled.append)
+
+        self.assertEqual(handled, [5])
+        self.assertEqual(self.pending, {"6": 6, "7": 7})
+
+    @override_settings(INBOUND_LOCK_TIMEOUT=0.03)
+    def test_lock_is_extended_while_handling(self):
+        lock = self.client.lock.return_value
+        ordering.process_in_order(1, 7, lambda _: time.sleep(0.1))
+        self.assertGreater(lock.reacquire.call_count, 1)
+
+    def test_lock_timeout(self):
+        self.client.lock.return_value.acquire.return_value = False
+        handled = []
+
+        with self.assertRaises(ordering.LockTimeout):
+            ordering.process_in_order(1, 7, handled.append)
+
+        self.assertEqual(handled, [])
+        self.assertEqual(self.pending, {"7": 7})
+
+    def test_redis_unavailable(self):
+        self.client.zadd.side_effect = redis.exceptions.ConnectionError()
+        handled = []
+
+        ordering.process_in_order(1, 7, handled.append)
+
+        self.assertEqual(handled, [7])
+
+
+class TaskRoutingTestCase(SimpleTestCase):
+    def test_routes_match_registered_tasks(self):
+        app = tasks.process_message.app
+        app.loader.import_default_modules()
+
+        for patterns in settings.TASK_CLASSES.values():
+            for pattern in patterns:
+                self.assertTrue(fnmatch.filter(app.tasks.keys(), pattern), pattern)
+        self.assertEqual(
+            app.amqp.router.route({}, "operator_interface.tasks.send_outbound_message")["queue"].name,
+            settings.TASK_QUEUES["outbound"],
+        )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProfileRefreshTestCase(TestCase):
+    url = "https://example.com/pic.jpg"
+
+    def setUp(self):
+        self.conversation = models.Conversation.objects.create()
+        self.cached = {}
+        self.client = mock.MagicMock()
+        self.client.hgetall.side_effect = lambda key: {
+            k.encode(): v.encode() for k, v in self.cached.items()
+        }
+        self.client.pipeline.return_value.hset.side_effect = \
+            lambda key, mapping: self.cached.update(mapping)
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, status, content=b"", headers=None):
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        response._content_consumed = True
+        response.headers.update(headers or {})
+        with mock.patch("wewillfixyourpc_bot.http_client.get", return_value=response) as get:
+            changed = profile_refresh.save_picture(self.conversation, self.url, "pic")
+        return changed, get.call_args.kwargs["headers"]
+
+    def test_refresh_is_only_held_off_after_success(self):
+        self.assertTrue(profile_refresh.should_refresh("FB", "psid"))
+        self.client.set.assert_called_once_with(
+            "profile_refresh:FB:psid", 1, nx=True, ex=profile_refresh.PENDING_TTL
+        )
+
+        response = requests.Response()
+        response.status_code = 500
+        with mock.patch("wewillfixyourpc_bot.http_client.get", return_value=response):
+            facebook.tasks.update_facebook_profile("psid", self.conversation.id)
+        self.client.set.assert_called_once()
+
+        profile_refresh.refreshed("FB", "psid")
+        self.client.set.assert_called_with("profile_refresh:FB:psid", 1, ex=settings.PROFILE_REFRESH_TTL)
+
+    def test_unchanged_picture_is_not_rewritten(self):
+        changed, headers = self.fetch(200, b"picture", {"ETag": '"v1"'})
+        self.assertTrue(changed)
+        self.assertEqual(headers, {})
+        name = self.conversation.conversation_pic.name
+
+        changed, headers = self.fetch(304)
+        self.assertFalse(changed)
+        self.assertEqual(headers, {"If-None-Match": '"v1"'})
+
+        changed, _ = self.fetch(200, b"picture")
+        self.assertFalse(changed)
+        self.assertEqual(self.conversation.conversation_pic.name, name)
+        self.assertEqual(self.cached["hash"], hashlib.sha256(b"picture").hexdigest())
+
+    def test_changed_picture_is_saved(self):
+        self.fetch(200, b"picture")
+        changed, _ = self.fetch(200, b"new picture")
+
+        self.assertTrue(changed)
+        self.assertEqual(self.conversation.conversation_pic.read(), b"new picture")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_MAX_SIZE=1024 * 1024)
+class MediaTestCase(TestCase):
+    def png(self, size):
+        f = io.BytesIO()
+        Image.new("RGB", size).save(f, "PNG")
+        f.seek(0)
+        return f
+
+    def test_image_is_stored_by_content(self):
+        obj = media.ingest_file(self.png((20, 10)), "photo.png")
+        digest = hashlib.sha256(self.png((20, 10)).read()).hexdigest()
+
+        self.assertEqual(obj.sha256, digest)
+        self.assertEqual(obj.path, f"media/{digest[:2]}/{digest[2:4]}/{digest}.png")
+        self.assertEqual(obj.content_type, "image/png")
+        self.assertEqual((obj.width, obj.height), (20, 10))
+        self.assertTrue(obj.is_image)
+
+    def test_duplicate_is_not_stored_twice(self):
+        first = media.ingest_file(self.png((5, 5)), "a.png")
+        with mock.patch("django.core.files.storage.FileSystemStorage.save") as save:
+            second = media.ingest_file(self.png((5, 5)), "b.png")
+
+        save.assert_not_called()
+        self.assertEqual(first, second)
+        self.assertEqual(models.MediaObject.objects.count(), 1)
+
+    def test_concurrent_ingest_keeps_one_file(self):
+        client = mock.MagicMock()
+        client.lock.return_value.acquire.side_effect = redis.exceptions.ConnectionError()
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=client):
+            first = media.ingest_file(self.png((6, 6)), "a.png")
+            # The other worker stored the file but hasn't created its row yet
+            models.MediaObject.objects.all().delete()
+            real_exists = FileSystemStorage.exists
+            checked = []
+
+            def exists(storage, name):
+                # The other worker's file only lands after this one has checked
+                checked.append(name)
+                return len(checked) > 1 and real_exists(storage, name)
+
+            with mock.patch.object(FileSystemStorage, "exists", exists):
+                second = media.ingest_file(self.png((6, 6)), "a.png")
+
+        self.assertEqual(second.path, first.path)
+        directory = DefaultStorage().path(os.path.dirname(first.path))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first.path)])
+        client.lock.assert_called_with(
+            media.INGEST_LOCK_KEY.format(first.sha256),
+            timeout=media.INGEST_LOCK_TIMEOUT,
+            blocking_timeout=media.INGEST_LOCK_WAIT,
+        )
+
+    def test_oversized_file_is_rejected(self):
+        with self.assertRaises(media.MediaTooLarge):
+            media.ingest_file(io.BytesIO(b"x" * (1024 * 1024 + 1)), "big.bin")
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Length"] = str(2 * 1024 * 1024)
+        response._content = b""
+        response._content_consumed = True
+        with self.assertRaises(media.MediaTooLarge):
+            media.ingest_response(response, "big.bin")
+        self.assertFalse(models.MediaObject.objects.exists())
+
+    def test_provider_media_id_is_uploaded_once(self):
+        obj = media.ingest_file(self.png((5, 5)), "a.png")
+        cache = {}
+        client = mock.MagicMock()
+        client.get.side_effect = lambda key: cache.get(key)
+        client.set.side_effect = lambda key, value, ex: cache.update({key: value.encode()})
+        upload = mock.MagicMock(return_value="1234")
+
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=client):
+            self.assertEqual(models.MediaObject.objects.get(sha256=obj.sha256), media.resolve(obj.url))
+            ids = [media.provider_media_id("TW", obj, upload, 60) for _ in range(3)]
+
+        self.assertEqual(ids, ["1234"] * 3)
+        upload.assert_called_once()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProfilePictureTestCase(TestCase):
+    def upload(self, colour):
+        f = io.BytesIO()
+        Image.new("RGB", (300, 200), colour).save(f, "PNG")
+        return SimpleUploadedFile("pic.png", f.getvalue(), content_type="image/png")
+
+    def setUp(self):
+        self.user = User.objects.create_user("operator")
+        self.profile = models.UserProfile.objects.create(user=self.user, picture=self.upload("red"))
+
+    def test_variants_are_generated_on_change(self):
+        fs = DefaultStorage()
+        old_hash = self.profile.picture_hash
+        for size in profile_pictures.SIZES:
+            self.assertTrue(fs.exists(profile_pictures.variant_path(old_hash, size)))
+
+        self.profile.picture = self.upload("blue")
+        self.profile.save()
+
+        self.assertNotEqual(self.profile.picture_hash, old_hash)
+        self.assertTrue(fs.exists(profile_pictures.variant_path(self.profile.picture_hash, 64)))
+        self.assertFalse(fs.exists(profile_pictures.variant_path(old_hash, 64)))
+
+    def test_picture_is_served_with_cache_headers(self):
+        url = profile_pictures.url(self.user, size=128)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b"".join(response.streaming_content))).size, (128, 85))
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["ETag"], f'"{self.profile.picture_hash}-128"')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_variant_is_regenerated(self):
+        path = profile_pictures.variant_path(self.profile.picture_hash, 128)
+        DefaultStorage().delete(path)
+
+        response = self.client.get(profile_pictures.url(self.user, size=128))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(DefaultStorage().exists(path))
+
+        for size in profile_pictures.SIZES:
+            DefaultStorage().delete(profile_pictures.variant_path(self.profile.picture_hash, size))
+        self.profile.picture.delete(save=False)
+        response = self.client.get(profile_pictures.url(self.user, size=128))
+        self.assertEqual(response.status_code, 404)
+
+    def test_unreadable_picture_still_saves(self):
+        self.profile.picture = SimpleUploadedFile("pic.png", b"not an image", content_type="image/png")
+        with self.assertLogs("operator_interface.models", "WARNING"):
+            self.profile.save()
+        self.assertEqual(models.UserProfile.objects.get(pk=self.profile.pk).picture.name, self.profile.picture.name)
+
+
+class DownRedis:
+    def __getattr__(self, name):
+        if name == "lock":
+            return mock.MagicMock()
+        raise redis.exceptions.RedisError()
+
+
+@override_settings(TOKEN_REFRESH_AHEAD=300, TOKEN_EXPIRY_MARGIN=30)
+class TokenCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        token_cache._cache.clear()
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=DownRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tokens = iter(f"token-{i}" for i in range(100))
+        self.fetch = mock.MagicMock(side_effect=lambda: {"access_token": next(self.tokens), "expires_in": 3600})
+
+    def test_token_is_reused_until_refresh_window(self):
+        self.assertEqual(token_cache.get_token("test", self.fetch), "token-0")
+        self.assertEqual(token_cache.get_token("test", self.fetch), "token-0")
+        self.fetch.assert_called_once()
+
+    def test_token_is_refreshed_ahead_of_expiry(self):
+        token_cache.get_token("test", self.fetch)
+        token = token_cache._cache["test"]
+        token_cache._cache["test"] = token._replace(refresh_at=token.refresh_at - 3600)
+
+        with mock.patch("threading.Thread") as thread:
+            self.assertEqual(token_cache.get_token("test", self.fetch), "token-0")
+        thread.return_value.start.assert_called_once()
+        token_cache._refresh_quietly(*thread.call_args.kwargs["args"])
+
+        self.assertEqual(token_cache.get_token("test", self.fetch), "token-1")
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        started = threading.Barrier(5)
+        tokens = []
+
+        def get():
+            started.wait()
+            tokens.append(token_cache.get_token("test", self.fetch))
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(tokens, ["token-0"] * 5)
+        self.fetch.assert_called_once()
+
+
+class AiohttpSessionTestCase(SimpleTestCase):
+    def test_session_per_loop(self):
+        async def get_session():
+            return aiohttp_client.get_session()
+
+        async def reuse():
+            session = aiohttp_client.get_session()
+            self.assertIs(aiohttp_client.get_session(), session)
+            await aiohttp_client.close_session()
+            self.assertTrue(session.closed)
+            self.assertIsNot(aiohttp_client.get_session(), session)
+            await aiohttp_client.close_session()
+
+        async_to_sync(reuse)()
+        first = async_to_sync(get_session)()
+        second = async_to_sync(get_session)()
+        self.assertIsNot(first, second)
+        self.assertEqual(len(aiohttp_client._sessions), 1)
+        aiohttp_client._close_sessions()
+        self.assertTrue(second.closed)
+        self.assertEqual(aiohttp_client._sessions, {})
+
+
+class KeycloakTokenTestCase(SimpleTestCase):
+    def setUp(self):
+        token_cache._cache.clear()
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=DownRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_async_token_uses_sync_fetch(self):
+        response = mock.MagicMock()
+        response.json.return_value = {"access_token": "token", "expires_in": 3600}
+        with mock.patch.object(http_client, "post", return_value=response) as post:
+            self.assertEqual(async_to_sync(keycloak_client.get_access_token)(), "token")
+        post.assert_called_once()
+
+    def test_async_token_failure(self):
+        with mock.patch.object(http_client, "post", side_effect=requests.exceptions.ConnectionError()):
+            with self.assertRaises(keycloak.exceptions.KeycloakClientError):
+                async_to_sync(keycloak_client.get_access_token)()
+
+
+class CustomerIdentityTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=DownRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def keycloak_user(self, email=None, phone=None, created=1500000000000):
+        return {
+            "id": str(uuid.uuid4()),
+            "email": email,
+            "createdTimestamp": created,
+            "attributes": {"phone": [phone] if phone else []},
+        }
+
+    def test_lookup_normalises_values(self):
+        user = self.keycloak_user(email="Customer@Example.com", phone="07700 900123")
+        users.index_user(user)
+
+        self.assertEqual(users.get_user_id_by_email(" customer@example.COM"), user["id"])
+        self.assertEqual(users.get_user_id_by_phone("+447700900123"), user["id"])
+        self.assertIsNone(users.get_user_id_by_email("other@example.com"))
+
+    def test_shared_identity_goes_to_oldest_account(self):
+        newer = self.keycloak_user(email="family@example.com", created=1600000000000)
+        older = self.keycloak_user(email="family@example.com", created=1500000000000)
+        users.index_user(newer)
+        users.index_user(older)
+
+        for _ in range(3):
+            self.assertEqual(users.get_user_id_by_email("family@example.com"), older["id"])
+
+    def test_update_refreshes_index(self):
+        user = self.keycloak_user(email="old@example.com")
+        users.index_user(user)
+        updated = dict(user, email="new@example.com")
+
+        with mock.patch("django_keycloak_auth.users.update_user"), \
+                mock.patch("django_keycloak_auth.users.get_user_by_id") as get_user_by_id:
+            get_user_by_id.return_value.user = updated
+            users.update_user(user["id"], email="new@example.com")
+
+        self.assertIsNone(users.get_user_id_by_email("old@example.com"))
+        self.assertEqual(users.get_user_id_by_email("new@example.com"), user["id"])
+
+    def test_sync_keeps_rows_written_during_scan(self):
+        gone = self.keycloak_user(email="gone@example.com")
+        user = self.keycloak_user(email="old@example.com")
+        other = self.keycloak_user(email="other@example.com")
+        users.index_user(gone)
+
+        def scan():
+            yield mock.Mock(user=user)
+            # Re-indexed by a message arriving part way through the scan
+            users.index_user(dict(user, email="new@example.com"))
+            yield mock.Mock(user=other)
+
+        with mock.patch("django_keycloak_auth.users.get_users", side_effect=scan, create=True):
+            users.sync_users()
+
+        self.assertIsNone(users.get_user_id_by_email("gone@example.com"))
+        self.assertIsNone(users.get_user_id_by_email("old@example.com"))
+        self.assertEqual(users.get_user_id_by_email("new@example.com"), user["id"])
+        self.assertEqual(users.get_user_id_by_email("other@example.com"), other["id"])
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.published = []
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+    def hincrby(self, key, field, amount):
+        self.hashes.setdefault(key, {}).setdefault(field, 0)
+        self.hashes[key][field] += amount
+
+    def pipeline(self, transaction=True):
+        client = self
+        calls = []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: calls.append((name, args, kwargs))
+
+            def execute(self):
+                return [getattr(client, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+        return Pipeline()
+
+
+@override_settings(
+    KEYCLOAK_PROFILE_CACHE_SIZE=2, KEYCLOAK_PROFILE_CACHE_LOCAL_TTL=30, KEYCLOAK_PROFILE_CACHE_TTL=300
+)
+class ProfileCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        profiles._cache.clear()
+        self.redis = FakeRedis()
+        patchers = [
+            mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=self.redis),
+            mock.patch("operator_interface.profiles._ensure_listener"),
+            mock.patch(
+                "django_keycloak_auth.users.get_user_by_id",
+                side_effect=lambda user_id: mock.Mock(user={"id": user_id, "firstName": "Keycloak"}),
+            ),
+        ]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        *_, self.keycloak = [patcher.start() for patcher in patchers]
+
+    def test_local_cache_is_lru(self):
+        for user_id in ("a", "b", "a", "c"):
+            profiles.get_user(user_id)
+
+        self.assertEqual(list(profiles._cache), ["a", "c"])
+
+    def test_local_entries_expire(self):
+        with mock.patch("time.monotonic", return_value=1000):
+            profiles.get_user("a")
+        with mock.patch("time.monotonic", return_value=1031):
+            self.assertIsNone(profiles._get_local("a"))
+
+    def test_shared_cache_is_used_across_processes(self):
+        profiles.get_user("a")
+        profiles._cache.clear()
+
+        self.assertEqual(profiles.get_user("a")["firstName"], "Keycloak")
+        self.keycloak.assert_called_once()
+
+    def test_invalidation_is_broadcast(self):
+        profiles.get_user("a")
+        profiles.invalidate_user("a")
+
+        self.assertNotIn("a", profiles._cache)
+        self.assertIsNone(self.redis.get(profiles.REDIS_KEY.format("a")))
+        self.assertEqual(self.redis.published, [(profiles.INVALIDATION_CHANNEL, "a")])
+
+    def test_listener_drops_invalidated_profiles(self):
+        profiles._set_local("a", {})
+        pubsub = mock.MagicMock()
+        pubsub.listen.return_value = [
+            {"type": "subscribe", "data": 1},
+        ]
+        client = mock.MagicMock()
+        client.pubsub.return_value = pubsub
+
+        # Resubscribing clears everything, since invalidations may have been missed meanwhile
+        profiles._listen(client)
+        self.assertEqual(profiles._cache, {})
+
+        profiles._set_local("a", {})
+        profiles._set_local("b", {})
+        pubsub.listen.return_value = [{"type": "message", "data": b"a"}]
+        profiles._listen(client)
+        self.assertEqual(list(profiles._cache), ["b"])
+
+
+class HttpClientTestCase(SimpleTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        http_client.flush_stats()
+        self.redis.hashes.clear()
+
+    def test_session_per_process(self):
+        session = http_client.get_session()
+        self.assertIs(http_client.get_session(), session)
+        with mock.patch("os.getpid", return_value=-1):
+            forked = http_client.get_session()
+            self.assertIsNot(forked, session)
+            self.assertIs(http_client.get_session(), forked)
+
+    def test_retries_and_timeout(self):
+        adapter = http_client.get_session().get_adapter("https://example.com")
+        self.assertEqual(adapter.max_retries.total, settings.HTTP_RETRIES)
+        self.assertEqual(tuple(adapter.max_retries.status_forcelist), (502, 503, 504))
+        self.assertFalse(adapter.max_retries.raise_on_status)
+
+        response = requests.Response()
+        response.status_code = 200
+        with mock.patch("requests.Session.request", return_value=response) as request:
+            http_client.get("https://example.com/a")
+            http_client.get("https://example.com/b", timeout=1)
+        self.assertEqual(
+            request.call_args_list[0].kwargs["timeout"],
+            (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT),
+        )
+        self.assertEqual(request.call_args_list[1].kwargs["timeout"], 1)
+
+    def test_stats_are_flushed_in_batches(self):
+        response = requests.Response()
+        response.status_code = 200
+        with mock.patch("requests.Session.request", return_value=response):
+            for _ in range(3):
+                http_client.get("https://example.com/")
+        self.assertEqual(self.redis.hashes, {})
+
+        http_client.flush_stats()
+        self.assertEqual(self.redis.hashes[http_client.REDIS_STATS_KEY]["example.com:requests"], 3)
+        self.assertEqual(self.redis.hashes[http_client.REDIS_STATS_KEY]["example.com:status_2xx"], 3)
+
+
+@override_settings(OUTBOUND_RATE_LIMITS={"test": {"platform": (10, 1), "recipient": (2, 60)}})
+class RateLimitTestCase(SimpleTestCase):
+    def setUp(self):
+        rate_limit._reserve_script = None
+        self.addCleanup(setattr, rate_limit, "_reserve_script", None)
+
+    def test_buckets(self):
+        self.assertEqual(rate_limit._buckets("test", "a"), [
+            ("outbound_rate_limit:test", 100, 900),
+            ("outbound_rate_limit:test:a", 30000, 30000),
+        ])
+        self.assertEqual(rate_limit._buckets("other", "a"), [])
+
+    def test_wait_bucket(self):
+        self.assertEqual(rate_limit._wait_bucket(0), "wait_le_0")
+        self.assertEqual(rate_limit._wait_bucket(0.05), "wait_le_0.1")
+        self.assertEqual(rate_limit._wait_bucket(1), "wait_le_1")
+        self.assertEqual(rate_limit._wait_bucket(301), "wait_le_inf")
+
+    def test_redis_down_fails_open(self):
+        client = mock.MagicMock()
+        client.register_script.return_value.side_effect = redis.exceptions.ConnectionError()
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=client):
+            self.assertEqual(rate_limit.reserve("test", "a"), 0)
+        client.pipeline.assert_not_called()
+
+    @unittest.skipUnless(fakeredis, "fakeredis is not installed")
+    def test_burst_then_refill(self):
+        client = fakeredis.FakeRedis()
+        now = [1000.0]
+        with mock.patch("wewillfixyourpc_bot.redis_client.get_client", return_value=client), \
+                mock.patch("time.time", side_effect=lambda: now[0]):
+            self.assertEqual(rate_limit.reserve("test", "a"), 0)
+            self.assertEqual(rate_limit.reserve("test", "a"), 0)
+            self.assertEqual(rate_limit.reserve("test", "b"), 0)
+            self.assertAlmostEqual(rate_limit.reserve("test", "a"), 30)
+
+            now[0] += 90
+            self.assertEqual(rate_limit.reserve("test", "a"), 0)
+
+        self.assertEqual(int(client.hget(rate_limit.REDIS_STATS_KEY, "test:delayed")), 1)
+        self.assertEqual(int(client.hget(rate_limit.REDIS_STATS_KEY, "test:immediate")), 4)
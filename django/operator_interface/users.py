@@ -0,0 +1,140 @@
+import datetime
+import typing
+import uuid
+
+import django_keycloak_auth.users
+import phonenumbers
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+import operator_interface.models
+import operator_interface.profiles
+
+
+def normalise_phone_number(number: str) -> typing.Optional[str]:
+    try:
+        number = phonenumbers.parse(number, settings.PHONENUMBER_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalise_email(email: str) -> typing.Optional[str]:
+    if not email:
+        return None
+    return email.strip().lower()
+
+
+def make_identities(user: dict) -> typing.List[operator_interface.models.CustomerIdentity]:
+    user_id = user.get("id")
+    created = user.get("createdTimestamp")
+    user_created_at = datetime.datetime.fromtimestamp(created / 1000, tz=datetime.timezone.utc) \
+        if created else None
+    identities = {}
+
+    email = normalise_email(user.get("email"))
+    if email:
+        identities[(operator_interface.models.CustomerIdentity.EMAIL, email)] = True
+
+    for number in user.get("attributes", {}).get("phone", []):
+        number = normalise_phone_number(number)
+        if number:
+            identities[(operator_interface.models.CustomerIdentity.PHONE, number)] = True
+
+    return [
+        operator_interface.models.CustomerIdentity(
+            identity_type=identity_type, value=value, user_id=user_id, user_created_at=user_created_at
+        )
+        for identity_type, value in identities.keys()
+    ]
+
+
+def index_user(user: dict) -> None:
+    if not user or not user.get("id"):
+        return
+
+    with transaction.atomic():
+        operator_interface.models.CustomerIdentity.objects.filter(
+            user_id=user.get("id")
+        ).delete()
+        operator_interface.models.CustomerIdentity.objects.bulk_create(
+            make_identities(user)
+        )
+
+
+def refresh_user(user_id: str) -> None:
+    user = django_keycloak_auth.users.get_user_by_id(str(user_id)).user
+    index_user(user)
+
+
+def sync_users() -> int:
+    scan_started_at = timezone.now()
+    identities = []
+    for user in django_keycloak_auth.users.get_users():
+        identities.extend(make_identities(user.user))
+
+    with transaction.atomic():
+        # The scan can take minutes, and anyone re-indexed by update_user or get_or_create_user
+        # in the meantime has newer rows than the scan saw, so leave those users alone
+        fresh_users = set(
+            operator_interface.models.CustomerIdentity.objects.filter(
+                indexed_at__gte=scan_started_at
+            ).values_list("user_id", flat=True)
+        )
+        operator_interface.models.CustomerIdentity.objects.filter(
+            indexed_at__lt=scan_started_at
+        ).delete()
+        identities = [i for i in identities if uuid.UUID(str(i.user_id)) not in fresh_users]
+        operator_interface.models.CustomerIdentity.objects.bulk_create(
+            identities, batch_size=1000, ignore_conflicts=True
+        )
+
+    return len(identities)
+
+
+def get_user_id(identity_type: str, value: typing.Optional[str]) -> typing.Optional[str]:
+    if not value:
+        return None
+
+    # Several accounts can share a phone number or email address, e.g. a family sharing an
+    # inbox. Messages always go to the oldest of those accounts, so the choice is stable.
+    user_id = (
+        operator_interface.models.CustomerIdentity.objects.filter(
+            identity_type=identity_type, value=value
+        )
+        .order_by(F("user_created_at").asc(nulls_last=True), "user_id")
+        .values_list("user_id", flat=True)
+        .first()
+    )
+    return str(user_id) if user_id else None
+
+
+def get_user_id_by_phone(number: str) -> typing.Optional[str]:
+    return get_user_id(
+        operator_interface.models.CustomerIdentity.PHONE, normalise_phone_number(number)
+    )
+
+
+def get_user_id_by_email(email: str) -> typing.Optional[str]:
+    return get_user_id(
+        operator_interface.models.CustomerIdentity.EMAIL, normalise_email(email)
+    )
+
+
+def update_user(user_id: str, force_update=False, **kwargs) -> None:
+    django_keycloak_auth.users.update_user(
+        str(user_id), force_update=force_update, **kwargs
+    )
+    operator_interface.profiles.invalidate_user(user_id)
+    if "email" in kwargs or "phone" in kwargs:
+        refresh_user(user_id)
+
+
+def get_or_create_user(**kwargs) -> typing.Optional[dict]:
+    user = django_keycloak_auth.users.get_or_create_user(**kwargs)
+    if user:
+        operator_interface.profiles.invalidate_user(user.get("id"))
+        refresh_user(user.get("id"))
+    return user
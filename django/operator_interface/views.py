@@ -1,12 +1,13 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse, HttpResponseBadRequest, Http404
-from django.contrib.auth.models import User
-from PIL import Image
+from django.http import HttpResponse, HttpResponseBadRequest, Http404, FileResponse
+from django.core.files.storage import DefaultStorage
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 import json
 import dateutil.parser
-from . import models
+from . import models, profile_pictures
 import fulfillment.models
 import rasa_api.actions
 
@@ -59,17 +60,43 @@ def push_subscription(request):
     return HttpResponseBadRequest()
 
 
+def _open_variant(profile, size: int):
+    fs = DefaultStorage()
+    try:
+        return fs.open(profile_pictures.variant_path(profile.picture_hash, size), "rb")
+    except FileNotFoundError:
+        pass
+
+    # Variants are derived from the uploaded picture, so one that's gone missing can be rebuilt
+    try:
+        profile_pictures.refresh(profile)
+        return fs.open(profile_pictures.variant_path(profile.picture_hash, size), "rb")
+    except (OSError, ValueError):
+        raise Http404()
+
+
 def profile_picture(request, user_id):
-    user = get_object_or_404(User, id=user_id)
+    profile = get_object_or_404(models.UserProfile, user_id=user_id)
     try:
-        image = user.userprofile.picture
-    except User.userprofile.RelatedObjectDoesNotExist:
+        if not profile.picture_hash:
+            profile_pictures.refresh(profile)
+    except (OSError, ValueError):
         raise Http404()
-    i = Image.open(image)
-    i.thumbnail((64, 64))
-    i = i.convert("RGB")
-    response = HttpResponse(content_type="image/jpg")
-    i.save(response, "JPEG")
+
+    size = profile_pictures.variant_size(request.GET.get("size"))
+    etag = f'"{profile.picture_hash}-{size}"'
+    last_modified = int(profile.picture_updated_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(_open_variant(profile, size), content_type="image/jpeg")
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+
+    # Versioned URLs change whenever the picture does so they never need revalidating
+    if request.GET.get("v") == profile_pictures.version(profile.picture_hash):
+        patch_cache_control(response, public=True, max_age=profile_pictures.VERSIONED_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=profile_pictures.UNVERSIONED_MAX_AGE)
     return response
 
 
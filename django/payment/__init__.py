@@ -1,11 +1,13 @@
-import aiohttp
 import uuid
 import decimal
 import datetime
 import dateutil.parser
-import django_keycloak_auth.clients
+import keycloak.exceptions
 from django.conf import settings
 
+import wewillfixyourpc_bot.aiohttp_client
+import wewillfixyourpc_bot.keycloak_client
+
 
 class PaymentException(Exception):
     def __init__(self, *args):
@@ -113,18 +115,22 @@ class Payment:
         return total
 
 
+async def _get_access_token() -> str:
+    try:
+        return await wewillfixyourpc_bot.keycloak_client.get_access_token()
+    except keycloak.exceptions.KeycloakClientError as e:
+        raise PaymentException() from e
+
+
 async def get_payment(payment_id: uuid.UUID) -> Payment:
-    access_token = django_keycloak_auth.clients.get_new_access_token()[0].get(
-        "access_token"
-    )
-    async with aiohttp.ClientSession() as session:
-        r = await session.get(
-            f"{settings.PAYMENT_HTTP_URL}/payment/{str(payment_id)}/",
-            headers={"Authorization": f"Bearer {access_token}"},
-        )
-    if r.status != 200:
-        raise PaymentException()
-    resp = await r.json()
+    access_token = await _get_access_token()
+    async with wewillfixyourpc_bot.aiohttp_client.get_session().get(
+        f"{settings.PAYMENT_HTTP_URL}/payment/{str(payment_id)}/",
+        headers={"Authorization": f"Bearer {access_token}"},
+    ) as r:
+        if r.status != 200:
+            raise PaymentException()
+        resp = await r.json()
     return Payment(
         payment_id=uuid.UUID(resp.get("id")),
         timestamp=dateutil.parser.isoparse(resp.get("timestamp")),
@@ -148,20 +154,17 @@ async def get_payment(payment_id: uuid.UUID) -> Payment:
 async def create_payment(
     environment: str, customer_id: uuid.UUID, items: [PaymentItem]
 ) -> uuid.UUID:
-    access_token = django_keycloak_auth.clients.get_new_access_token()[0].get(
-        "access_token"
-    )
-    async with aiohttp.ClientSession() as session:
-        r = await session.post(
-            f"{settings.PAYMENT_HTTP_URL}/payment/new/",
-            headers={"Authorization": f"Bearer {access_token}"},
-            json={
-                "environment": environment,
-                "customer_id": str(customer_id),
-                "items": [i.as_json for i in items],
-            },
-        )
-    if r.status != 200:
-        raise PaymentException()
-    resp = await r.json()
+    access_token = await _get_access_token()
+    async with wewillfixyourpc_bot.aiohttp_client.get_session().post(
+        f"{settings.PAYMENT_HTTP_URL}/payment/new/",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={
+            "environment": environment,
+            "customer_id": str(customer_id),
+            "items": [i.as_json for i in items],
+        },
+    ) as r:
+        if r.status != 200:
+            raise PaymentException()
+        resp = await r.json()
     return uuid.UUID(resp.get("id"))
@@ -5,16 +5,16 @@ from django.core.mail import send_mail
 from django.conf import settings
 
 import operator_interface.models
-import operator_interface.tasks
+import operator_interface.outbox
+import operator_interface.profiles
 import operator_interface.consumers
-import django_keycloak_auth.users
 from . import models
 
 
 @shared_task
 def process_payment(pid):
     payment_o = models.Payment.objects.get(id=pid)
-    user = django_keycloak_auth.users.get_user_by_id(payment_o.customer_id)
+    user = operator_interface.profiles.get_user(payment_o.customer_id)
 
     email_items = "\n\n".join(
         [
@@ -33,9 +33,9 @@ Order date: {payment_o.timestamp.strftime("%c")}
 Environment: {next(e[1] for e in models.Payment.ENVIRONMENTS if e[0] == payment_o.environment)}
 Payment method: {payment_o.payment_method}
 ---
-Customer name: {user.user.get("firstName")} {user.user.get("lastName")}
-Customer email: {user.user.get("email")}
-Customer phone: {next(iter(user.user.get("attributes", {}).get("phone", [])), "")}
+Customer name: {user.get("firstName")} {user.get("lastName")}
+Customer email: {user.get("email")}
+Customer phone: {next(iter(user.get("attributes", {}).get("phone", [])), "")}
 ---
 Items:
 
@@ -65,7 +65,6 @@ Items:
             message_id=uuid.uuid4(),
             payment_confirm=payment_o,
         )
-        message.save()
-        operator_interface.tasks.process_message.delay(message.id)
+        operator_interface.outbox.dispatch(message)
     except operator_interface.models.Message.DoesNotExist:
         pass
@@ -15,7 +15,6 @@ import fuzzywuzzy.fuzz
 import fuzzywuzzy.process
 import fuzzywuzzy.string_processing
 import fuzzywuzzy.utils
-import inflect
 import keycloak.exceptions
 import phonenumbers
 import pytz
@@ -32,11 +31,23 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.forms import FormAction
 
 import operator_interface.models
+import operator_interface.users
 import rasa_api.models
 from fulfillment import models
 
 tz = pytz.timezone("Europe/London")
-p = inflect.engine()
+_inflect_engine = None
+
+
+def get_inflect_engine():
+    # inflect takes seconds to import, and this module is loaded by every worker at startup
+    global _inflect_engine
+    if _inflect_engine is None:
+        import inflect
+
+        _inflect_engine = inflect.engine()
+    return _inflect_engine
+
 
 SurfaceCapabilities = namedtuple(
     "SurfaceCapabilities",
@@ -166,7 +177,7 @@ def update_user_info(
 ):
     conversation = platform.conversation
     if not conversation.conversation_user_id and email:
-        user = django_keycloak_auth.users.get_or_create_user(
+        user = operator_interface.users.get_or_create_user(
             email=email,
             first_name=conversation.conversation_name,
             required_actions=["UPDATE_PASSWORD", "UPDATE_PROFILE", "VERIFY_EMAIL"],
@@ -177,7 +188,7 @@ def update_user_info(
             conversation.update_user_id(user.get("id"))
 
     if conversation.conversation_user_id:
-        django_keycloak_auth.users.update_user(
+        operator_interface.users.update_user(
             str(conversation.conversation_user_id), force_update=force_update, **kwargs
         )
 
@@ -560,12 +571,12 @@ class ActionOpeningHours(Action):
                     else:
                         if hours is None:
                             dispatcher.utter_message(
-                                f"On {want_date.strftime('%A %B')} the {p.ordinal(want_date.day)}"
+                                f"On {want_date.strftime('%A %B')} the {get_inflect_engine().ordinal(want_date.day)}"
                                 f" we are closed."
                             )
                         else:
                             dispatcher.utter_message(
-                                f"On {want_date.strftime('%A %B')} the {p.ordinal(want_date.day)}"
+                                f"On {want_date.strftime('%A %B')} the {get_inflect_engine().ordinal(want_date.day)}"
                                 f" we are {format_hours(hours)}."
                             )
                 return []
@@ -606,7 +617,7 @@ class ActionOpeningHours(Action):
                     lambda f: f.day.weekday() in day_ids_in_period, future_overrides
                 )
                 future_overrides_txt = map(
-                    lambda d: f"\nOn {d.day.strftime('%A %B')} the {p.ordinal(d.day.day)} we will be "
+                    lambda d: f"\nOn {d.day.strftime('%A %B')} the {get_inflect_engine().ordinal(d.day.day)} we will be "
                     f"{format_hours(d)}.",
                     future_overrides,
                 )
@@ -620,7 +631,7 @@ class ActionOpeningHours(Action):
         days = "\n".join(days)
 
         future_overrides_txt = map(
-            lambda d: f"\nOn {d.day.strftime('%A %B')} the {p.ordinal(d.day.day)} we will be "
+            lambda d: f"\nOn {d.day.strftime('%A %B')} the {get_inflect_engine().ordinal(d.day.day)} we will be "
             f"{format_hours(d)}.",
             future_overrides,
         )
@@ -765,7 +776,7 @@ class ActionRepair(Action):
                 )()
                 if repair_m:
                     repair_strs.append(
-                        f"A{p.a(f'{d.display_name} {repair.display_name}')[1:]} will cost "
+                        f"A{get_inflect_engine().a(f'{d.display_name} {repair.display_name}')[1:]} will cost "
                         f"£{repair_m.price} and will take roughly {repair_m.repair_time}."
                     )
 
@@ -1310,7 +1321,7 @@ class RepairBookForm(BaseForm):
                 else:
                     dispatcher.utter_message(
                         f"Sorry, we're not open then. "
-                        f"On {date.strftime('%A')} the {p.ordinal(date.day)} we are {format_hours(await sync_to_async(is_open_on)(date))}"
+                        f"On {date.strftime('%A')} the {get_inflect_engine().ordinal(date.day)} we are {format_hours(await sync_to_async(is_open_on)(date))}"
                     )
                     return {"time": None}
 
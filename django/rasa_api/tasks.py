@@ -1,7 +1,7 @@
 from django.conf import settings
 from celery import shared_task
 import operator_interface.tasks
-import requests
+import wewillfixyourpc_bot.http_client
 import json
 import logging
 import uuid
@@ -39,7 +39,7 @@ def handle_event(cid: int, event: str):
 def handle_text(platform: ConversationPlatform, text: str):
     operator_interface.tasks.process_typing_on.delay(platform.id)
 
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         f"{settings.RASA_HTTP_URL}/webhooks/rest/webhook?stream=true",
         json={"sender": f"CONV:{platform.id}", "message": text},
         stream=True,
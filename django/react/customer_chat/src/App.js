@@ -113,6 +113,7 @@ class App extends Component {
         this.msgRef = React.createRef();
         this.ws = new ReconnectingWebSocket(process.env.NODE_ENV === 'production' ? "wss://" + window.location.host + "/ws/chat/" : "ws://localhost:8000/ws/chat/");
         this.pending_messages = [];
+        this.cursor = null;
         this.sw_registration = null;
         this.push_subscription = null;
 
@@ -133,6 +134,7 @@ class App extends Component {
         this.setupChat = this.setupChat.bind(this);
         this.sendMsg = this.sendMsg.bind(this);
         this.getMsg = this.getMsg.bind(this);
+        this.loadOlderMessages = this.loadOlderMessages.bind(this);
         this.resyncWs = this.resyncWs.bind(this);
         this.wsRecv = this.wsRecv.bind(this);
         this.messageObserverCallback = this.messageObserverCallback.bind(this);
@@ -177,7 +179,8 @@ class App extends Component {
         if (this.state.token) {
             this.ws.send(JSON.stringify({
                 type: "resyncReq",
-                token: this.state.token
+                token: this.state.token,
+                last_seen: this.state.conversation ? this.cursor : null
             }));
             this.pending_messages.forEach(m => {
                 this.ws.send(JSON.stringify({
@@ -194,12 +197,50 @@ class App extends Component {
         }
     }
 
+    updateCursor(cursor) {
+        if (typeof cursor !== "undefined" && (this.cursor === null || cursor > this.cursor)) {
+            this.cursor = cursor;
+        }
+    }
+
     wsRecv(msg) {
         const data = JSON.parse(msg.data);
+        this.updateCursor(data.cursor);
         if (data.type === "conversation") {
+            const conversation = this.state.conversation;
+            if (conversation && data.messages.length) {
+                const start = conversation.messages.indexOf(data.messages[0]);
+                if (start > 0) {
+                    data.messages = conversation.messages.slice(0, start).concat(data.messages);
+                    data.messages_before = conversation.messages_before;
+                }
+            }
             this.setState({
                 conversation: data
             });
+        } else if (data.type === "conversation_delta") {
+            const conversation = this.state.conversation;
+            if (conversation) {
+                const last_message = conversation.messages.length ?
+                    conversation.messages[conversation.messages.length - 1] : -1;
+                const new_messages = data.messages.filter(m => m > last_message);
+                this.setState({
+                    conversation: Object.assign({}, conversation, {
+                        current_agent: data.current_agent,
+                        messages: conversation.messages.concat(new_messages)
+                    })
+                });
+            }
+        } else if (data.type === "message_page") {
+            const conversation = this.state.conversation;
+            if (conversation && conversation.messages_before === data.before) {
+                this.setState({
+                    conversation: Object.assign({}, conversation, {
+                        messages: data.messages.concat(conversation.messages),
+                        messages_before: data.messages_before
+                    })
+                });
+            }
         } else if (data.type === "message") {
             const messages = this.state.messages;
             messages[data.id] = new MessageData(data.id, data, this);
@@ -216,6 +257,15 @@ class App extends Component {
         }
     }
 
+    loadOlderMessages() {
+        if (this.state.conversation && this.state.conversation.messages_before !== null) {
+            this.ws.send(JSON.stringify({
+                type: "getMessagePage",
+                before: this.state.conversation.messages_before
+            }));
+        }
+    }
+
     getMsg(m) {
         if (typeof this.state.messages[m] === "undefined") {
             return new MessageData(m, null, this);
@@ -442,6 +492,8 @@ class App extends Component {
                     <button onClick={() => this.setState({ask_notification: false})}>Dismiss</button>
                 </div> : null}
                 <div className="messages" ref={this.messages}>
+                    {this.state.conversation && this.state.conversation.messages_before !== null ?
+                        <button onClick={this.loadOlderMessages}>Load older messages</button> : null}
                     {this.state.conversation ? this.state.conversation.messages.map((id, i) => {
                         let msg = this.getMsg(id);
                         const next_mid = this.state.conversation.messages[i + 1];
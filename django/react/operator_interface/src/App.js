@@ -22,6 +22,8 @@ import Select, {Option} from "@material/react-select";
 export const ROOT_URL = process.env.NODE_ENV === 'production' ?
     "https://" + window.location.host + "/" : "http://localhost:8000/";
 export const SockContext = React.createContext(null);
+const INLINE_MESSAGES = 50;
+const MESSAGE_PAGE_SIZE = 100;
 
 
 class BookingData {
@@ -143,13 +145,7 @@ class MessageData {
 
     load() {
         if (!this.isLoaded()) {
-            if (this.app.pending_messages.indexOf(this.id) === -1) {
-                this.app.sock.send(JSON.stringify({
-                    type: "getMessage",
-                    id: this.id
-                }));
-                this.app.pending_messages.push(this.id);
-            }
+            this.app.requestMessage(this.id);
             return false;
         }
         return true;
@@ -289,6 +285,10 @@ class ConversationData {
         return this.data.messages.map(m => this.get_message(m));
     }
 
+    get has_older_messages() {
+        return typeof this.data.messages_before !== "undefined" && this.data.messages_before !== null;
+    }
+
     get payments() {
         return this.data.payments.map(p => this.get_payment(p));
     }
@@ -389,6 +389,17 @@ class ConversationData {
         return this.data.can_message;
     }
 
+    load_older_messages() {
+        if (this.has_older_messages) {
+            this.app.sock.send(JSON.stringify({
+                type: "getMessages",
+                cid: this.id,
+                before: this.data.messages_before,
+                limit: MESSAGE_PAGE_SIZE
+            }));
+        }
+    }
+
     send(text) {
         if (this.can_message()) {
             this.app.sock.send(JSON.stringify({
@@ -399,6 +410,13 @@ class ConversationData {
         }
     }
 
+    retry_failed() {
+        this.app.sock.send(JSON.stringify({
+            type: "replayFailed",
+            cid: this.id
+        }));
+    }
+
     send_preset(id) {
         if (this.can_message()) {
             this.app.sock.send(JSON.stringify({
@@ -441,7 +459,7 @@ class App extends Component {
             error: null,
             open: true,
             newOpen: false,
-            lastMessage: -1,
+            cursor: null,
             conversationOffset: 0,
             selectedCid: null,
             showCustomerPanel: true,
@@ -456,6 +474,8 @@ class App extends Component {
         };
 
         this.pending_messages = [];
+        this.requested_messages = [];
+        this.requestMessagesTimeout = null;
         this.pending_payments = [];
         this.pending_bookings = [];
 
@@ -502,31 +522,132 @@ class App extends Component {
     }
 
     selectConversation(i) {
+        if (this.state.selectedCid !== null && this.state.selectedCid !== i) {
+            this.sock.send(JSON.stringify({
+                type: "unsubscribe",
+                cid: this.state.selectedCid
+            }));
+        }
+        this.subscribe(i);
         this.setState({
             selectedCid: i
         })
     }
 
+    subscribe(cid) {
+        this.sock.send(JSON.stringify({
+            type: "subscribe",
+            cid: cid
+        }));
+        this.sock.send(JSON.stringify({
+            type: "getConversation",
+            id: cid,
+            inline_messages: INLINE_MESSAGES
+        }));
+    }
+
+    requestMessage(id) {
+        if (this.pending_messages.indexOf(id) !== -1) {
+            return;
+        }
+        this.pending_messages.push(id);
+        this.requested_messages.push(id);
+        if (this.requestMessagesTimeout === null) {
+            this.requestMessagesTimeout = setTimeout(() => {
+                this.requestMessagesTimeout = null;
+                this.sendMessagesRequest(this.requested_messages);
+                this.requested_messages = [];
+            }, 0);
+        }
+    }
+
+    sendMessagesRequest(ids) {
+        for (let i = 0; i < ids.length; i += MESSAGE_PAGE_SIZE) {
+            this.sock.send(JSON.stringify({
+                type: "getMessages",
+                ids: ids.slice(i, i + MESSAGE_PAGE_SIZE)
+            }));
+        }
+    }
+
+    receiveMessage(data) {
+        const messages = this.state.messages;
+        messages[data.id] = new MessageData(data.id, data, this);
+        let p_index = this.pending_messages.indexOf(data.id);
+        if (p_index > -1) {
+            this.pending_messages.splice(p_index, 1);
+        }
+        this.updateCursor(data.cursor);
+        return messages;
+    }
+
     handleReceiveMessage(msg) {
         const data = JSON.parse(msg.data);
 
         if (data.type === "message") {
-            const messages = this.state.messages;
-            messages[data.id] = new MessageData(data.id, data, this);
-            let p_index = this.pending_messages.indexOf(data.id);
-            if (p_index > -1) {
-                this.pending_messages.splice(p_index, 1);
+            this.setState({
+                messages: this.receiveMessage(data),
+            });
+        } else if (data.type === "messages") {
+            let messages = this.state.messages;
+            data.messages.forEach(m => {
+                messages = this.receiveMessage(m);
+            });
+            const conversations = this.state.conversations;
+            const conversation = conversations[data.cid];
+            if (typeof conversation !== "undefined" && typeof data.before !== "undefined" &&
+                conversation.data.messages_before === data.before) {
+                conversation.data = Object.assign({}, conversation.data, {
+                    messages: data.messages.map(m => m.id).concat(conversation.data.messages),
+                    messages_before: data.messages_before,
+                });
             }
             this.setState({
+                conversations: conversations,
                 messages: messages,
-                lastMessage: data.timestamp
             });
         } else if (data.type === "conversation") {
             const conversations = this.state.conversations;
+            const existing = conversations[data.id];
+            if (typeof existing !== "undefined" && data.messages.length) {
+                const start = existing.data.messages.indexOf(data.messages[0]);
+                if (start > 0) {
+                    data.messages = existing.data.messages.slice(0, start).concat(data.messages);
+                    data.messages_before = existing.data.messages_before;
+                }
+            }
             conversations[data.id] = new ConversationData(data.id, data, this);
+            let messages = this.state.messages;
+            (data.recent_messages || []).forEach(m => {
+                messages = this.receiveMessage(m);
+            });
             this.setState({
-                conversations: conversations
+                conversations: conversations,
+                messages: messages
             });
+            this.updateCursor(data.cursor);
+        } else if (data.type === "conversation_summary") {
+            const conversations = this.state.conversations;
+            const conversation = conversations[data.id];
+            if (typeof conversation === "undefined") {
+                this.sock.send(JSON.stringify({
+                    type: "getConversation",
+                    id: data.id
+                }));
+            } else {
+                conversation.data = Object.assign({}, conversation.data, {
+                    agent_responding: data.agent_responding,
+                    current_user_responding: data.current_user_responding,
+                    user_responding: data.user_responding,
+                    unread_count: data.unread_count,
+                });
+                if (data.last_message_id !== null && conversation.data.messages.indexOf(data.last_message_id) === -1) {
+                    conversation.data.messages = conversation.data.messages.concat([data.last_message_id]);
+                }
+                this.setState({
+                    conversations: conversations
+                });
+            }
         } else if (data.type === "conversation_delete") {
             const conversations = this.state.conversations;
             let new_cid = this.state.selectedCid;
@@ -542,6 +663,7 @@ class App extends Component {
             let new_cid = this.state.selectedCid;
             if (new_cid === data.id) {
                 new_cid = data.nid;
+                this.subscribe(new_cid);
             }
             this.setState({
                 selectedCid: new_cid
@@ -574,11 +696,39 @@ class App extends Component {
             this.setState({
                 config: data.config
             });
+        } else if (data.type === "resync") {
+            if (data.reload) {
+                this.reload();
+            } else {
+                this.updateCursor(data.cursor);
+            }
+        }
+    }
+
+    reload() {
+        this.state.cursor = null;
+        this.state.conversationOffset = 0;
+        if (this.state.selectedCid !== null) {
+            this.subscribe(this.state.selectedCid);
+        }
+        this.sock.send(JSON.stringify({
+            type: "getConversations",
+            offset: 0
+        }));
+    }
+
+    updateCursor(cursor) {
+        if (typeof cursor === "number" && (this.state.cursor === null || cursor > this.state.cursor)) {
+            this.state.cursor = cursor;
         }
     }
 
     handleOpen() {
-        if (this.state.lastMessage === -1) {
+        if (this.state.selectedCid !== null) {
+            this.subscribe(this.state.selectedCid);
+        }
+
+        if (this.state.cursor === null) {
             this.sock.send(JSON.stringify({
                 type: "getConversations",
                 offset: this.state.conversationOffset
@@ -586,16 +736,11 @@ class App extends Component {
         } else {
             this.sock.send(JSON.stringify({
                 type: "resyncReq",
-                lastMessage: this.state.lastMessage
+                cursor: this.state.cursor
             }));
         }
 
-        this.pending_messages.forEach(m => {
-            this.sock.send(JSON.stringify({
-                type: "getMessage",
-                id: m
-            }));
-        });
+        this.sendMessagesRequest(this.pending_messages);
         this.pending_payments.forEach(p => {
             this.sock.send(JSON.stringify({
                 type: "getPayment",
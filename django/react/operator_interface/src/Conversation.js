@@ -6,6 +6,7 @@ import MaterialIcon from '@material/react-material-icon';
 import CustomerPanel from "./CustomerPanel";
 import './App.scss';
 import Dialog, {DialogButton, DialogContent, DialogFooter, DialogTitle} from "@material/react-dialog";
+import Button from "@material/react-button";
 
 export const entity_map = {
     "phone-number": "phone number",
@@ -161,6 +162,10 @@ export default class Conversation extends Component {
                         </React.Fragment> : null}
                     </Dialog>
                     <div className="messages" ref="messages">
+                        {this.props.conversation.has_older_messages ?
+                            <Button onClick={() => this.props.conversation.load_older_messages()}>
+                                Load older messages
+                            </Button> : null}
                         {this.props.conversation.messages.map((m, i, a) => {
                             let out = [];
                             let d = new Date(0);
@@ -254,7 +259,12 @@ export default class Conversation extends Component {
                                             <span>Sent by {m.sent_by}</span> : null
                                         }
                                         {m.direction === "I" && m.state ?
-                                            <span>{status_map[m.state]}</span> : null
+                                            (m.state === "F" ?
+                                                <span className="entity"
+                                                      onClick={() => this.props.conversation.retry_failed()}>
+                                                    {status_map[m.state]}. Click here to retry.
+                                                </span> :
+                                                <span>{status_map[m.state]}</span>) : null
                                         }
                                     </div>)) : <div className="dir-O">
                                     <div>Loading...</div>
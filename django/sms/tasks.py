@@ -2,17 +2,17 @@ from celery import shared_task
 import typing
 import json
 import requests
-import phonenumbers
+import wewillfixyourpc_bot.http_client
 import operator_interface.consumers
-import operator_interface.tasks
-import django_keycloak_auth.users
-import django_keycloak_auth.clients
+import operator_interface.delivery
+import operator_interface.outbox
+import operator_interface.users
+import wewillfixyourpc_bot.keycloak_client
+import wewillfixyourpc_bot.twilio_client
 from django.conf import settings
 from django.utils import html
-import twilio.base.exceptions
 from django.shortcuts import reverse
 from operator_interface.models import ConversationPlatform, Message
-from . import views
 from . import models
 
 
@@ -33,23 +33,7 @@ def get_platform(msg_from):
 
 
 def attempt_get_user_id(msg_from: str) -> typing.Optional[str]:
-    def match_user(u):
-        numbers = u.user.get("attributes", {}).get("phone", [])
-        for num in numbers:
-            try:
-                num = phonenumbers.parse(num, settings.PHONENUMBER_DEFAULT_REGION)
-            except phonenumbers.NumberParseException:
-                continue
-            if (
-                phonenumbers.format_number(num, phonenumbers.PhoneNumberFormat.E164)
-                == msg_from
-            ):
-                return True
-
-        return False
-
-    user = next(filter(match_user, django_keycloak_auth.users.get_users()), None)
-    return user.user.get("id") if user else None
+    return operator_interface.users.get_user_id_by_phone(msg_from)
 
 
 @shared_task
@@ -65,8 +49,7 @@ def handle_sms(msg_id, msg_from, data):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -100,29 +83,27 @@ def send_message(mid: int):
     else:
         return
 
-    try:
-        requests.post(
-            f"{settings.VSMS_URL}message/new/",
-            headers={
-                "Authorization": f"Bearer {django_keycloak_auth.clients.get_access_token()}"
-            },
-            json={"to": message.platform.platform_id, "contents": msg_body},
-        )
-    except requests.exceptions.RequestException:
-        pass
+    def send_vsms():
+        try:
+            wewillfixyourpc_bot.http_client.post(
+                f"{settings.VSMS_URL}message/new/",
+                headers={
+                    "Authorization": f"Bearer {wewillfixyourpc_bot.keycloak_client.get_access_token_sync()}"
+                },
+                json={"to": message.platform.platform_id, "contents": msg_body},
+            )
+        except requests.exceptions.RequestException:
+            pass
 
-    try:
-        msg_resp = views.twilio_client.messages.create(
+    def send_twilio():
+        msg_resp = wewillfixyourpc_bot.twilio_client.get_client().messages.create(
             to=message.platform.platform_id,
             provide_feedback=True,
             messaging_service_sid=settings.TWILIO_MSID,
             body=msg_body,
             **other_args,
         )
-    except twilio.base.exceptions.TwilioException:
-        message.state = Message.FAILED
+        message.platform_message_id = msg_resp.sid
         message.save()
-        return
 
-    message.platform_message_id = msg_resp.sid
-    message.save()
+    operator_interface.delivery.send_parts(message, [send_vsms, send_twilio])
@@ -6,16 +6,14 @@ from twilio.twiml.messaging_response import MessagingResponse
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 import datetime
-import twilio.rest
 import logging
 from . import tasks
 from . import models
-import operator_interface.tasks
+import operator_interface.outbox
 from operator_interface.models import Message
 
 
 logger = logging.getLogger(__name__)
-twilio_client = twilio.rest.Client(settings.TWILIO_ACCOUNT, settings.TWILIO_TOKEN)
 twilio_validator = RequestValidator(settings.TWILIO_TOKEN)
 
 
@@ -83,8 +81,7 @@ def account_linking(request):
         text="Login complete, thanks!",
         direction=Message.TO_CUSTOMER,
     )
-    message.save()
-    operator_interface.tasks.process_message.delay(message.id)
+    operator_interface.outbox.dispatch(message)
 
     return HttpResponse(
         '<script type="text/javascript">window.close();</script><h1>You can now close this window</h1>'
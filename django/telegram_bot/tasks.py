@@ -1,17 +1,19 @@
 import datetime
 import logging
-from io import BytesIO
 
 import requests
 from celery import shared_task
 from django.conf import settings
-from django.core.files.storage import DefaultStorage
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.shortcuts import reverse
+from django.utils import html
 
 import operator_interface.consumers
+import operator_interface.media
+import operator_interface.outbox
+import operator_interface.profile_refresh
 import operator_interface.tasks
-from operator_interface.models import Conversation, Message
+from operator_interface.models import Conversation, ConversationPlatform, Message
+import wewillfixyourpc_bot.http_client
 
 
 @shared_task
@@ -29,7 +31,9 @@ def handle_telegram_message(message):
     conversation = Conversation.get_or_create_conversation(
         Conversation.TELEGRAM, chat_id, agent_responding=False
     )
-    update_telegram_profile(chat_id, conversation.id)
+    operator_interface.profile_refresh.schedule(
+        update_telegram_profile, ConversationPlatform.TELEGRAM, chat_id, chat_id, conversation.id
+    )
     if not Message.message_exits(conversation, mid):
         message_m = Message(
             conversation=conversation,
@@ -62,43 +66,51 @@ def handle_telegram_message(message):
                 photo = photo[-1]
             else:
                 photo = sticker
-            file = requests.get(
-                f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getFile",
-                json={"file_id": photo["file_id"]},
-            )
-            file.raise_for_status()
-            fs = DefaultStorage()
-            file_name = fs.save(photo["file_id"], BytesIO(file.content))
-
-            message_m.image = fs.base_url + file_name
+            try:
+                message_m.image = ingest_telegram_file(photo["file_id"]).url
+            except operator_interface.media.MediaError as e:
+                logging.warning(f"Couldn't ingest Telegram photo: {e}")
+                return
             if caption:
-                message.text = caption
+                message_m.text = caption
         elif document:
             file_name = document["file_name"] if document.get("file_name") else "File"
-            file = requests.get(
-                f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getFile",
-                json={"file_id": document["file_id"]},
-            )
-            file.raise_for_status()
-            fs = DefaultStorage()
-            file_url = fs.save(photo["file_id"], BytesIO(file.content))
+            try:
+                media = ingest_telegram_file(document["file_id"], file_name)
+            except operator_interface.media.MediaError as e:
+                logging.warning(f"Couldn't ingest Telegram document: {e}")
+                return
             message_m.text = (
-                f'<a href="{fs.base_url + file_url}" target="_blank">{file_name}</a>'
+                f'<a href="{media.url}" target="_blank">{html.conditional_escape(file_name)}</a>'
             )
             if caption:
-                message.text = caption
+                message_m.text += f"\n{html.conditional_escape(caption)}"
         elif contact:
             message_m.text = contact["phone_number"]
         else:
             return
-        message_m.save()
-        operator_interface.tasks.process_message.delay(message_m.id)
+        operator_interface.outbox.dispatch(message_m)
+
+
+def ingest_telegram_file(file_id, name=None):
+    try:
+        r = wewillfixyourpc_bot.http_client.get(
+            f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getFile",
+            json={"file_id": file_id},
+        )
+        r.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise operator_interface.media.MediaError(f"Failed to look up {file_id}: {e}") from e
+    file_path = r.json()["result"]["file_path"]
+    return operator_interface.media.ingest_url(
+        f"https://api.telegram.org/file/bot{settings.TELEGRAM_TOKEN}/{file_path}", name
+    )
 
 
 @shared_task
 def handle_telegram_message_typing_on(cid):
     conversation = Conversation.objects.get(id=cid)
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/sendChatAction",
         json={"chat_id": conversation.platform_id, "action": "typing"},
     )
@@ -124,7 +136,7 @@ def handle_telegram_pre_checkout_query(query):
     if error:
         data["error"] = error
 
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/answerPreCheckoutQuery",
         json=data,
     )
@@ -137,7 +149,7 @@ def handle_telegram_pre_checkout_query(query):
 @shared_task
 def update_telegram_profile(chat_id, cid):
     conversation = Conversation.objects.get(id=cid)
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getChat",
         json={"chat_id": chat_id},
     )
@@ -160,7 +172,7 @@ def update_telegram_profile(chat_id, cid):
         profile_pic = r.get("photo")
 
         if profile_pic:
-            file = requests.get(
+            file = wewillfixyourpc_bot.http_client.get(
                 f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/getFile",
                 json={"file_id": profile_pic["small_file_id"]},
             )
@@ -168,20 +180,14 @@ def update_telegram_profile(chat_id, cid):
             file = file.json()
             if file["ok"]:
                 file = file["result"]
-                file = requests.get(
-                    f"https://api.telegram.org/file/bot{settings.TELEGRAM_TOKEN}/{file['file_path']}"
+                operator_interface.profile_refresh.save_picture(
+                    conversation,
+                    f"https://api.telegram.org/file/bot{settings.TELEGRAM_TOKEN}/{file['file_path']}",
+                    profile_pic["small_file_id"],
                 )
-                if file.status_code == 200:
-                    conversation.conversation_pic = InMemoryUploadedFile(
-                        file=BytesIO(file.content),
-                        size=len(file.content),
-                        charset=file.encoding,
-                        content_type=file.headers.get("content-type"),
-                        field_name=profile_pic["small_file_id"],
-                        name=profile_pic["small_file_id"],
-                    )
         conversation.conversation_name = name
-        conversation.save()
+        conversation.save(update_fields=["conversation_pic", "conversation_name", "updated_at"])
+        operator_interface.profile_refresh.refreshed(ConversationPlatform.TELEGRAM, chat_id)
 
 
 @shared_task
@@ -226,12 +232,15 @@ def send_telegram_message(mid):
                 ]
             }
 
-        r = requests.post(
+        r = wewillfixyourpc_bot.http_client.post(
             f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/{method}", json=data
         )
         if r.status_code != 200 or not r.json()["ok"]:
             logging.error(f"Error sending telegram message: {r.status_code} {r.text}")
-            requests.post(
+            if r.status_code == 429 or r.status_code >= 500:
+                # Transient, so leave it to the outbound retries rather than apologising to the customer
+                r.raise_for_status()
+            wewillfixyourpc_bot.http_client.post(
                 f"https://api.telegram.org/bot{settings.TELEGRAM_TOKEN}/sendMessage",
                 json={
                     "chat_id": message.conversation.platform_id,
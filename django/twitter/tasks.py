@@ -1,26 +1,98 @@
 import logging
 import os
 import re
-import magic
 import time
 import urllib.parse
-from io import BytesIO
 
 import typing
-import requests
 from celery import shared_task
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.core.files.storage import DefaultStorage
 from django.conf import settings
 from django.shortcuts import reverse
 from django.utils import html
+import operator_interface.media
+import operator_interface.outbox
+import operator_interface.profile_refresh
 import operator_interface.tasks
+import operator_interface.users
 import django_keycloak_auth.users
-from operator_interface.models import ConversationPlatform, Message
+from operator_interface.models import Conversation, ConversationPlatform, MediaObject, Message
+import wewillfixyourpc_bot.http_client
 from . import views
 from . import models
 
 
+UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Uploaded media can be attached for 24 hours, leave some slack for a send in flight
+MEDIA_ID_TTL = 60 * 60 * 23
+MEDIA_STATUS_BACKOFF_CAP = 30
+MEDIA_PROCESSING_TIMEOUT = 300
+
+
+def upload_twitter_media(media: MediaObject, creds) -> str:
+    init_r = wewillfixyourpc_bot.http_client.post(
+        UPLOAD_URL,
+        auth=creds,
+        data={
+            "command": "INIT",
+            "total_bytes": media.size,
+            "media_type": media.content_type,
+            "media_category": "DmImage",
+            "shared": "true",
+        },
+    )
+    init_r.raise_for_status()
+    media_id = init_r.json()["media_id_string"]
+
+    with media.open() as f:
+        for segment_index, chunk in enumerate(iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b"")):
+            append_r = wewillfixyourpc_bot.http_client.post(
+                UPLOAD_URL,
+                auth=creds,
+                data={
+                    "command": "APPEND",
+                    "media_id": media_id,
+                    "segment_index": segment_index,
+                },
+                files={"media": chunk},
+            )
+            append_r.raise_for_status()
+
+    finalize_r = wewillfixyourpc_bot.http_client.post(
+        UPLOAD_URL,
+        auth=creds,
+        data={"command": "FINALIZE", "media_id": media_id},
+    )
+    finalize_r.raise_for_status()
+
+    processing_info = finalize_r.json().get("processing_info")
+    deadline = time.monotonic() + MEDIA_PROCESSING_TIMEOUT
+    attempt = 0
+    while processing_info and processing_info["state"] in ("pending", "in_progress"):
+        wait_secs = max(
+            processing_info.get("check_after_secs", 1),
+            min(MEDIA_STATUS_BACKOFF_CAP, 2 ** attempt),
+        )
+        if time.monotonic() + wait_secs > deadline:
+            raise operator_interface.media.MediaError(f"Twitter media {media_id} still processing")
+        time.sleep(wait_secs)
+        attempt += 1
+
+        status_r = wewillfixyourpc_bot.http_client.get(
+            UPLOAD_URL,
+            auth=creds,
+            params={"command": "STATUS", "media_id": media_id},
+        )
+        status_r.raise_for_status()
+        processing_info = status_r.json().get("processing_info")
+
+    if processing_info and processing_info["state"] == "failed":
+        raise operator_interface.media.MediaError(
+            f"Twitter failed to process media {media_id}: {processing_info.get('error')}"
+        )
+    return media_id
+
+
 @shared_task
 def handle_twitter_message(mid: str, psid, message, user):
     text: str = message.get("text")
@@ -30,7 +102,7 @@ def handle_twitter_message(mid: str, psid, message, user):
             ConversationPlatform.TWITTER, psid
         )
         if not platform:
-            kc_user = django_keycloak_auth.users.get_or_create_user(
+            kc_user = operator_interface.users.get_or_create_user(
                 federated_provider="twitter",
                 federated_user_id=user.get("id"),
                 federated_user_name=user.get("screen_name"),
@@ -47,7 +119,7 @@ def handle_twitter_message(mid: str, psid, message, user):
         conversation = platform.conversation
 
         if not conversation.conversation_user_id:
-            kc_user = django_keycloak_auth.users.get_or_create_user(
+            kc_user = operator_interface.users.get_or_create_user(
                 federated_provider="twitter",
                 federated_user_id=user.get("id"),
                 federated_user_name=user.get("screen_name"),
@@ -59,17 +131,9 @@ def handle_twitter_message(mid: str, psid, message, user):
                 )
                 conversation.update_user_id(kc_user.get("id"))
 
-        if conversation.conversation_user_id:
-            django_keycloak_auth.users.link_federated_identity_if_not_exists(
-                str(conversation.conversation_user_id),
-                federated_provider="twitter",
-                federated_user_id=user.get("id"),
-                federated_user_name=user.get("screen_name"),
-            )
-
-            django_keycloak_auth.users.update_user(
-                str(conversation.conversation_user_id), first_name=user.get("name")
-            )
+        operator_interface.profile_refresh.schedule(
+            update_twitter_profile, ConversationPlatform.TWITTER, psid, conversation.id, user, psid
+        )
 
         if not Message.message_exits(platform, mid):
             message_m: Message = Message(
@@ -89,41 +153,46 @@ def handle_twitter_message(mid: str, psid, message, user):
                     indices: typing.Tuple = attachment["media"]["indices"]
                     message_m.text = (text[: indices[0]] + text[indices[1] :]).strip()
 
-                    media_r = requests.get(url, auth=creds)
-                    if media_r.status_code == 200:
-                        orig_file_name = os.path.basename(
-                            urllib.parse.urlparse(url).path
-                        )
-                        fs = DefaultStorage()
-                        file_name = fs.save(orig_file_name, BytesIO(media_r.content))
-                        message_m.image = fs.base_url + file_name
+                    try:
+                        message_m.image = operator_interface.media.ingest_url(url, auth=creds).url
+                    except operator_interface.media.MediaError as e:
+                        logging.warning(f"Couldn't ingest Twitter attachment: {e}")
 
-            message_m.save()
+            operator_interface.outbox.dispatch(message_m)
             handle_mark_twitter_message_read.delay(psid, mid)
-            operator_interface.tasks.process_message.delay(message_m.id)
 
-        file_name = os.path.basename(
-            urllib.parse.urlparse(user["profile_image_url_https"]).path
+
+@shared_task
+def update_twitter_profile(cid, user: dict, psid=None):
+    conversation = Conversation.objects.get(id=cid)
+
+    file_name = os.path.basename(
+        urllib.parse.urlparse(user["profile_image_url_https"]).path
+    )
+    pic_changed = operator_interface.profile_refresh.save_picture(
+        conversation, user["profile_image_url_https"], file_name
+    )
+    conversation.save(update_fields=["conversation_pic", "updated_at"])
+
+    if conversation.conversation_user_id:
+        django_keycloak_auth.users.link_federated_identity_if_not_exists(
+            str(conversation.conversation_user_id),
+            federated_provider="twitter",
+            federated_user_id=user.get("id"),
+            federated_user_name=user.get("screen_name"),
         )
-        r = requests.get(user["profile_image_url_https"])
-        if r.status_code == 200:
-            if not conversation.conversation_pic:
-                conversation.conversation_pic.save(
-                    file_name,
-                    InMemoryUploadedFile(
-                        file=BytesIO(r.content),
-                        size=len(r.content),
-                        charset=r.encoding,
-                        content_type=r.headers.get("content-type"),
-                        field_name=file_name,
-                        name=file_name,
-                    ),
-                )
-            django_keycloak_auth.users.update_user(
+
+        operator_interface.users.update_user(
+            str(conversation.conversation_user_id), first_name=user.get("name")
+        )
+        if pic_changed:
+            operator_interface.users.update_user(
                 str(conversation.conversation_user_id),
                 profile_picture=conversation.conversation_pic.url,
             )
-            conversation.save()
+
+    if psid is not None:
+        operator_interface.profile_refresh.refreshed(ConversationPlatform.TWITTER, psid)
 
 
 @shared_task
@@ -161,7 +230,7 @@ def handle_twitter_typing(psid: str):
 @shared_task
 def handle_mark_twitter_message_read(psid: str, mid: str):
     creds = views.get_creds()
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://api.twitter.com/1.1/direct_messages/mark_read.json",
         data={"last_read_event_id": mid, "recipient_id": psid},
         auth=creds,
@@ -172,7 +241,7 @@ def handle_mark_twitter_message_read(psid: str, mid: str):
 def handle_twitter_message_typing_on(cid: int):
     creds = views.get_creds()
     platform = ConversationPlatform.objects.get(id=cid)
-    requests.post(
+    wewillfixyourpc_bot.http_client.post(
         "https://api.twitter.com/1.1/direct_messages/indicate_typing.json",
         data={"recipient_id": platform.platform_id},
         auth=creds,
@@ -258,82 +327,26 @@ def send_twitter_message(mid: int):
             ]
 
     if message.image:
-        image = requests.get(message.image)
-        image.raise_for_status()
-        image = image.content
-        mime = magic.from_buffer(image, mime=True)
-
-        init_r = requests.post(
-            "https://upload.twitter.com/1.1/media/upload.json",
-            auth=creds,
-            data={
-                "command": "INIT",
-                "total_bytes": len(image),
-                "media_type": mime,
-                "media_category": "DmImage",
-            },
-        )
-        init_r.raise_for_status()
-        media_id = init_r.json()["media_id"]
-
-        append_r = requests.post(
-            "https://upload.twitter.com/1.1/media/upload.json",
-            auth=creds,
-            files={
-                "command": "APPEND",
-                "media_id": media_id,
-                "segment_index": 0,
-                "media": image,
-            },
+        media = operator_interface.media.resolve(message.image)
+        media_id = operator_interface.media.provider_media_id(
+            ConversationPlatform.TWITTER, media, lambda: upload_twitter_media(media, creds), MEDIA_ID_TTL
         )
-        append_r.raise_for_status()
-
-        finalize_r = requests.post(
-            "https://upload.twitter.com/1.1/media/upload.json",
-            auth=creds,
-            data={"command": "FINALIZE", "media_id": media_id},
-        )
-        finalize_r.raise_for_status()
-        finalize_r = finalize_r.json()
-
-        uploaded = True
-        wait_secs = 1
-
-        if finalize_r.get("processing_info"):
-            uploaded = False
-            wait_secs = finalize_r["processing_info"]["check_after_secs"]
-
-        while not uploaded:
-            time.sleep(wait_secs)
-            status_r = requests.post(
-                "https://upload.twitter.com/1.1/media/upload.json",
-                auth=creds,
-                data={"command": "STATUS", "media_id": media_id},
-            )
-            status_r.raise_for_status()
-            status_r = finalize_r.json()
-            processing_info = status_r["processing_info"]
-            if processing_info["state"] == "succeded":
-                uploaded = True
-            else:
-                wait_secs = processing_info["check_after_secs"]
 
         request_body["event"]["message_create"]["message_data"]["attachment"] = {
             "type": "media",
             "media": {"id": media_id},
         }
 
-    r = requests.post(
+    r = wewillfixyourpc_bot.http_client.post(
         "https://api.twitter.com/1.1/direct_messages/events/new.json",
         auth=creds,
         json=request_body,
     )
     if r.status_code != 200:
         logging.error(f"Error sending twitter message: {r.status_code} {r.text}")
-        message.state = Message.FAILED
-        message.save()
-    else:
-        r = r.json()
-        message.platform_message_id = r["event"]["id"]
-        message.state = Message.DELIVERED
-        message.save()
+    r.raise_for_status()
+
+    r = r.json()
+    message.platform_message_id = r["event"]["id"]
+    message.state = Message.DELIVERED
+    message.save()
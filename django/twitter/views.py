@@ -5,7 +5,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
 from django.utils import timezone
-import operator_interface.tasks
+import operator_interface.outbox
 import json
 import hashlib
 import hmac
@@ -216,8 +216,7 @@ def account_linking(request):
         text="Login complete, thanks!",
         direction=Message.TO_CUSTOMER,
     )
-    message.save()
-    operator_interface.tasks.process_message.delay(message.id)
+    operator_interface.outbox.dispatch(message)
 
     return HttpResponse(
         '<script type="text/javascript">window.close();</script><h1>You can now close this window</h1>'
@@ -0,0 +1,39 @@
+import asyncio
+import atexit
+import typing
+
+import aiohttp
+
+TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+_sessions: typing.Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # Sync callers get a new loop from async_to_sync each call, so close what those left behind
+        for other in [other for other in _sessions if other.is_closed()]:
+            loop.create_task(_sessions.pop(other).close())
+        session = aiohttp.ClientSession(timeout=TIMEOUT)
+        _sessions[loop] = session
+    return session
+
+
+async def close_session() -> None:
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+@atexit.register
+def _close_sessions() -> None:
+    while _sessions:
+        loop, session = _sessions.popitem()
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        elif loop.is_closed():
+            asyncio.run(session.close())
+        else:
+            loop.run_until_complete(session.close())
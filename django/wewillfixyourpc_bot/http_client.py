@@ -0,0 +1,137 @@
+import atexit
+import bisect
+import collections
+import os
+import threading
+import time
+import typing
+import urllib.parse
+
+import redis.exceptions
+import requests
+import requests.adapters
+import urllib3.util.retry
+from django.conf import settings
+
+import wewillfixyourpc_bot.redis_client
+
+REDIS_STATS_KEY = "http_client_stats"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATS_FLUSH_INTERVAL = 10
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+stats = collections.Counter()
+_pending = collections.Counter()
+_pending_pid = None
+_last_flush = 0.0
+_stats_lock = threading.Lock()
+
+
+def _bucket(elapsed: float) -> str:
+    i = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+    return f"le_{LATENCY_BUCKETS[i]}" if i < len(LATENCY_BUCKETS) else "le_inf"
+
+
+def flush_stats() -> None:
+    global _last_flush
+    with _stats_lock:
+        events = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not events:
+        return
+    try:
+        pipe = wewillfixyourpc_bot.redis_client.get_client().pipeline(transaction=False)
+        for event, count in events.items():
+            pipe.hincrby(REDIS_STATS_KEY, event, count)
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+atexit.register(flush_stats)
+
+
+def _record(host: str, elapsed: float, outcome: str) -> None:
+    global _pending_pid
+    events = [f"{host}:requests", f"{host}:{_bucket(elapsed)}", f"{host}:{outcome}"]
+    # Counted in process and flushed every STATS_FLUSH_INTERVAL seconds, a Redis round trip on
+    # every request costs more than the requests being measured
+    with _stats_lock:
+        if _pending_pid != os.getpid():
+            # Counts pending when a worker was forked are the parent's to flush
+            _pending.clear()
+            _pending_pid = os.getpid()
+        for event in events:
+            stats[event] += 1
+            _pending[event] += 1
+        due = time.monotonic() - _last_flush >= STATS_FLUSH_INTERVAL
+    if due:
+        flush_stats()
+
+
+class Session(requests.Session):
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+        host = urllib.parse.urlsplit(url).netloc
+        start = time.monotonic()
+        try:
+            r = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _record(host, time.monotonic() - start, f"error_{type(e).__name__}")
+            raise
+        _record(host, time.monotonic() - start, f"status_{r.status_code // 100}xx")
+        return r
+
+
+def get_session() -> Session:
+    global _session, _session_pid
+    # Connection pools can't be shared across a fork, so each Celery worker process gets its own
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                    max_retries=urllib3.util.retry.Retry(
+                        total=settings.HTTP_RETRIES,
+                        backoff_factor=0.2,
+                        status_forcelist=(502, 503, 504),
+                        raise_on_status=False,
+                    ),
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                _session_pid = os.getpid()
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def get_stats() -> typing.Dict[str, typing.Dict[str, int]]:
+    flush_stats()
+    try:
+        shared = wewillfixyourpc_bot.redis_client.get_client().hgetall(REDIS_STATS_KEY)
+        shared = {k.decode(): int(v) for k, v in shared.items()}
+    except redis.exceptions.RedisError:
+        shared = dict(stats)
+
+    hosts = {}
+    for key, value in shared.items():
+        host, event = key.rsplit(":", 1)
+        hosts.setdefault(host, {})[event] = value
+    return hosts
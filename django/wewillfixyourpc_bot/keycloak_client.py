@@ -0,0 +1,63 @@
+import asyncio
+
+import aiohttp
+import keycloak.exceptions
+import requests
+from django.conf import settings
+
+import wewillfixyourpc_bot.aiohttp_client
+import wewillfixyourpc_bot.http_client
+import wewillfixyourpc_bot.token_cache
+
+
+def _realm_url(path: str) -> str:
+    return f"{settings.KEYCLOAK_SERVER_URL}/auth/realms/{settings.KEYCLOAK_REALM}/{path}"
+
+
+def _admin_url(path: str) -> str:
+    return f"{settings.KEYCLOAK_SERVER_URL}/auth/admin/realms/{settings.KEYCLOAK_REALM}/{path}"
+
+
+def _token_request() -> dict:
+    return {
+        "grant_type": "client_credentials",
+        "client_id": settings.OIDC_CLIENT_ID,
+        "client_secret": settings.OIDC_CLIENT_SECRET,
+        "scope": "realm-management openid",
+    }
+
+
+def _fetch_access_token() -> dict:
+    r = wewillfixyourpc_bot.http_client.post(
+        _realm_url("protocol/openid-connect/token"),
+        data=_token_request(),
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+def get_access_token_sync() -> str:
+    try:
+        return wewillfixyourpc_bot.token_cache.get_token("keycloak", _fetch_access_token)
+    except requests.exceptions.RequestException as e:
+        raise keycloak.exceptions.KeycloakClientError(e)
+
+
+async def get_access_token() -> str:
+    try:
+        return await wewillfixyourpc_bot.token_cache.get_token_async("keycloak", _fetch_access_token)
+    except requests.exceptions.RequestException as e:
+        raise keycloak.exceptions.KeycloakClientError(e)
+
+
+async def get_user(user_id: str) -> dict:
+    access_token = await get_access_token()
+    try:
+        async with wewillfixyourpc_bot.aiohttp_client.get_session().get(
+                _admin_url(f"users/{user_id}"),
+                headers={"Authorization": f"Bearer {access_token}"},
+        ) as r:
+            r.raise_for_status()
+            return await r.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise keycloak.exceptions.KeycloakClientError(e)
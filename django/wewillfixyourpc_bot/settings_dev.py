@@ -156,10 +156,113 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 PHONENUMBER_DEFAULT_REGION = "GB"
 
+REDIS_URL = "redis://localhost"
+
+KEYCLOAK_PROFILE_CACHE_TTL = 300
+KEYCLOAK_PROFILE_CACHE_LOCAL_TTL = 30
+KEYCLOAK_PROFILE_CACHE_SIZE = 1024
+
+OPERATOR_INTERFACE_DEBOUNCE_MS = 100
+
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 20
+HTTP_RETRIES = 3
+HTTP_POOL_CONNECTIONS = 20
+HTTP_POOL_MAXSIZE = 20
+
+# (messages, seconds) per platform account and per recipient, sends over the limit are delayed
+OUTBOUND_RATE_LIMITS = {
+    "FB": {"platform": (250, 1), "recipient": (5, 1)},
+    "TW": {"platform": (1000, 86400), "recipient": (5, 1)},
+    "TG": {"platform": (30, 1), "recipient": (3, 3)},
+    "TX": {"platform": (1, 1)},
+    "WA": {"platform": (80, 1), "recipient": (5, 1)},
+    "AS": {"platform": (20, 1), "recipient": (5, 1)},
+}
+
+# Failed sends are retried with jittered exponential backoff before being dead-lettered
+OUTBOUND_MAX_ATTEMPTS = 6
+OUTBOUND_RETRY_BASE = 2
+OUTBOUND_RETRY_CAP = 300
+
+# Entries the post-commit publish missed are relayed by the relay-outbox command after the grace period
+OUTBOX_RELAY_INTERVAL = 1
+OUTBOX_RELAY_GRACE = 5
+OUTBOX_RELAY_BATCH_SIZE = 100
+
+# Inbound messages handed to Rasa are handled one at a time per conversation, in arrival order
+INBOUND_ORDERING = True
+INBOUND_LOCK_TIMEOUT = 60
+INBOUND_LOCK_WAIT = 30
+
+# Channel profiles (name, picture) are refreshed at most once per TTL seconds per customer
+PROFILE_REFRESH_TTL = 21600
+
+# Largest attachment in bytes accepted from a channel
+MEDIA_MAX_SIZE = 26214400
+
+# Service access tokens are refreshed in the background this many seconds before they expire,
+# and never handed out within the margin of their expiry
+TOKEN_REFRESH_AHEAD = 300
+TOKEN_EXPIRY_MARGIN = 30
+
+# Queue for each class of task, classes can share a queue to run them on fewer workers.
+# Anything not listed in TASK_CLASSES, such as inbound message handling, goes to ingest.
+TASK_QUEUES = {
+    "ingest": "ingest",
+    "outbound": "outbound",
+    "interface": "interface",
+    "enrichment": "enrichment",
+    "notifications": "notifications",
+}
+TASK_CLASSES = {
+    "interface": [
+        "operator_interface.tasks.send_message_to_interface",
+        "operator_interface.tasks.send_interface_event",
+    ],
+    "outbound": [
+        "operator_interface.tasks.send_outbound_message",
+        "operator_interface.tasks.process_typing_on",
+        "operator_interface.tasks.process_typing_off",
+        "*.tasks.send_message",
+        "facebook.tasks.send_facebook_message",
+        "facebook.tasks.handle_mark_facebook_message_read",
+        "facebook.tasks.handle_facebook_message_typing_on",
+        "facebook.tasks.handle_facebook_message_typing_off",
+        "twitter.tasks.send_twitter_message",
+        "twitter.tasks.handle_mark_twitter_message_read",
+        "twitter.tasks.handle_twitter_message_typing_on",
+        "telegram_bot.tasks.send_telegram_message",
+        "telegram_bot.tasks.handle_telegram_message_typing_on",
+        "azure_bot.tasks.send_azure_message",
+        "apple_business_chat.tasks.handle_abc_typing_on",
+        "apple_business_chat.tasks.handle_abc_typing_off",
+        "as207960.tasks.handle_as207960_typing_on",
+        "as207960.tasks.handle_as207960_typing_off",
+        "whatsapp.tasks.attempt_alternative_delivery",
+    ],
+    "enrichment": [
+        "operator_interface.tasks.extract_entities_from_message",
+        "facebook.tasks.update_facebook_profile",
+        "telegram_bot.tasks.update_telegram_profile",
+        "twitter.tasks.update_twitter_profile",
+    ],
+    "notifications": [
+        "operator_interface.tasks.send_push_notification",
+        "operator_interface.tasks.send_message_notifications",
+    ],
+}
+
 CELERY_RESULT_BACKEND = "redis://localhost"
 CELERY_BROKER_URL = "pyamqp://"
 CELERY_TASK_SERIALIZER = "json"
 CELERY_ACCEPT_CONTENT = ["json"]
+CELERY_TASK_DEFAULT_QUEUE = TASK_QUEUES["ingest"]
+CELERY_TASK_ROUTES = {
+    task: {"queue": TASK_QUEUES[task_class]}
+    for task_class, tasks in TASK_CLASSES.items()
+    for task in tasks
+}
 
 with open(os.path.join(BASE_DIR, "secrets/facebook.json")) as f:
     facebook_conf = json.load(f)
@@ -0,0 +1,159 @@
+import collections
+import logging
+import threading
+import time
+import typing
+
+import redis.exceptions
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+import wewillfixyourpc_bot.redis_client
+
+REDIS_KEY = "access_token:{}"
+LOCK_KEY = "access_token_lock:{}"
+REDIS_STATS_KEY = "token_cache_stats"
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 15
+
+logger = logging.getLogger(__name__)
+
+Fetcher = typing.Callable[[], dict]
+
+
+class Token(typing.NamedTuple):
+    token: str
+    refresh_at: float
+    expires_at: float
+
+    @classmethod
+    def from_response(cls, data: dict) -> "Token":
+        now = time.time()
+        lifetime = max(int(data["expires_in"]) - settings.TOKEN_EXPIRY_MARGIN, 0)
+        return cls(
+            token=data["access_token"],
+            refresh_at=now + lifetime - min(settings.TOKEN_REFRESH_AHEAD, lifetime / 2),
+            expires_at=now + lifetime,
+        )
+
+    @property
+    def valid(self) -> bool:
+        return time.time() < self.expires_at
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.refresh_at
+
+
+_cache: typing.Dict[str, Token] = {}
+_refresh_locks = collections.defaultdict(threading.Lock)
+stats = collections.Counter()
+
+
+def _record(audience: str, event: str) -> None:
+    stats[f"{audience}:{event}"] += 1
+    try:
+        wewillfixyourpc_bot.redis_client.get_client().hincrby(REDIS_STATS_KEY, f"{audience}:{event}", 1)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _get_shared(client: redis.Redis, audience: str) -> typing.Optional[Token]:
+    try:
+        cached = client.hgetall(REDIS_KEY.format(audience))
+    except redis.exceptions.RedisError:
+        return None
+    if not cached:
+        return None
+    return Token(
+        token=cached[b"token"].decode(),
+        refresh_at=float(cached[b"refresh_at"]),
+        expires_at=float(cached[b"expires_at"]),
+    )
+
+
+def _set_shared(client: redis.Redis, audience: str, token: Token) -> None:
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(REDIS_KEY.format(audience), mapping=token._asdict())
+        pipe.expireat(REDIS_KEY.format(audience), int(token.expires_at))
+        pipe.execute()
+    except redis.exceptions.RedisError:
+        pass
+
+
+def _refresh(audience: str, fetch: Fetcher) -> Token:
+    # One refresh per audience in this process, and the Redis lock makes it one across all
+    # processes; whoever waited on either picks up the token the holder stored
+    with _refresh_locks[audience]:
+        token = _cache.get(audience)
+        if token and token.fresh:
+            return token
+
+        client = wewillfixyourpc_bot.redis_client.get_client()
+        lock = client.lock(LOCK_KEY.format(audience), timeout=LOCK_TIMEOUT, blocking_timeout=LOCK_WAIT)
+        try:
+            acquired = lock.acquire()
+        except redis.exceptions.RedisError:
+            acquired = False
+
+        try:
+            token = _get_shared(client, audience)
+            if token is None or not token.fresh:
+                token = Token.from_response(fetch())
+                _set_shared(client, audience, token)
+                _record(audience, "refresh")
+            _cache[audience] = token
+            return token
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except redis.exceptions.RedisError:
+                    pass
+
+
+def _refresh_quietly(audience: str, fetch: Fetcher) -> None:
+    try:
+        _refresh(audience, fetch)
+    except Exception:
+        _record(audience, "refresh_error")
+        logger.warning(f"Failed to refresh {audience} access token ahead of expiry", exc_info=True)
+
+
+def _refresh_ahead(audience: str, fetch: Fetcher) -> None:
+    if _refresh_locks[audience].locked():
+        return
+    threading.Thread(target=_refresh_quietly, args=(audience, fetch), daemon=True).start()
+
+
+def get_token(audience: str, fetch: Fetcher) -> str:
+    token = _cache.get(audience)
+    if token is None or not token.valid:
+        token = _get_shared(wewillfixyourpc_bot.redis_client.get_client(), audience)
+        if token is not None and token.valid:
+            _cache[audience] = token
+
+    if token is None or not token.valid:
+        _record(audience, "miss")
+        return _refresh(audience, fetch).token
+
+    # Still usable but close to expiry, so hand it out and fetch the next one off the request path
+    if not token.fresh:
+        _refresh_ahead(audience, fetch)
+    return token.token
+
+
+async def get_token_async(audience: str, fetch: Fetcher) -> str:
+    token = _cache.get(audience)
+    if token is not None and token.fresh:
+        return token.token
+    return await sync_to_async(get_token, thread_sensitive=False)(audience, fetch)
+
+
+def invalidate(audience: str) -> None:
+    _cache.pop(audience, None)
+    try:
+        wewillfixyourpc_bot.redis_client.get_client().delete(REDIS_KEY.format(audience))
+    except redis.exceptions.RedisError:
+        pass
@@ -0,0 +1,11 @@
+import twilio.rest
+from django.conf import settings
+
+_client = None
+
+
+def get_client() -> twilio.rest.Client:
+    global _client
+    if _client is None:
+        _client = twilio.rest.Client(settings.TWILIO_ACCOUNT, settings.TWILIO_TOKEN)
+    return _client
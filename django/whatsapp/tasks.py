@@ -1,17 +1,17 @@
 from celery import shared_task
 import typing
 import json
-import phonenumbers
 import operator_interface.consumers
+import operator_interface.delivery
+import operator_interface.outbox
 import operator_interface.tasks
-import django_keycloak_auth.users
+import operator_interface.users
 import django_keycloak_auth.clients
 from django.conf import settings
 from django.utils import html
-import twilio.base.exceptions
 from django.shortcuts import reverse
 from operator_interface.models import ConversationPlatform, Message
-from . import views
+import wewillfixyourpc_bot.twilio_client
 from . import models
 
 
@@ -32,23 +32,7 @@ def get_platform(msg_from):
 
 
 def attempt_get_user_id(msg_from: str) -> typing.Optional[str]:
-    def match_user(u):
-        numbers = u.user.get("attributes", {}).get("phone", [])
-        for num in numbers:
-            try:
-                num = phonenumbers.parse(num, settings.PHONENUMBER_DEFAULT_REGION)
-            except phonenumbers.NumberParseException:
-                continue
-            if (
-                phonenumbers.format_number(num, phonenumbers.PhoneNumberFormat.E164)
-                == msg_from
-            ):
-                return True
-
-        return False
-
-    user = next(filter(match_user, django_keycloak_auth.users.get_users()), None)
-    return user.user.get("id") if user else None
+    return operator_interface.users.get_user_id_by_phone(msg_from)
 
 
 @shared_task
@@ -64,8 +48,7 @@ def handle_whatsapp(msg_id, msg_from, data):
                 direction=Message.FROM_CUSTOMER,
                 state=Message.DELIVERED,
             )
-            message_m.save()
-            operator_interface.tasks.process_message.delay(message_m.id)
+            operator_interface.outbox.dispatch(message_m)
 
 
 @shared_task
@@ -94,20 +77,17 @@ def send_message(mid: int):
     else:
         return
 
-    try:
-        msg_resp = views.twilio_client.messages.create(
+    def send_twilio():
+        msg_resp = wewillfixyourpc_bot.twilio_client.get_client().messages.create(
             to=f"whatsapp:{message.platform.platform_id}",
             provide_feedback=True,
             from_=f"whatsapp:{settings.TWILIO_WHATSAPP_NUMBER}",
             body=msg_body,
         )
-    except twilio.base.exceptions.TwilioException:
-        message.state = Message.FAILED
+        message.platform_message_id = msg_resp.sid
         message.save()
-        return
 
-    message.platform_message_id = msg_resp.sid
-    message.save()
+    operator_interface.delivery.send_parts(message, [send_twilio])
 
 
 @shared_task
@@ -142,7 +122,7 @@ def attempt_alternative_delivery(mid: int):
         info["already_tried"] = already_tried
         platform.additional_platform_data = json.dumps(info)
         platform.save()
-        send_message.delay(mid)
+        operator_interface.tasks.queue_outbound_message(platform, mid)
     else:
         info["already_tried"] = []
         new_platform = None
@@ -156,14 +136,13 @@ def attempt_alternative_delivery(mid: int):
             except ConversationPlatform.DoesNotExist:
                 pass
         if not new_platform:
-            new_platform = ConversationPlatform(
+            new_platform = ConversationPlatform.create(
+                ConversationPlatform.SMS,
+                platform.platform_id,
                 conversation=platform.conversation,
-                platform=ConversationPlatform.SMS,
-                platform_id=platform.platform_id,
-                additional_platform_data=json.dumps(info)
+                additional_platform_data=json.dumps(info),
             )
-            new_platform.save()
 
         message.platform = new_platform
         message.save()
-        send_message.delay(message.id)
+        operator_interface.tasks.queue_outbound_message(new_platform, message.id)